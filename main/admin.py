@@ -1,8 +1,46 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Count
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
+from .forms import RepriceForm
+from .repricing import RepricingError, reprice
 from .models import Drink, DrinkSize, Category, RomaPizza, Toppings, Pizza, Combo, ComboDrink, ComboPizza, ComboRomaPizza, ActionImage, ActionGallery
 # Register your models here.
 
+
+def reprice_action(rules):
+    """Действие «изменить цены»: промежуточная страница с diff, затем один UPDATE"""
+
+    def action(modeladmin, request, queryset):
+        submitted = "preview" in request.POST or "apply" in request.POST
+        form = RepriceForm(request.POST if submitted else None, rules=rules)
+        diff = None
+        if form.is_valid():
+            rule, args = form.rule_args()
+            try:
+                diff = reprice(queryset, rule, *args, dry_run="apply" not in request.POST)
+            except RepricingError as exc:
+                form.add_error(None, str(exc))
+            else:
+                if "apply" in request.POST:
+                    modeladmin.message_user(request, f"Изменено позиций: {len(diff)}", messages.SUCCESS)
+                    return None
+
+        return TemplateResponse(request, "admin/main/reprice.html", {
+            **modeladmin.admin_site.each_context(request),
+            "title": "Изменение цен",
+            "opts": modeladmin.model._meta,
+            "action": "reprice",
+            "queryset": queryset,
+            "form": form,
+            "diff": diff,
+        })
+
+    action.__name__ = "reprice"
+    action.short_description = "Изменить цены выбранных"
+    return action
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name']
@@ -22,6 +60,7 @@ class DrinkAdmin(admin.ModelAdmin):
 @admin.register(Toppings)
 class ToppingsAdmin(admin.ModelAdmin):
     list_display = ['name', 'price', 'is_active', 'top_category']
+    actions = [reprice_action(['percent', 'round'])]
 
 @admin.register(RomaPizza)
 class RomaPizzaAdmin(admin.ModelAdmin):
@@ -34,12 +73,13 @@ class RomaPizzaAdmin(admin.ModelAdmin):
 
 @admin.register(Pizza)
 class PizzaAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'base_price_s', 'is_active', 'new', 'auto_calculate']
+    list_display = ['name', 'category', 'base_price_s', 'is_active', 'is_available', 'new', 'auto_calculate']
     list_filter = ['category', 'is_active', 'new', 'auto_calculate']
     filter_horizontal = ['toppings']
     list_editable = ['is_active', 'new', 'auto_calculate']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
+    actions = [reprice_action(['percent', 'round', 'multiplier'])]
     
     fieldsets = [
         ('Основная информация', {
@@ -79,15 +119,53 @@ class PizzaAdmin(admin.ModelAdmin):
         js = ('admin/js/pizza_admin.js',)
         css = {'all': ('admin/css/pizza_admin.css',)}
 
-class ComboDrinkInline(admin.TabularInline):
+class SharedChoicesInlineMixin:
+    """
+    Инлайны без запросов на строку: список выбора FK считается один раз за
+    запрос (get_formset вызывается админкой многократно), а связи из __str__
+    строк подтягиваются select_related
+    """
+
+    choice_select_related = {}
+    row_select_related = []
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.row_select_related)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        related = self.choice_select_related.get(db_field.name)
+        if related:
+            kwargs['queryset'] = db_field.related_model.objects.select_related(*related)
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        # Ссылку на родителя формсет всё равно заменяет скрытым полем
+        if formfield is None or db_field.related_model is self.parent_model:
+            return formfield
+
+        cache = request.__dict__.setdefault('_inline_choices', {})
+        key = (self.model, db_field.name)
+        if key not in cache:
+            cache[key] = list(formfield.choices)
+        formfield.choices = cache[key]
+        return formfield
+
+
+class ComboDrinkInline(SharedChoicesInlineMixin, admin.TabularInline):
     model = ComboDrink
     extra = 0  
     min_num = 0  
+    choice_select_related = {'drink_size': ['drink']}
+    row_select_related = ['drink_size__drink']
 
-class ComboPizzaInline(admin.TabularInline):
+class ComboPizzaInline(SharedChoicesInlineMixin, admin.TabularInline):
     model = ComboPizza
     extra = 0
 
+    def get_queryset(self, request):
+        # Цена размера считается в SQL тем же выражением, что и Combo.items_price
+        return super().get_queryset(request).annotate(
+            unit_price=ComboPizza.objects.unit_price_expression()
+        )
+
     def get_formset(self, request, obj=None, **kwargs):
         formset = super().get_formset(request, obj, **kwargs)
 
@@ -95,16 +173,17 @@ class ComboPizzaInline(admin.TabularInline):
             def __init__(self, *args, **kwargs):
                 super().__init__(*args, **kwargs)
 
-                if self.instance.pk and self.instance.pizza:
-                    price = self.instance.pizza.get_price_for_size(self.instance.size)
+                if self.instance.pk and self.instance.pizza_id:
+                    price = self.instance.unit_price
                     self.fields['pizza'].widget.attrs['data-price'] = price
 
         formset.form = Form
         return formset
 
 
-class ComboRomaPizzaInline(admin.TabularInline):
+class ComboRomaPizzaInline(SharedChoicesInlineMixin, admin.TabularInline):
     model = ComboRomaPizza
+    row_select_related = ['roman_pizza']
     extra = 0  
     min_num = 0  
 
@@ -136,13 +215,13 @@ class ComboAdmin(admin.ModelAdmin):
     class Media:
         js = ('admin/js/combo_admin.js',)
 
-    def items_price(self, obj):
-        return obj.get_items_price()
-    items_price.short_description = "Цена позиций без скидок"
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_final_price()
 
     def final_price(self, obj):
-        return obj.get_final_price()
+        return obj.final_price_value
     final_price.short_description = "Итоговая цена"
+    final_price.admin_order_field = 'final_price_value'
 
 
 class ActionImageInline(admin.TabularInline):
@@ -161,7 +240,11 @@ class ActionImageInline(admin.TabularInline):
 class ActionGalleryAdmin(admin.ModelAdmin):
     inlines = [ActionImageInline]
     list_display = ['title', 'image_count']
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(image_total=Count('images'))
+
     def image_count(self, obj):
-        return obj.images.count()
-    image_count.short_description = "Кол-во изображений"
\ No newline at end of file
+        return obj.image_total
+    image_count.short_description = "Кол-во изображений"
+    image_count.admin_order_field = 'image_total'
@@ -0,0 +1,109 @@
+from django.db.models import BooleanField, Exists, ExpressionWrapper, F, OuterRef, Q
+
+from .models import (
+    PIZZA_SIZE_SUFFIXES,
+    Combo,
+    ComboDrink,
+    ComboPizza,
+    ComboRomaPizza,
+    Pizza,
+    RomaPizza,
+)
+
+
+def _flag(condition):
+    return ExpressionWrapper(condition, output_field=BooleanField())
+
+
+def pizza_expression():
+    """Пицца активна и в её составе нет топпингов из стоп-листа"""
+    stopped = Pizza.toppings.through.objects.filter(
+        pizza=OuterRef("pk"), toppings__is_active=False
+    )
+    return _flag(Q(is_active=True) & ~Exists(stopped))
+
+
+def roma_expression():
+    stopped = RomaPizza.toppings.through.objects.filter(
+        romapizza=OuterRef("pk"), toppings__is_active=False
+    )
+    return _flag(~Exists(stopped))
+
+
+def _size_missing():
+    """Размера строки комбо у пиццы нет (как в Pizza.get_available_sizes)"""
+    return Q(
+        *[
+            Q(size=size, **{f"pizza__price_multiplier_{suffix}__lte": 0})
+            for size, suffix in PIZZA_SIZE_SUFFIXES.items()
+        ],
+        _connector=Q.OR,
+    )
+
+
+def combo_expression():
+    """
+    Все пиццы комбо в продаже в нужном размере, все римские пиццы в продаже,
+    размеры напитков не удалены (строка остаётся с пустым drink_size)
+    и в комбо есть хотя бы одна позиция
+    """
+    items = {
+        model: model.objects.filter(combo=OuterRef("pk"))
+        for model in (ComboPizza, ComboRomaPizza, ComboDrink)
+    }
+    broken_pizzas = items[ComboPizza].filter(
+        Q(pizza__is_available=False) | _size_missing()
+    )
+    broken_romas = items[ComboRomaPizza].filter(roman_pizza__is_available=False)
+    broken_drinks = items[ComboDrink].filter(drink_size__isnull=True)
+    return _flag(
+        ~Exists(broken_pizzas)
+        & ~Exists(broken_romas)
+        & ~Exists(broken_drinks)
+        & (Exists(items[ComboPizza]) | Exists(items[ComboRomaPizza]) | Exists(items[ComboDrink]))
+    )
+
+
+def _recompute(queryset, expression):
+    """
+    Флаг is_available для набора строк: один SELECT тех, у кого он меняется,
+    и один UPDATE по ним. Возвращает pk изменившихся строк
+    """
+    changed = list(
+        queryset.annotate(available_now=expression)
+        .exclude(is_available=F("available_now"))
+        .values_list("pk", flat=True)
+    )
+    if changed:
+        queryset.model.objects.filter(pk__in=changed).update(is_available=expression)
+    return changed
+
+
+def _scope(model, ids):
+    return model.objects.all() if ids is None else model.objects.filter(pk__in=ids)
+
+
+def refresh(pizza_ids=None, roma_ids=None, combo_ids=()):
+    """
+    Пересчитывает доступность пицц и римских пицц из наборов (None — все),
+    затем комбо из combo_ids и тех, где доступность позиции поменялась.
+    Возвращает {"pizzas": [...], "romas": [...], "combos": [...]} изменившихся pk
+    """
+    changed = {"pizzas": [], "romas": [], "combos": []}
+    if pizza_ids is None or pizza_ids:
+        changed["pizzas"] = _recompute(_scope(Pizza, pizza_ids), pizza_expression())
+    if roma_ids is None or roma_ids:
+        changed["romas"] = _recompute(_scope(RomaPizza, roma_ids), roma_expression())
+
+    if pizza_ids is None and roma_ids is None:
+        combos = Combo.objects.all()
+    else:
+        combos = Combo.objects.filter(
+            Q(pk__in=list(combo_ids))
+            | Q(pk__in=ComboPizza.objects.filter(pizza__in=changed["pizzas"]).values("combo"))
+            | Q(pk__in=ComboRomaPizza.objects.filter(roman_pizza__in=changed["romas"]).values("combo"))
+        )
+        if not (combo_ids or changed["pizzas"] or changed["romas"]):
+            return changed
+    changed["combos"] = _recompute(combos, combo_expression())
+    return changed
@@ -0,0 +1,314 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory, Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import home, response_cache, snapshot, views
+from .catalog import SORT_ORDERINGS
+from .models import Category
+from .instrumentation import QueryRecorder
+from .synthetic import generate_menu, remove_menu
+
+
+LOCAL_BACKEND = "main.response_cache.LocalLRUBackend"
+
+
+@contextmanager
+def isolated_caches():
+    """
+    Кэш ответов, данные главной и файл снимка каталога на время замера —
+    в памяти процесса и во временном каталоге: меню бенчмарка не попадает
+    в общий кэш и в снимок, который читают воркеры
+    """
+    with tempfile.TemporaryDirectory(prefix="pizza-benchmark-") as directory, override_settings(
+        CATALOG_RESPONSE_CACHE={
+            **getattr(settings, "CATALOG_RESPONSE_CACHE", {}), "BACKEND": LOCAL_BACKEND, "OPTIONS": {},
+        },
+        HOME_PAYLOAD={
+            **getattr(settings, "HOME_PAYLOAD", {}),
+            "BACKEND": LOCAL_BACKEND,
+            "OPTIONS": {"max_entries": 1},
+        },
+        CATALOG_SNAPSHOT={
+            **getattr(settings, "CATALOG_SNAPSHOT", {}),
+            "PATH": os.path.join(directory, "catalog.snapshot"),
+        },
+    ):
+        response_cache.reset_backend()
+        snapshot.invalidate()
+        try:
+            yield
+        finally:
+            response_cache.reset_backend()
+            snapshot.invalidate()
+
+
+def scenarios(menu):
+    """(имя, URL) сценариев для сгенерированного меню"""
+    catalog = reverse("main:catalog", args=[menu["category_slug"]])
+    items = [("index", reverse("main:index"))]
+    for sort in SORT_ORDERINGS:
+        url = f"{catalog}?sort={sort}" if sort else catalog
+        items.append((f"catalog:{sort or 'default'}", url))
+    items += [
+        ("catalog:search", f"{catalog}?q={menu['search']}"),
+        ("product", reverse("main:product", args=[menu["product_slug"]])),
+        ("admin:pizza_changelist", reverse("admin:main_pizza_changelist")),
+        ("admin:combo_changelist", reverse("admin:main_combo_changelist")),
+    ]
+    return items
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def measure(client, url, requests, cold):
+    """Последовательные запросы: задержки, пропускная способность и число SQL-запросов"""
+    latencies, queries, statuses = [], [], {}
+    client.get(url)  # прогрев импорта шаблонов и кэша запросов
+    for _ in range(requests):
+        if cold:
+            response_cache.reset_backend()
+            home.reset_backend()
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - start)
+        queries.append(recorder.count)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    latencies_ms = [value * 1000 for value in latencies]
+    return {
+        "requests": requests,
+        "statuses": statuses,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies_ms), 3),
+            "p50": round(_percentile(latencies_ms, 50), 3),
+            "p95": round(_percentile(latencies_ms, 95), 3),
+            "max": round(max(latencies_ms), 3),
+        },
+        "throughput_rps": round(requests / sum(latencies), 1),
+        "queries": {"min": min(queries), "max": max(queries), "mean": statistics.fmean(queries)},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, requests=20, only=None, progress=None):
+    """
+    Для каждого размера меню генерирует данные, прогоняет сценарии с холодным
+    и тёплым кэшем и откатывает транзакцию — рабочая БД не меняется.
+    Реплики незакоммиченного меню не видят, поэтому всё читается с основной базы;
+    кэши и снимок на время замера свои (isolated_caches)
+    """
+    results = []
+    with isolated_caches(), override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        REQUEST_METRICS={"SAMPLE_RATE": 0},
+        READ_REPLICAS={"ALIASES": []},
+    ):
+        for size in sizes:
+            with transaction.atomic():
+                started = time.perf_counter()
+                menu = generate_menu(size, prefix=f"bench{size}", publish=False)
+                generated = time.perf_counter() - started
+
+                admin = get_user_model().objects.create_superuser(
+                    f"bench{size}", f"bench{size}@example.com", "bench"
+                )
+                # Админка требует входа; публичным страницам сессия не мешает
+                client = Client(raise_request_exception=False)
+                client.force_login(admin)
+
+                for name, url in scenarios(menu):
+                    if only and name not in only:
+                        continue
+                    for cold in (True, False):
+                        if progress:
+                            progress(f"{size}: {name} ({'cold' if cold else 'warm'})")
+                        results.append({
+                            "menu_size": size,
+                            "scenario": name,
+                            "url": url,
+                            "cache": "cold" if cold else "warm",
+                            **measure(client, url, requests, cold),
+                        })
+                results.append({
+                    "menu_size": size,
+                    "scenario": "generate_menu",
+                    "seconds": round(generated, 3),
+                    "rows": {k: v for k, v in menu.items() if isinstance(v, int)},
+                })
+                transaction.set_rollback(True)
+
+    return {
+        "revision": git_revision(),
+        "created_at": timezone.now().isoformat(),
+        "database": connections["default"].vendor,
+        "requests_per_scenario": requests,
+        "results": results,
+    }
+
+
+class SimulatedLatency:
+    """execute_wrapper: задержка перед каждым SQL-запросом (round trip до удалённой БД)"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def simulated_latency(seconds):
+    """
+    Задержка на соединениях текущего потока и на всех, открытых внутри блока
+    (в том числе в потоках main.parallel)
+    """
+    wrapper = SimulatedLatency(seconds)
+
+    def install(sender, connection, **kwargs):
+        # Объект соединения потока переживает переподключения — ставим один раз
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(install, weak=False, dispatch_uid="simulated_latency")
+    for connection in connections.all():
+        install(None, connection)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(dispatch_uid="simulated_latency")
+        for connection in connections.all():
+            if wrapper in connection.execute_wrappers:
+                connection.execute_wrappers.remove(wrapper)
+
+
+def _summary(latencies):
+    latencies_ms = [value * 1000 for value in latencies]
+    return {
+        "mean": round(statistics.fmean(latencies_ms), 3),
+        "p50": round(_percentile(latencies_ms, 50), 3),
+        "p95": round(_percentile(latencies_ms, 95), 3),
+    }
+
+
+def _check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"Страница ответила {response.status_code}")
+
+
+def _time_sync(view, request, kwargs, requests):
+    latencies = []
+    for _ in range(requests):
+        response_cache.reset_backend()
+        start = time.perf_counter()
+        response = view(request(), **kwargs)
+        if hasattr(response, "render") and not response.is_rendered:
+            response.render()
+        latencies.append(time.perf_counter() - start)
+        _check(response)
+    return latencies
+
+
+async def _time_async(view, request, kwargs, requests):
+    latencies = []
+    for _ in range(requests):
+        response_cache.reset_backend()
+        start = time.perf_counter()
+        response = await view(request(), **kwargs)
+        latencies.append(time.perf_counter() - start)
+        _check(response)
+    return latencies
+
+
+def _compare_menu(size, requests, latency_ms, progress):
+    prefix = f"async{size}"
+    # remove_menu удаляет по префиксу — чужие категории с ним не трогаем
+    if Category.objects.filter(slug__startswith=f"{prefix}-cat-").exists():
+        raise RuntimeError(f"В базе уже есть категории {prefix}-cat-*")
+    factory, async_factory = RequestFactory(), AsyncRequestFactory()
+    with transaction.atomic():
+        menu = generate_menu(size, prefix=prefix, publish=False)
+    results = []
+    try:
+        catalog_kwargs = {"slug": menu["category_slug"]}
+        product_kwargs = {"slug": menu["product_slug"]}
+        pages = [
+            ("catalog", views.CatalogView.as_view(), views.catalog_async,
+             reverse("main:catalog", kwargs=catalog_kwargs), catalog_kwargs),
+            ("product", views.ProductDetailView.as_view(), views.product_async,
+             reverse("main:product", kwargs=product_kwargs), product_kwargs),
+        ]
+        with simulated_latency(latency_ms / 1000):
+            for name, sync_view, async_view, url, kwargs in pages:
+                if progress:
+                    progress(f"{size}: {name} sync/async, {latency_ms} ms на запрос")
+                sync = _time_sync(sync_view, lambda: factory.get(url), kwargs, requests)
+                concurrent = asyncio.run(
+                    _time_async(async_view, lambda: async_factory.get(url), kwargs, requests)
+                )
+                results.append({
+                    "menu_size": size,
+                    "scenario": name,
+                    "url": url,
+                    "latency_per_query_ms": latency_ms,
+                    "sync_ms": _summary(sync),
+                    "async_ms": _summary(concurrent),
+                    "speedup": round(statistics.fmean(sync) / statistics.fmean(concurrent), 2),
+                })
+    finally:
+        remove_menu(prefix)
+    return results
+
+
+def compare_async_views(sizes, requests=20, latency_ms=5.0, progress=None, allow_commit=False):
+    """
+    Задержка синхронных и async-версий каталога и товара, когда каждый SQL-запрос
+    стоит latency_ms. Кэш ответов холодный, чтобы мерить запросы к БД.
+    Параллельные запросы async-версий идут в других соединениях и не видят
+    незакоммиченных данных, поэтому меню коммитится и удаляется после замера —
+    только с явным allow_commit (отдельная база или осознанный запуск на рабочей)
+    """
+    if not allow_commit:
+        raise ValueError("Сравнение коммитит синтетическое меню в базу: нужен allow_commit=True")
+    results = []
+    with isolated_caches(), override_settings(
+        REQUEST_METRICS={"SAMPLE_RATE": 0}, READ_REPLICAS={"ALIASES": []}
+    ):
+        for size in sizes:
+            results += _compare_menu(size, requests, latency_ms, progress)
+    return {
+        "revision": git_revision(),
+        "created_at": timezone.now().isoformat(),
+        "database": connections["default"].vendor,
+        "requests_per_scenario": requests,
+        "results": results,
+    }
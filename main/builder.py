@@ -0,0 +1,172 @@
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+
+from .models import Pizza, Toppings
+from .versions import GLOBAL, current
+
+DEFAULTS = {
+    # Сколько секунд снимок цен считается свежим без проверки версии меню.
+    # Внутри процесса снимок сбрасывается сразу после коммита изменений меню,
+    # остальные воркеры увидят их не позже чем через SNAPSHOT_TTL
+    "SNAPSHOT_TTL": 1.0,
+    # Не больше стольких добавленных топпингов в одной пицце
+    "MAX_EXTRAS": 15,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "PIZZA_BUILDER", {})}
+
+
+class QuoteError(ValueError):
+    pass
+
+
+def topping_price(price, scale):
+    """Цена топпинга для размера: масштаб цены пиццы, округление до рубля"""
+    return (Decimal(price) * scale).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+
+
+class PriceSnapshot:
+    """
+    Цены пицц в продаже по размерам, их состав и цены активных топпингов
+    в памяти процесса. Расчёт конструктора не делает запросов, пока снимок
+    свежий; затем одна проверка глобальной версии меню
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._built = None
+
+    def _build(self, version):
+        toppings = {
+            row["pk"]: row
+            for row in Toppings.objects.filter(is_active=True).values(
+                "pk", "name", "price", "top_category", "order"
+            )
+        }
+
+        composition = {}
+        through = Pizza.toppings.through.objects.filter(
+            pizza__is_active=True, pizza__is_available=True
+        )
+        for pizza_id, topping_id in through.values_list("pizza_id", "toppings_id").iterator():
+            composition.setdefault(pizza_id, set()).add(topping_id)
+
+        pizzas = {}
+        for pizza in Pizza.objects.filter(is_active=True, is_available=True).iterator():
+            sizes = {}
+            for size in pizza.get_available_sizes():
+                price = pizza.get_price_for_size(size)
+                if price is not None:
+                    sizes[size] = (Decimal(price), pizza.get_topping_scale(size))
+            pizzas[pizza.pk] = {
+                "name": pizza.name,
+                "slug": pizza.slug,
+                "sizes": sizes,
+                "toppings": frozenset(composition.get(pizza.pk, ())),
+            }
+
+        return {
+            "version": version,
+            "toppings": toppings,
+            "pizzas": pizzas,
+            "slugs": {pizza["slug"]: pk for pk, pizza in pizzas.items()},
+        }
+
+    def get(self):
+        built = self._built
+        if built is not None and time.monotonic() - self._checked_at < config()["SNAPSHOT_TTL"]:
+            return built
+
+        version = current([GLOBAL])[GLOBAL][0]
+        with self._lock:
+            if self._built is None or self._built["version"] != version:
+                self._built = self._build(version)
+            self._checked_at = time.monotonic()
+            return self._built
+
+
+_snapshot = PriceSnapshot()
+
+
+def invalidate():
+    _snapshot.invalidate()
+
+
+def quote(pizza_id, size, add=(), remove=()):
+    """
+    Цена конфигурации: пицца, размер, добавленные и убранные топпинги.
+    Добавление топпинга из состава и удаление отсутствующего игнорируются;
+    убранные топпинги цену не снижают
+    """
+    snapshot = _snapshot.get()
+    pizza = snapshot["pizzas"].get(pizza_id)
+    if pizza is None:
+        raise QuoteError("Пицца недоступна")
+    if size not in pizza["sizes"]:
+        raise QuoteError("Размер недоступен")
+
+    add = set(add) - pizza["toppings"]
+    remove = set(remove) & pizza["toppings"]
+    if len(add) > config()["MAX_EXTRAS"]:
+        raise QuoteError("Слишком много добавок")
+    missing = add - snapshot["toppings"].keys()
+    if missing:
+        raise QuoteError("Топпинг недоступен")
+
+    base_price, scale = pizza["sizes"][size]
+    toppings = snapshot["toppings"]
+    extras = [
+        {"id": pk, "name": toppings[pk]["name"], "price": topping_price(toppings[pk]["price"], scale)}
+        for pk in sorted(add, key=lambda pk: (toppings[pk]["order"], toppings[pk]["name"]))
+    ]
+    return {
+        "pizza_id": pizza_id,
+        "name": pizza["name"],
+        "size": size,
+        "base_price": base_price,
+        "extras": extras,
+        "removed": [toppings[pk]["name"] for pk in remove if pk in toppings],
+        "price": base_price + sum((extra["price"] for extra in extras), Decimal(0)),
+        "version": snapshot["version"],
+    }
+
+
+def builder_options(slug):
+    """Пицца, размеры с ценами и топпинги с ценами по размерам для формы конструктора"""
+    snapshot = _snapshot.get()
+    pizza_id = snapshot["slugs"].get(slug)
+    if pizza_id is None:
+        return None
+    pizza = snapshot["pizzas"][pizza_id]
+    toppings = sorted(snapshot["toppings"].values(), key=lambda t: (t["order"], t["name"]))
+    return {
+        "id": pizza_id,
+        "name": pizza["name"],
+        "slug": slug,
+        "sizes": [
+            {"size": size, "price": price}
+            for size, (price, _) in pizza["sizes"].items()
+        ],
+        "toppings": [
+            {
+                "id": topping["pk"],
+                "name": topping["name"],
+                "group": topping["top_category"],
+                "included": topping["pk"] in pizza["toppings"],
+                "prices": {
+                    size: topping_price(topping["price"], scale)
+                    for size, (_, scale) in pizza["sizes"].items()
+                },
+            }
+            for topping in toppings
+        ],
+    }
@@ -0,0 +1,196 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+from .builder import topping_price
+from .models import Combo, DrinkSize, Pizza, ProductType, RomaPizza, Toppings
+
+# Префиксы ключей строк корзины в сессии
+TYPE_CODES = {
+    ProductType.PIZZA: "p",
+    ProductType.ROMA: "r",
+    ProductType.DRINK: "d",
+    ProductType.COMBO: "c",
+}
+CODE_TYPES = {code: product_type for product_type, code in TYPE_CODES.items()}
+
+# Типы, к которым можно добавить топпинги
+TOPPING_TYPES = {ProductType.PIZZA, ProductType.ROMA}
+
+MAX_QUANTITY = 99
+
+
+def _ids(values):
+    return ".".join(str(pk) for pk in sorted({int(pk) for pk in values}))
+
+
+def make_key(product_type, object_id, size=None, toppings=(), removed=()):
+    """
+    Компактный ключ строки: "p:12:L:3.7" — пицца 12, размер L, топпинги 3 и 7;
+    "p:12:L::5" — без топпинга 5 из состава.
+    Одинаковая конфигурация всегда даёт один и тот же ключ
+    """
+    parts = [TYPE_CODES[product_type], str(int(object_id)), size or "", _ids(toppings)]
+    if removed:
+        parts.append(_ids(removed))
+    return ":".join(parts).rstrip(":")
+
+
+def parse_key(key):
+    """(тип, id, размер, id добавленных, id убранных топпингов) или None для битого ключа"""
+    parts = key.split(":")
+
+    def ids(index):
+        if len(parts) > index and parts[index]:
+            return tuple(int(pk) for pk in parts[index].split("."))
+        return ()
+
+    try:
+        product_type = CODE_TYPES[parts[0]]
+        object_id = int(parts[1])
+        size = parts[2] if len(parts) > 2 and parts[2] else None
+        toppings, removed = ids(3), ids(4)
+    except (KeyError, IndexError, ValueError):
+        return None
+    return product_type, object_id, size, toppings, removed
+
+
+class Cart:
+    """
+    Корзина в сессии: {ключ строки: количество}. Модели и цены в сессию не
+    попадают — цены считаются при чтении пачкой запросов по типам товаров
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        cart = self.session.get(settings.CART_SESSION_ID)
+        if not isinstance(cart, dict):
+            cart = self.session[settings.CART_SESSION_ID] = {}
+        self.cart = cart
+        self._lines = None
+
+    def __len__(self):
+        return sum(self.cart.values())
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def save(self):
+        self.session.modified = True
+        self._lines = None
+
+    def add(self, product_type, object_id, size=None, toppings=(), quantity=1, removed=()):
+        if product_type not in TOPPING_TYPES:
+            toppings = ()
+        if product_type != ProductType.PIZZA:
+            size = None
+            removed = ()
+        key = make_key(product_type, object_id, size, toppings, removed)
+        self.cart[key] = min(self.cart.get(key, 0) + quantity, MAX_QUANTITY)
+        self.save()
+        return key
+
+    def update(self, key, quantity):
+        if key not in self.cart:
+            return
+        if quantity <= 0:
+            del self.cart[key]
+        else:
+            self.cart[key] = min(quantity, MAX_QUANTITY)
+        self.save()
+
+    def remove(self, key):
+        if self.cart.pop(key, None) is not None:
+            self.save()
+
+    def clear(self):
+        self.cart.clear()
+        self.save()
+
+    def _load(self, parsed):
+        """Все товары корзины: не больше одного запроса на тип"""
+        ids = {product_type: set() for product_type in TYPE_CODES}
+        topping_ids = set()
+        for product_type, object_id, _, toppings, removed in parsed.values():
+            ids[product_type].add(object_id)
+            topping_ids.update(toppings)
+            topping_ids.update(removed)
+
+        def bulk(queryset, pks):
+            return queryset.in_bulk(pks) if pks else {}
+
+        # Флаг is_available ведёт main.availability: позиции из стоп-листа
+        # отбрасываются без разбора их состава
+        return {
+            ProductType.PIZZA: bulk(
+                Pizza.objects.filter(is_active=True, is_available=True), ids[ProductType.PIZZA]
+            ),
+            ProductType.ROMA: bulk(RomaPizza.objects.filter(is_available=True), ids[ProductType.ROMA]),
+            ProductType.DRINK: bulk(
+                DrinkSize.objects.select_related("drink"), ids[ProductType.DRINK]
+            ),
+            ProductType.COMBO: bulk(Combo.objects.filter(is_available=True), ids[ProductType.COMBO]),
+            "toppings": bulk(Toppings.objects.all(), topping_ids),
+        }
+
+    def _price(self, product_type, product, size):
+        """(название, цена за единицу) или None, если позицию нельзя продать"""
+        if product_type == ProductType.PIZZA:
+            if size not in product.get_available_sizes():
+                return None
+            price = product.get_price_for_size(size)
+            return product.name, None if price is None else Decimal(price)
+        if product_type == ProductType.ROMA:
+            return product.name, product.price
+        if product_type == ProductType.DRINK:
+            return product.drink.name, product.price
+        return product.name, product.get_final_price()
+
+    def lines(self):
+        """Строки корзины с ценами; несуществующие товары пропускаются"""
+        if self._lines is not None:
+            return self._lines
+
+        parsed = {key: parse_key(key) for key in self.cart}
+        parsed = {key: value for key, value in parsed.items() if value is not None}
+        loaded = self._load(parsed)
+
+        lines = []
+        for key, (product_type, object_id, size, topping_ids, removed_ids) in parsed.items():
+            product = loaded[product_type].get(object_id)
+            priced = product and self._price(product_type, product, size)
+            if not priced or priced[1] is None:
+                continue
+            name, unit_price = priced
+
+            available = loaded["toppings"]
+            toppings = [available[pk] for pk in topping_ids if pk in available]
+            if len(toppings) != len(topping_ids) or not all(t.is_active for t in toppings):
+                continue
+            if product_type == ProductType.PIZZA:
+                # Добавки дорожают с размером так же, как сама пицца (см. main.builder)
+                scale = product.get_topping_scale(size)
+                unit_price += sum((topping_price(t.price, scale) for t in toppings), Decimal(0))
+            else:
+                unit_price += sum((t.price for t in toppings), Decimal(0))
+            removed = [available[pk].name for pk in removed_ids if pk in available]
+
+            quantity = self.cart[key]
+            lines.append({
+                "key": key,
+                "type": product_type,
+                "id": object_id,
+                "name": name,
+                "size": size,
+                "toppings": [t.name for t in toppings],
+                "removed": removed,
+                "unit_price": unit_price,
+                "quantity": quantity,
+                "total": unit_price * quantity,
+            })
+
+        self._lines = lines
+        return lines
+
+    def get_total_price(self):
+        return sum((line["total"] for line in self.lines()), Decimal(0))
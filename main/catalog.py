@@ -0,0 +1,340 @@
+import threading
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import (
+    CatalogEntry,
+    Combo,
+    DrinkSize,
+    Pizza,
+    RomaPizza,
+)
+from .mappers import map_combo, map_pizza, map_drink, map_roma_pizza
+from .pagination import keyset_page
+from .search import search_entries, update_vectors
+from .slugs import forget_slug, resolve_slug
+from . import availability, builder, facets, home, ingredients, snapshot, versions
+
+
+def pizzas_queryset():
+    return Pizza.objects.filter(is_active=True).prefetch_related("toppings")
+
+
+def roma_pizzas_queryset():
+    return RomaPizza.objects.prefetch_related("toppings")
+
+
+def drink_sizes_queryset():
+    return DrinkSize.objects.select_related("drink")
+
+
+def combos_queryset():
+    return Combo.objects.all()
+
+
+def _entry(product_type, category_id, data, *search_parts, toppings=()):
+    entry = CatalogEntry(
+        product_type=product_type,
+        type_order=CatalogEntry.TYPE_ORDER[product_type],
+        object_id=data["id"],
+        category_id=category_id,
+        slug=data["slug"],
+        name=data["name"],
+        price=data["price"],
+        new=data.get("new", False),
+        available=data.get("available", True),
+        search_text=" ".join(search_parts).lower(),
+        data=data,
+    )
+    # (id, группа) топпингов для индекса фасетов после bulk_create
+    entry.facet_toppings = [(topping.pk, topping.top_category) for topping in toppings]
+    return entry
+
+
+def _pizza_entries(pizzas):
+    for pizza in pizzas:
+        data = map_pizza(pizza)
+        yield _entry(
+            CatalogEntry.Type.PIZZA, pizza.category_id, data,
+            pizza.name, *data["toppings"],
+            toppings=pizza.toppings.all(),
+        )
+
+
+def _roma_entries(romas):
+    for roma in romas:
+        data = map_roma_pizza(roma)
+        yield _entry(
+            CatalogEntry.Type.ROMA, roma.category_id, data,
+            roma.name, *data["toppings"],
+            toppings=roma.toppings.all(),
+        )
+
+
+def _drink_entries(drink_sizes):
+    for size in drink_sizes:
+        yield _entry(
+            CatalogEntry.Type.DRINK, size.drink.category_id, map_drink(size),
+            size.drink.name, size.drink.description,
+        )
+
+
+def _combo_entries(combos):
+    for combo in combos:
+        yield _entry(CatalogEntry.Type.COMBO, combo.category_id, map_combo(combo), combo.name)
+
+
+# Тип позиции -> (исходный queryset, построитель строк витрины)
+ENTRY_SOURCES = {
+    CatalogEntry.Type.PIZZA: (pizzas_queryset, _pizza_entries),
+    CatalogEntry.Type.ROMA: (roma_pizzas_queryset, _roma_entries),
+    CatalogEntry.Type.DRINK: (drink_sizes_queryset, _drink_entries),
+    CatalogEntry.Type.COMBO: (combos_queryset, _combo_entries),
+}
+
+
+def refresh_entries(product_type, ids):
+    """Пересобирает строки витрины для указанных объектов одного типа"""
+    ids = list(ids)
+    queryset, build = ENTRY_SOURCES[product_type]
+
+    with transaction.atomic():
+        old = CatalogEntry.objects.filter(product_type=product_type, object_id__in=ids)
+        category_ids = set(old.values_list("category_id", flat=True))
+        old.delete()
+
+        created = CatalogEntry.objects.bulk_create(build(queryset().filter(pk__in=ids)))
+        facets.index_entries(created)
+        ingredients.invalidate()
+        category_ids.update(entry.category_id for entry in created)
+        update_vectors(
+            CatalogEntry.objects.filter(product_type=product_type, object_id__in=ids)
+        )
+        versions.bump_categories(category_ids)
+
+
+def rebuild_entries(batch_size=500):
+    """Полная пересборка витрины; возвращает количество строк"""
+    total = 0
+    with transaction.atomic():
+        availability.refresh()
+        CatalogEntry.objects.all().delete()
+        for queryset, build in ENTRY_SOURCES.values():
+            created = CatalogEntry.objects.bulk_create(
+                build(queryset().iterator(chunk_size=batch_size)),
+                batch_size=batch_size,
+            )
+            facets.index_entries(created, batch_size=batch_size)
+            total += len(created)
+        ingredients.invalidate()
+        builder.invalidate()
+        update_vectors(CatalogEntry.objects.all())
+        versions.bump_all()
+        transaction.on_commit(snapshot.schedule_rebuild)
+    return total
+
+
+def build_category_entries(category_ids, batch_size=500):
+    """
+    Строки витрины для товаров новых категорий (синтетическое меню): остальная
+    витрина и версии не трогаются. Возвращает количество строк
+    """
+    category_ids = list(category_ids)
+    total = 0
+    with transaction.atomic():
+        for product_type, (queryset, build) in ENTRY_SOURCES.items():
+            field = "drink__category" if product_type == CatalogEntry.Type.DRINK else "category"
+            rows = queryset().filter(**{f"{field}__in": category_ids})
+            created = CatalogEntry.objects.bulk_create(
+                build(rows.iterator(chunk_size=batch_size)), batch_size=batch_size
+            )
+            facets.index_entries(created, batch_size=batch_size)
+            total += len(created)
+        ingredients.invalidate()
+        update_vectors(CatalogEntry.objects.filter(category_id__in=category_ids))
+    return total
+
+
+_local = threading.local()
+
+# Ключи отложенной очереди помимо типов товаров
+COMBO_PRICES = "combo_prices"
+VERSIONS = "versions"
+
+
+def _flush_pending():
+    pending = getattr(_local, "pending", None) or {}
+    _local.pending = None
+
+    # Доступность и цены комбо пересчитываются до пересборки витрины, которая
+    # их читает. Комбо, чья доступность поменялась из-за пицц, тоже пересобираются
+    combo_ids = pending.pop(COMBO_PRICES, None)
+    changed = availability.refresh(
+        pending.get(CatalogEntry.Type.PIZZA, ()),
+        pending.get(CatalogEntry.Type.ROMA, ()),
+        combo_ids or (),
+    )
+    if changed["combos"]:
+        pending.setdefault(CatalogEntry.Type.COMBO, set()).update(changed["combos"])
+    if combo_ids:
+        Combo.objects.filter(pk__in=combo_ids).recompute_items_price()
+        pending.setdefault(CatalogEntry.Type.COMBO, set()).update(combo_ids)
+
+    scopes = pending.pop(VERSIONS, None)
+    for product_type, ids in pending.items():
+        refresh_entries(product_type, ids)
+    if scopes:
+        versions.bump(scopes)
+        if versions.LAYOUT in scopes:
+            home.refresh_payload()
+    # Этот воркер видит новые цены сразу, остальные — после проверки версии
+    builder.invalidate()
+    # Файл снимка пересобирается в фоне; воркеры переотобразят его за TTL
+    snapshot.schedule_rebuild()
+
+
+def _schedule(key, ids):
+    """
+    Откладывает работу до коммита транзакции, чтобы несколько сигналов
+    одного сохранения в админке дали одну пересборку
+    """
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return
+
+    # Колбэк мог пропасть вместе с откатанной транзакцией — тогда регистрируем заново
+    connection = transaction.get_connection()
+    registered = getattr(_local, "pending", None) is not None and any(
+        callback is _flush_pending for _, callback, *_ in connection.run_on_commit
+    )
+    if getattr(_local, "pending", None) is None:
+        _local.pending = defaultdict(set)
+    _local.pending[key].update(ids)
+
+    if not registered:
+        transaction.on_commit(_flush_pending)
+
+
+def schedule_refresh(product_type, ids):
+    """Пересборка строк витрины для объектов одного типа после коммита"""
+    _schedule(product_type, ids)
+
+
+def schedule_combo_prices(ids):
+    """Пересчёт сохранённой цены комбо (и их строк витрины) после коммита"""
+    _schedule(COMBO_PRICES, ids)
+
+
+def schedule_version_bump(scopes):
+    """Увеличение версий меню (см. main.versions) после коммита"""
+    _schedule(VERSIONS, scopes)
+
+
+# Глобальная сортировка витрины по всем типам товаров; последнее поле уникально
+SORT_ORDERINGS = {
+    None: ("type_order", "name", "pk"),
+    "price_asc": ("price", "pk"),
+    "price_desc": ("-price", "-pk"),
+    "name": ("name", "pk"),
+    "new": ("-new", "type_order", "name", "pk"),
+}
+SEARCH_ORDERING = ("-search_rank", "type_order", "name", "pk")
+
+# Товар берётся из снимка (main.snapshot), поэтому JSON data с базы не читается
+PRODUCT_DEFERRED = ("data", "search_text", "search_vector")
+
+
+def category_queryset(category, search="", sort=None, **filters):
+    """
+    Queryset витрины категории и его сортировка; filters — фильтры состава
+    (см. main.facets.parse_filters)
+    """
+    entries = CatalogEntry.objects.filter(category=category, available=True)
+    entries = facets.filter_entries(entries, category, **filters)
+
+    if search:
+        entries = search_entries(entries, search)
+
+    if sort in SORT_ORDERINGS:
+        ordering = SORT_ORDERINGS[sort]
+    elif search:
+        ordering = SEARCH_ORDERING
+    else:
+        ordering = SORT_ORDERINGS[None]
+    return entries, ordering
+
+
+def category_entries(category, search="", sort=None, **filters):
+    """Все товары категории одним запросом к витрине"""
+    entries, ordering = category_queryset(category, search, sort, **filters)
+    return snapshot.products(entries.defer(*PRODUCT_DEFERRED).order_by(*ordering))
+
+
+def catalog_page(category, search="", sort=None, cursor=None, page_size=None, **filters):
+    """
+    Страница каталога по курсору (keyset): выбирается только page_size + 1
+    строка, поэтому стоимость не растёт с размером категории
+    """
+    if page_size is None:
+        page_size = getattr(settings, "CATALOG_PAGE_SIZE", 24)
+
+    entries, ordering = category_queryset(category, search, sort, **filters)
+    page, next_cursor = keyset_page(entries.defer(*PRODUCT_DEFERRED), ordering, cursor, page_size)
+    return snapshot.products(page), next_cursor
+
+
+def catalog_facets(category, search="", **filters):
+    """Счётчики фасетов для текущей выборки каталога (см. main.facets)"""
+    entries, _ = category_queryset(category, search, None, **filters)
+    return facets.facet_counts(entries, category, **filters)
+
+
+def catalog_queries(category, search="", sort=None, cursor=None, page_size=None, **filters):
+    """
+    Независимые запросы страницы каталога (callable без аргументов) для
+    одновременного выполнения в async-view: страница и части счётчиков
+    фасетов (без курсора). Результаты — как у catalog_page и catalog_facets
+    """
+    queries = [partial(catalog_page, category, search, sort, cursor, page_size, **filters)]
+    if not cursor:
+        entries, _ = category_queryset(category, search, None, **filters)
+        queries += facets.facet_queries(entries, category, filters.get("without", ()))
+    return queries
+
+
+def search_catalog(search="", limit=50, **filters):
+    """Поиск по всей витрине с фильтрами состава (для JSON API)"""
+    entries = facets.filter_entries(CatalogEntry.objects.filter(available=True), **filters)
+    ordering = SORT_ORDERINGS[None]
+    if search:
+        entries = search_entries(entries, search)
+        ordering = SEARCH_ORDERING
+    return list(entries.order_by(*ordering)[:limit])
+
+
+def entry_by_slug(slug):
+    """
+    Товар по slug: тип определяется реестром (LRU или один запрос),
+    затем одна строка витрины, сам товар — из снимка.
+    Неизвестный slug — один запрос и None
+    """
+    for use_cache in (True, False):
+        resolved = resolve_slug(slug, use_cache=use_cache)
+        if resolved is None:
+            return None
+
+        entry = (
+            CatalogEntry.objects.filter(product_type=resolved[0], slug=slug)
+            .defer(*PRODUCT_DEFERRED)
+            .order_by("object_id")
+            .first()
+        )
+        if entry is not None:
+            return snapshot.products([entry])[0]
+
+        # В LRU этого процесса мог остаться slug переименованного товара
+        forget_slug(slug)
+    return None
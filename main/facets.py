@@ -0,0 +1,206 @@
+from urllib.parse import urlencode
+
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from . import ingredients
+from .models import CatalogEntry, CatalogEntryTopping, Toppings
+
+# Не больше стольких топпингов в одном фильтре (защита от огромных URL)
+MAX_TOPPINGS = 20
+
+
+def parse_filters(params):
+    """
+    Фильтры состава из QueryDict: ?topping=<id> (есть), ?group=MT (хотя бы
+    одна группа), ?without=<id> (нет), ?without_group=SF (нет ни одного из
+    группы). Неизвестные значения отбрасываются, списки отсортированы, чтобы
+    одинаковые фильтры давали один ключ кэша
+    """
+    filters = {}
+    for name in ("topping", "without"):
+        ids = {int(value) for value in params.getlist(name) if value.isdigit()}
+        filters[name] = sorted(ids)[:MAX_TOPPINGS]
+    for name in ("group", "without_group"):
+        filters[name] = sorted(
+            {value for value in params.getlist(name) if value in Toppings.TopCategory.values}
+        )
+    return {
+        "toppings": filters["topping"],
+        "groups": filters["group"],
+        "without": filters["without"],
+        "without_groups": filters["without_group"],
+    }
+
+
+# Имя фильтра -> параметр URL
+FILTER_PARAMS = {
+    "toppings": "topping",
+    "groups": "group",
+    "without": "without",
+    "without_groups": "without_group",
+}
+
+
+def filter_query(filters):
+    """Параметры фильтров для ссылок (пагинация, переключатели)"""
+    return urlencode([
+        (FILTER_PARAMS[name], value)
+        for name, values in filters.items()
+        for value in values
+    ])
+
+
+def toggle_query(params, name, value):
+    """Строка запроса с включённым/выключенным значением фасета; курсор сбрасывается"""
+    query = params.copy()
+    query.pop("cursor", None)
+    values = query.getlist(name)
+    value = str(value)
+    query.setlist(name, [v for v in values if v != value] if value in values else values + [value])
+    return query.urlencode()
+
+
+def index_rows(entries):
+    """Строки индекса для сохранённых строк витрины (у которых есть facet_toppings)"""
+    return [
+        CatalogEntryTopping(
+            entry_id=entry.pk,
+            category_id=entry.category_id,
+            topping_id=topping_id,
+            top_category=top_category,
+        )
+        for entry in entries
+        for topping_id, top_category in getattr(entry, "facet_toppings", ())
+    ]
+
+
+def index_entries(entries, batch_size=1000):
+    CatalogEntryTopping.objects.bulk_create(index_rows(entries), batch_size=batch_size)
+
+
+# Строки витрины, у которых индексируется состав
+INDEXED_TYPES = ingredients.PRODUCT_TYPES
+
+
+def filter_entries(entries, category=None, toppings=(), groups=(), without=(), without_groups=()):
+    """
+    Ограничивает entries позициями, подходящими под фильтры состава: есть
+    все toppings, хотя бы одна из groups, нет ни одного из without и ни одного
+    топпинга из without_groups. Отбор делает битовый индекс в памяти
+    (main.ingredients); в SQL уходит его список pk, а если совпадений больше
+    MAX_IDS — (NOT) EXISTS по индексу CatalogEntryTopping, чтобы запрос
+    не рос с размером категории. Без фильтров queryset не меняется
+    """
+    if not (toppings or groups or without or without_groups):
+        return entries
+
+    # Только исключения: напитки под них подходят всегда, а комбо — нет,
+    # их состав не индексируется (аллергенный фильтр не должен пропускать лишнее)
+    only_exclusions = not (toppings or groups)
+    ids = ingredients.match_entries(
+        category.pk if category else None,
+        limit=ingredients.config()["MAX_IDS"],
+        toppings=toppings,
+        groups=groups,
+        without=without,
+        without_groups=without_groups,
+    )
+    if ids is not None:
+        if only_exclusions:
+            return entries.filter(Q(pk__in=ids) | Q(product_type=CatalogEntry.Type.DRINK))
+        return entries.filter(pk__in=ids)
+
+    index = CatalogEntryTopping.objects.filter(entry=OuterRef("pk"))
+    conditions = [Exists(index.filter(topping_id=topping_id)) for topping_id in toppings]
+    if groups:
+        conditions.append(Exists(index.filter(top_category__in=groups)))
+    if without:
+        conditions.append(~Exists(index.filter(topping_id__in=without)))
+    if without_groups:
+        conditions.append(~Exists(index.filter(top_category__in=without_groups)))
+    types = [*INDEXED_TYPES, CatalogEntry.Type.DRINK] if only_exclusions else INDEXED_TYPES
+    return entries.filter(*conditions, product_type__in=types)
+
+
+def facet_queries(entries, category, without=()):
+    """
+    Независимые запросы счётчиков фасетов (callable без аргументов): группы,
+    топпинги и исключённые топпинги. Их можно выполнить одновременно
+    (main.parallel), результаты собирает facet_result
+    """
+    index = CatalogEntryTopping.objects.filter(
+        category=category, entry__in=entries.order_by().values("pk")
+    )
+
+    def group_counts():
+        return dict(
+            index.order_by()
+            .values_list("top_category")
+            .annotate(count=Count("entry_id", distinct=True))
+        )
+
+    def topping_rows():
+        return list(
+            index.values("topping_id", "topping__name", "top_category", "topping__order")
+            .annotate(count=Count("entry_id"))
+            .order_by("topping__order", "topping__name")
+        )
+
+    def excluded_rows():
+        # Исключённых топпингов в выборке нет — они показываются с нулём
+        if not without:
+            return []
+        return [
+            {**row, "count": 0}
+            for row in Toppings.objects.filter(pk__in=without).values(
+                topping_id=F("pk"),
+                topping__name=F("name"),
+                top_category=F("top_category"),
+                topping__order=F("order"),
+            )
+        ]
+
+    return group_counts, topping_rows, excluded_rows
+
+
+def facet_result(group_counts, topping_rows, excluded_rows,
+                 toppings=(), groups=(), without=(), without_groups=()):
+    if excluded_rows:
+        topping_rows = sorted(
+            topping_rows + excluded_rows,
+            key=lambda row: (row["topping__order"], row["topping__name"]),
+        )
+    return {
+        "groups": [
+            {
+                "value": value,
+                "label": label,
+                "count": group_counts.get(value, 0),
+                "selected": value in groups,
+                "excluded": value in without_groups,
+            }
+            for value, label in Toppings.TopCategory.choices
+            if value in group_counts or value in groups or value in without_groups
+        ],
+        "toppings": [
+            {
+                "id": row["topping_id"],
+                "name": row["topping__name"],
+                "group": row["top_category"],
+                "count": row["count"],
+                "selected": row["topping_id"] in toppings,
+                "excluded": row["topping_id"] in without,
+            }
+            for row in topping_rows
+        ],
+    }
+
+
+def facet_counts(entries, category, **filters):
+    """
+    Сколько из отфильтрованных товаров содержат каждый топпинг и каждую группу.
+    Два GROUP BY по индексу, ограниченному строками entries; исключённые
+    топпинги (их в выборке нет) добавляются отдельным запросом с нулём
+    """
+    queries = facet_queries(entries, category, filters.get("without", ()))
+    return facet_result(*(query() for query in queries), **filters)
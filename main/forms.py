@@ -0,0 +1,71 @@
+from django import forms
+
+from .cart import MAX_QUANTITY
+from .models import Order, Pizza, ProductType, Toppings
+
+
+class CartAddForm(forms.Form):
+    type = forms.ChoiceField(choices=ProductType.choices)
+    id = forms.IntegerField(min_value=1)
+    size = forms.ChoiceField(choices=Pizza.SIZE_CHOICES, required=False)
+    toppings = forms.ModelMultipleChoiceField(
+        queryset=Toppings.objects.filter(is_active=True), required=False
+    )
+    # Топпинги, убранные из состава пиццы (конструктор)
+    removed = forms.ModelMultipleChoiceField(queryset=Toppings.objects.all(), required=False)
+    quantity = forms.IntegerField(min_value=1, max_value=MAX_QUANTITY, initial=1, required=False)
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get("type") == ProductType.PIZZA and not cleaned.get("size"):
+            self.add_error("size", "Для пиццы нужно выбрать размер")
+        return cleaned
+
+
+class CartUpdateForm(forms.Form):
+    key = forms.CharField(max_length=200)
+    quantity = forms.IntegerField(min_value=0, max_value=MAX_QUANTITY)
+
+
+class CheckoutForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = ["name", "phone", "address"]
+
+
+class RepriceForm(forms.Form):
+    """Правило массового изменения цен для действия админки (см. main.repricing)"""
+
+    RULE_CHOICES = [
+        ("percent", "Изменить цены на N%"),
+        ("round", "Округлить цены до последней цифры"),
+        ("multiplier", "Задать коэффициент размера (только авторасчёт)"),
+    ]
+
+    rule = forms.ChoiceField(label="Правило", choices=RULE_CHOICES)
+    percent = forms.DecimalField(label="Процент", max_digits=6, decimal_places=2, required=False)
+    digit = forms.IntegerField(label="Последняя цифра", min_value=0, max_value=9, initial=9, required=False)
+    size = forms.ChoiceField(label="Размер", choices=[("M", "M"), ("L", "L"), ("XL", "XL")], required=False)
+    multiplier = forms.DecimalField(
+        label="Коэффициент", min_value=0, max_digits=4, decimal_places=2, required=False
+    )
+
+    # Обязательные поля каждого правила
+    RULE_FIELDS = {"percent": ["percent"], "round": ["digit"], "multiplier": ["size", "multiplier"]}
+
+    def __init__(self, *args, rules=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if rules is not None:
+            self.fields["rule"].choices = [c for c in self.RULE_CHOICES if c[0] in rules]
+
+    def clean(self):
+        cleaned = super().clean()
+        for name in self.RULE_FIELDS.get(cleaned.get("rule"), []):
+            if cleaned.get(name) in (None, ""):
+                self.add_error(name, "Обязательное поле для выбранного правила")
+        return cleaned
+
+    def rule_args(self):
+        """(правило, аргументы) для main.repricing.reprice"""
+        rule = self.cleaned_data["rule"]
+        return rule, [self.cleaned_data[name] for name in self.RULE_FIELDS[rule]]
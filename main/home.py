@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from . import response_cache
+from .models import ActionGallery, ActionImage, Category
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_KEY = "home-payload"
+
+DEFAULTS = {
+    # Общий кэш Django (CACHES): пересборка после коммита видна всем воркерам,
+    # а не только тому, кто сохранил категорию
+    "BACKEND": "main.response_cache.DjangoCacheBackend",
+    "OPTIONS": {"key_prefix": "home"},
+    # Через TIMEOUT payload считается устаревшим и пересобирается в фоне
+    "TIMEOUT": 60,
+    # Сколько хранить устаревший payload, пока идёт пересборка
+    "STALE_TIMEOUT": 24 * 3600,
+    "LOCK_TIMEOUT": 30,
+    # Сколько ждать чужой сборки при холодном кэше
+    "WAIT_TIMEOUT": 2.0,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "HOME_PAYLOAD", {})}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                conf = config()
+                _backend = import_string(conf["BACKEND"])(**conf["OPTIONS"])
+    return _backend
+
+
+def reset_backend():
+    """Удаляет payload и сбрасывает экземпляр бэкенда (после смены настроек, в тестах)"""
+    global _backend
+    if _backend is not None:
+        _backend.delete(PAYLOAD_KEY)
+        _backend.release_lock(PAYLOAD_KEY)
+    _backend = None
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    # override_settings (бенчмарк): следующий get_backend() возьмёт новые настройки,
+    # payload прежнего бэкенда не трогается
+    global _backend
+    if setting == "HOME_PAYLOAD":
+        _backend = None
+
+
+def _image(field_file, srcset):
+    return {"url": field_file.url, "srcset": srcset} if field_file else None
+
+
+def build_payload():
+    """
+    Данные главной одним снимком: категории и изображения первой галереи.
+    Два-три запроса, дальше в шаблоне обращений к БД нет
+    """
+    categories = [
+        {
+            "name": category.name,
+            "slug": category.slug,
+            "image": _image(category.image, category.image_srcset),
+        }
+        for category in Category.objects.only("name", "slug", "image", "image_variants")
+    ]
+
+    gallery = (
+        ActionGallery.objects.prefetch_related(
+            Prefetch("images", queryset=ActionImage.objects.exclude(image="").exclude(image=None))
+        )
+        .order_by("pk")
+        .first()
+    )
+    if gallery is not None:
+        gallery = {
+            "title": gallery.title,
+            "images": [_image(image.image, image.image_srcset) for image in gallery.images.all()],
+        }
+
+    payload = {"categories": categories, "gallery": gallery}
+    payload["etag"] = hashlib.sha1(
+        json.dumps(payload, sort_keys=True).encode()
+    ).hexdigest()[:16]
+    return payload
+
+
+def store_payload(payload):
+    conf = config()
+    get_backend().set(
+        PAYLOAD_KEY,
+        {"payload": payload, "fresh_until": time.time() + conf["TIMEOUT"]},
+        conf["STALE_TIMEOUT"],
+    )
+
+
+def refresh_payload():
+    """Пересобирает и кладёт payload (после изменения категорий или галереи)"""
+    payload = build_payload()
+    store_payload(payload)
+    return payload
+
+
+def _refresh_in_background():
+    backend = get_backend()
+    try:
+        refresh_payload()
+    except Exception:
+        logger.exception("Не удалось пересобрать данные главной")
+    finally:
+        backend.release_lock(PAYLOAD_KEY)
+        connections.close_all()
+
+
+def get_payload():
+    """
+    Payload главной из кэша. Устаревший отдаётся сразу, а пересборку
+    запускает в фоне один воркер (тот, кто взял блокировку). При холодном
+    кэше собирает тоже один воркер, остальные ждут его результата
+    """
+    conf = config()
+    backend = get_backend()
+    item = backend.get(PAYLOAD_KEY)
+    if item is not None:
+        if item["fresh_until"] <= time.time() and backend.add_lock(
+            PAYLOAD_KEY, conf["LOCK_TIMEOUT"]
+        ):
+            threading.Thread(target=_refresh_in_background, daemon=True).start()
+        return item["payload"]
+
+    if not backend.add_lock(PAYLOAD_KEY, conf["LOCK_TIMEOUT"]):
+        item = response_cache.wait_for(backend, PAYLOAD_KEY, conf["WAIT_TIMEOUT"])
+        if item is not None:
+            return item["payload"]
+        # Сборщик не успел: собираем сами, но не ждём дальше
+        return build_payload()
+    try:
+        return refresh_payload()
+    finally:
+        backend.release_lock(PAYLOAD_KEY)
@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "WIDTHS": [320, 640, 960],
+    # Порядок важен: браузер берёт первый поддерживаемый <source>
+    "FORMATS": ["avif", "webp", "jpeg"],
+    "QUALITY": 80,
+    # False — производные строятся сразу после коммита (тесты, отладка)
+    "ASYNC": True,
+}
+
+PIL_FORMATS = {"avif": "AVIF", "webp": "WEBP", "jpeg": "JPEG"}
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+EXTENSIONS = {"avif": "avif", "webp": "webp", "jpeg": "jpg"}
+
+# Модели с полями image и image_variants
+IMAGE_MODELS = ["main.category", "main.pizza", "main.romapizza", "main.drink", "main.actionimage"]
+
+# Манифест записан: sender — модель, pk — объект (витрину и версии обновляет main.signals)
+variants_applied = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "IMAGE_DERIVATIVES", {})}
+
+
+def supported_formats(formats):
+    """Форматы, которые умеет кодировать установленный Pillow"""
+    return [fmt for fmt in formats if fmt == "jpeg" or features.check(fmt)]
+
+
+def derivative_name(name, width, fmt):
+    """Pizza/2024/01/01/pepperoni.png -> Pizza/2024/01/01/pepperoni_640w.webp"""
+    root, _ = os.path.splitext(name)
+    return f"{root}_{width}w.{EXTENSIONS[fmt]}"
+
+
+def _encode(image, fmt, quality):
+    if fmt == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    buffer = BytesIO()
+    image.save(buffer, PIL_FORMATS[fmt], quality=quality)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_derivatives(name, overwrite=False):
+    """
+    Строит уменьшенные копии исходника name во всех форматах и кладёт их
+    рядом с ним. Возвращает манифест для image_variants. Не трогает БД,
+    поэтому годится для пула процессов
+    """
+    conf = config()
+    storage = default_storage
+
+    with storage.open(name) as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+
+    # Шире исходника не растягиваем: узкая картинка получает одну копию своей ширины
+    widths = sorted({min(width, image.width) for width in conf["WIDTHS"]})
+    formats = supported_formats(conf["FORMATS"])
+
+    for width in widths:
+        resized = None
+        for fmt in formats:
+            target = derivative_name(name, width, fmt)
+            if storage.exists(target):
+                if not overwrite:
+                    continue
+                storage.delete(target)
+            if resized is None:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            storage.save(target, _encode(resized, fmt, conf["QUALITY"]))
+
+    return {"source": name, "widths": widths, "formats": formats}
+
+
+def srcset(image, variants):
+    """
+    [{"format", "type", "srcset"}] для <picture>; пусто, пока производные
+    не построены или относятся к прежнему файлу
+    """
+    if not image or not variants or variants.get("source") != image.name:
+        return []
+    return [
+        {
+            "format": fmt,
+            "type": MIME_TYPES[fmt],
+            "srcset": ", ".join(
+                f"{image.storage.url(derivative_name(image.name, width, fmt))} {width}w"
+                for width in variants["widths"]
+            ),
+        }
+        for fmt in variants["formats"]
+    ]
+
+
+def needs_variants(instance):
+    return bool(instance.image) and instance.image_variants.get("source") != instance.image.name
+
+
+def apply_variants(model, pk, variants):
+    """
+    Сохраняет манифест одним UPDATE, если файл объекта не сменился за время
+    сборки. Без save(): валидация и сигналы сохранения тут не нужны, витрину
+    пересобирает получатель variants_applied после коммита (в пачке — один раз)
+    """
+    updated = model.objects.filter(pk=pk, image=variants["source"]).update(
+        image_variants=variants
+    )
+    if updated:
+        variants_applied.send(sender=model, pk=pk)
+    return bool(updated)
+
+
+def build_variants(label, pk, name):
+    """Производные файла name объекта label#pk; в БД пишется только манифест"""
+    # Файл мог быть удалён или ещё не доехать до хранилища
+    if not default_storage.exists(name):
+        return False
+    return apply_variants(apps.get_model(label), pk, generate_derivatives(name))
+
+
+def _build_in_background(label, pk, name):
+    try:
+        build_variants(label, pk, name)
+    except Exception:
+        logger.exception("Не удалось построить производные %s #%s", label, pk)
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="image-derivatives"
+                )
+    return _executor
+
+
+def schedule_variants(instance):
+    """
+    После коммита отдаёт сборку производных фоновому потоку —
+    сохранение в админке не ждёт Pillow
+    """
+    if not needs_variants(instance):
+        return
+    args = (instance._meta.label_lower, instance.pk, instance.image.name)
+    if config()["ASYNC"]:
+        transaction.on_commit(lambda: get_executor().submit(_build_in_background, *args))
+    else:
+        transaction.on_commit(lambda: build_variants(*args))
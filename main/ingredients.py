@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import CatalogEntry, CatalogEntryTopping
+from .versions import GLOBAL, current
+
+# Строки витрины, у которых есть состав
+PRODUCT_TYPES = [CatalogEntry.Type.PIZZA, CatalogEntry.Type.ROMA]
+
+DEFAULTS = {
+    # Сколько секунд индекс считается свежим без проверки версии меню.
+    # Внутри процесса он сбрасывается сразу после пересборки витрины,
+    # остальные воркеры увидят изменения не позже чем через TTL
+    "TTL": 1.0,
+    # Больше стольких совпадений список pk в SQL не отдаётся — фильтр
+    # строится подзапросами к индексу состава (main.facets)
+    "MAX_IDS": 500,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "TOPPING_INDEX", {})}
+
+
+class ToppingBitsetIndex:
+    """
+    Битовые маски состава пицц и римских пицц в памяти процесса.
+    Позиция строки витрины — номер бита; для каждого топпинга, группы топпингов
+    и категории хранится целое, где выставлены биты содержащих его позиций.
+    «Без грибов и морепродуктов» — два AND NOT над целыми, без NOT EXISTS в SQL.
+    Строится из индекса CatalogEntryTopping и перестраивается, когда меняется
+    глобальная версия меню; версия проверяется не чаще раза в TTL
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._built = None
+
+    def _build(self, version):
+        entries = list(
+            CatalogEntry.objects.filter(product_type__in=PRODUCT_TYPES)
+            .order_by("pk")
+            .values_list("pk", "category_id")
+        )
+        position = {pk: bit for bit, (pk, _) in enumerate(entries)}
+
+        categories = defaultdict(int)
+        for bit, (_, category_id) in enumerate(entries):
+            categories[category_id] |= 1 << bit
+
+        toppings, groups = defaultdict(int), defaultdict(int)
+        rows = CatalogEntryTopping.objects.filter(entry__product_type__in=PRODUCT_TYPES)
+        for entry_id, topping_id, top_category in rows.values_list(
+            "entry_id", "topping_id", "top_category"
+        ).iterator():
+            # Строка могла появиться после выборки entries — её не будет до следующей версии
+            if entry_id not in position:
+                continue
+            bit = 1 << position[entry_id]
+            toppings[topping_id] |= bit
+            groups[top_category] |= bit
+
+        return {
+            "version": version,
+            "entries": [pk for pk, _ in entries],
+            "all": (1 << len(entries)) - 1,
+            "categories": dict(categories),
+            "toppings": dict(toppings),
+            "groups": dict(groups),
+        }
+
+    def _index(self):
+        built = self._built
+        if built is not None and time.monotonic() - self._checked_at < config()["TTL"]:
+            return built
+
+        # Версия вместе со временем изменения: номера версий повторяются после отката
+        version = current([GLOBAL])[GLOBAL]
+        with self._lock:
+            if self._built is None or self._built["version"] != version:
+                self._built = self._build(version)
+            self._checked_at = time.monotonic()
+            return self._built
+
+    def match(self, category_id=None, toppings=(), groups=(), without=(), without_groups=(),
+              limit=None):
+        """
+        pk строк витрины: есть все toppings, хотя бы одна из groups,
+        нет ни одного из without и ни одного топпинга из without_groups.
+        None — совпадений больше limit
+        """
+        index = self._index()
+        mask = index["categories"].get(category_id, 0) if category_id else index["all"]
+
+        for topping_id in toppings:
+            mask &= index["toppings"].get(topping_id, 0)
+        if groups:
+            any_group = 0
+            for group in groups:
+                any_group |= index["groups"].get(group, 0)
+            mask &= any_group
+        for topping_id in without:
+            mask &= ~index["toppings"].get(topping_id, 0)
+        for group in without_groups:
+            mask &= ~index["groups"].get(group, 0)
+
+        if limit is not None and bin(mask).count("1") > limit:
+            return None
+        return self._decode(mask, index["entries"])
+
+    @staticmethod
+    def _decode(mask, entries):
+        # Поиск единиц в двоичной строке идёт в C и не зависит от числа нулей
+        bits = bin(mask)[:1:-1]
+        result = []
+        bit = bits.find("1")
+        while bit != -1:
+            result.append(entries[bit])
+            bit = bits.find("1", bit + 1)
+        return result
+
+
+_index = ToppingBitsetIndex()
+
+
+def match_entries(category_id=None, limit=None, **filters):
+    return _index.match(category_id, limit=limit, **filters)
+
+
+def invalidate():
+    _index.invalidate()
@@ -0,0 +1,247 @@
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("main.metrics")
+
+DEFAULTS = {
+    # Доля запросов, которые измеряются; остальные проходят без обёрток
+    "SAMPLE_RATE": 0.05,
+    # Сколько последних измерений хранить на каждый URL для перцентилей
+    "WINDOW": 1000,
+    # Отдавать заголовок Server-Timing (браузерные DevTools его показывают)
+    "SERVER_TIMING": True,
+}
+
+PERCENTILES = (50, 95, 99)
+# Числа и строки в SQL заменяются, чтобы N+1 с разными id считались повтором
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "REQUEST_METRICS", {})}
+
+
+def normalize_sql(sql):
+    return _LITERALS.sub("?", sql)
+
+
+class QueryRecorder:
+    """execute_wrapper: число запросов, время SQL и повторы одного шаблона"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        # Запросы одной страницы могут идти из нескольких потоков (main.parallel)
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.duration += duration
+                self.count += 1
+                self.statements[normalize_sql(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+
+class Metrics:
+    """Скользящие окна измерений по имени URL (main:index, admin:main_pizza_changelist)"""
+
+    FIELDS = ("total", "view", "template", "db", "queries", "duplicates")
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def add(self, name, record):
+        with self._lock:
+            self._samples[name].append(tuple(record[field] for field in self.FIELDS))
+
+    def snapshot(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+
+        result = {}
+        for name, rows in samples.items():
+            result[name] = {"count": len(rows)}
+            for index, field in enumerate(self.FIELDS):
+                values = sorted(row[index] for row in rows)
+                result[name][field] = {
+                    f"p{p}": values[min(len(values) - 1, len(values) * p // 100)]
+                    for p in PERCENTILES
+                }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+metrics = Metrics(config()["WINDOW"])
+
+
+# Recorder измеряемого запроса; контекст переходит в sync_to_async и потоки main.parallel
+_recorder = contextvars.ContextVar("request_metrics_recorder", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install(sender=None, connection=None, **kwargs):
+    # Объект соединения потока переживает переподключения — ставим один раз
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _install_on_thread():
+    for connection in connections.all():
+        _install(connection=connection)
+
+
+def install_query_wrapper():
+    """
+    Ставит _record_query на соединения этого потока и на все, что откроются
+    позже в любом потоке (пул main.parallel, потоки sync_to_async под ASGI)
+    """
+    connection_created.connect(_install, dispatch_uid="request_metrics")
+    _install_on_thread()
+
+
+def timed_render(request, response):
+    """
+    response.render() с учётом времени шаблона в метриках запроса. Так рисуют
+    и middleware (синхронные view), и async-view, отдающие ответ отрисованным
+    """
+    marks = getattr(request, "_metrics", None)
+    if marks is None or response.is_rendered:
+        return response.render()
+    start = time.perf_counter()
+    try:
+        return response.render()
+    finally:
+        marks["template"] += time.perf_counter() - start
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestMetricsMiddleware:
+    """
+    Для выборки запросов считает SQL (число, время, повторы), время view и
+    шаблона. Результат — заголовок Server-Timing, строка лога main.metrics
+    и перцентили по имени URL. Ставится первым в MIDDLEWARE
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install_query_wrapper()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        conf = config()
+        if random.random() >= conf["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        recorder, token, start = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self._finish(conf, request, response, recorder, start)
+
+    async def __acall__(self, request):
+        conf = config()
+        if random.random() >= conf["SAMPLE_RATE"]:
+            return await self.get_response(request)
+
+        recorder, token, start = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self._finish(conf, request, response, recorder, start)
+
+    def _start(self, request):
+        recorder = QueryRecorder()
+        request._metrics = {"view_start": None, "template": 0.0}
+        return recorder, _recorder.set(recorder), time.perf_counter()
+
+    def _finish(self, conf, request, response, recorder, start):
+        total = time.perf_counter() - start
+        record = self._record(request, recorder, start, total)
+        metrics.add(record["url"], record)
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if conf["SERVER_TIMING"]:
+            response["Server-Timing"] = self._server_timing(record)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, "_metrics"):
+            # Под ASGI process_view идёт в потоке sync_to_async, что и синхронная часть
+            # view; его соединение могло открыться раньше, чем появилась обёртка
+            _install_on_thread()
+            request._metrics["view_start"] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Первая в MIDDLEWARE вызывается последней: рисуем сами, чтобы замерить
+        # шаблон; обработчик Django потом увидит готовый ответ
+        if hasattr(request, "_metrics"):
+            timed_render(request, response)
+        return response
+
+    def _record(self, request, recorder, start, total):
+        marks = request._metrics
+        view_start = marks["view_start"] or start
+        # Всё, кроме шаблона, от начала view до ответа относится к view
+        template = marks["template"]
+        view = max(start + total - view_start - template, 0)
+        match = getattr(request, "resolver_match", None)
+        return {
+            "url": match.view_name if match else "unresolved",
+            "method": request.method,
+            "total": _ms(total),
+            "view": _ms(view),
+            "template": _ms(template),
+            "db": _ms(recorder.duration),
+            "queries": recorder.count,
+            "duplicates": recorder.duplicates,
+        }
+
+    def _server_timing(self, record):
+        return ", ".join([
+            f'db;dur={record["db"]};desc="{record["queries"]} queries, '
+            f'{record["duplicates"]} duplicates"',
+            f'view;dur={record["view"]}',
+            f'tpl;dur={record["template"]}',
+            f'total;dur={record["total"]}',
+        ])
@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.benchmark import compare_async_views, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержку, пропускную способность и число SQL-запросов главной, "
+        "каталога, товара и списков админки на синтетических меню разного размера. "
+        "Данные создаются в транзакции и откатываются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="100,1000,5000", help="Размеры меню (число пицц) через запятую"
+        )
+        parser.add_argument("--requests", type=int, default=20, help="Запросов на сценарий")
+        parser.add_argument(
+            "--scenario", action="append", help="Только указанные сценарии (index, product, ...)"
+        )
+        parser.add_argument("--output", help="JSON с результатами (по умолчанию benchmarks/)")
+        parser.add_argument(
+            "--compare-async",
+            action="store_true",
+            help="Сравнить синхронные и async-версии каталога и товара (меню коммитится и удаляется)",
+        )
+        parser.add_argument(
+            "--allow-commit",
+            action="store_true",
+            help="Подтверждение для --compare-async: меню коммитится в базу POSTGRES_DB, лучше отдельную",
+        )
+        parser.add_argument(
+            "--latency-ms", type=float, default=5.0, help="Искусственная задержка каждого SQL-запроса"
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size.strip()]
+        if options["compare_async"]:
+            if not options["allow_commit"]:
+                raise CommandError(
+                    "--compare-async коммитит синтетическое меню в базу по умолчанию. "
+                    "Запустите на отдельной базе и подтвердите флагом --allow-commit"
+                )
+            report = compare_async_views(
+                sizes,
+                requests=options["requests"],
+                latency_ms=options["latency_ms"],
+                progress=lambda message: self.stderr.write(message),
+                allow_commit=True,
+            )
+        else:
+            report = run_benchmark(
+                sizes,
+                requests=options["requests"],
+                only=options["scenario"],
+                progress=lambda message: self.stderr.write(message),
+            )
+
+        output = options["output"]
+        if not output:
+            stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+            output = Path(settings.BASE_DIR) / "benchmarks" / f"{stamp}-{report['revision']}.json"
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+
+        for row in report["results"]:
+            if "latency_ms" in row:
+                self.stdout.write(
+                    f"{row['menu_size']:>6} {row['scenario']:<28} {row['cache']:<5} "
+                    f"p50={row['latency_ms']['p50']:>8}ms p95={row['latency_ms']['p95']:>8}ms "
+                    f"rps={row['throughput_rps']:>7} queries={row['queries']['max']}"
+                )
+            elif "speedup" in row:
+                self.stdout.write(
+                    f"{row['menu_size']:>6} {row['scenario']:<10} "
+                    f"sync p50={row['sync_ms']['p50']:>8}ms async p50={row['async_ms']['p50']:>8}ms "
+                    f"x{row['speedup']}"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {output}"))
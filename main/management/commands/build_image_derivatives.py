@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from main.images import IMAGE_MODELS, apply_variants, generate_derivatives, needs_variants
+
+
+# Манифестов в одной транзакции: витрина пересобирается один раз на пачку
+APPLY_BATCH = 100
+
+
+def apply_batch(batch):
+    with transaction.atomic():
+        return sum(apply_variants(model, pk, variants) for model, pk, variants in batch)
+
+
+class Command(BaseCommand):
+    help = "Строит производные изображений (WebP/AVIF/JPEG по ширинам) в пуле процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1, help="Число процессов"
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Пересобрать и уже построенные производные"
+        )
+        parser.add_argument(
+            "--model", action="append", choices=IMAGE_MODELS, help="Только указанные модели"
+        )
+
+    def handle(self, *args, **options):
+        jobs = []
+        for label in options["model"] or IMAGE_MODELS:
+            model = apps.get_model(label)
+            for instance in model.objects.exclude(image="").exclude(image__isnull=True).only(
+                "pk", "image", "image_variants"
+            ):
+                if options["force"] or needs_variants(instance):
+                    jobs.append((model, instance.pk, instance.image.name))
+
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS("Все производные уже построены"))
+            return
+
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+
+        # Pillow работает в процессах, запись манифестов — в основном процессе
+        done = failed = 0
+        batch = []
+        build = partial(generate_derivatives, overwrite=options["force"])
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {pool.submit(build, name): (model, pk) for model, pk, name in jobs}
+            for future in as_completed(futures):
+                model, pk = futures[future]
+                try:
+                    variants = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{model._meta.label} #{pk}: {exc}")
+                    continue
+                batch.append((model, pk, variants))
+                if len(batch) >= APPLY_BATCH:
+                    done += apply_batch(batch)
+                    batch = []
+        done += apply_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Производные построены: {done}, ошибок: {failed}"))
@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from main.menu_io import BATCH_SIZE, export_records, write_csv, write_jsonl
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv}
+
+
+class Command(BaseCommand):
+    help = "Потоковый экспорт всего меню в JSONL или CSV (в порядке, пригодном для import_menu)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", nargs="?", help="Файл (по умолчанию stdout)")
+        parser.add_argument("--format", choices=WRITERS, help="По умолчанию — по расширению файла")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        fmt = options["format"] or ("csv" if output and output.endswith(".csv") else "jsonl")
+        records = export_records(batch_size=options["batch_size"])
+
+        if output:
+            with open(output, "w", encoding="utf-8", newline="") as stream:
+                count = WRITERS[fmt](records, stream)
+            self.stderr.write(self.style.SUCCESS(f"Экспортировано записей: {count} -> {output}"))
+        else:
+            WRITERS[fmt](records, sys.stdout)
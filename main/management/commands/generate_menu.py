@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.synthetic import generate_menu
+
+
+class Command(BaseCommand):
+    help = "Генерирует синтетическое меню заданного размера (для нагрузочных проверок)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pizzas", type=int, default=1000, help="Число пицц")
+        parser.add_argument("--categories", type=int, default=4)
+        parser.add_argument("--toppings", type=int, default=60)
+        parser.add_argument(
+            "--combo-items", type=int, default=6, help="Максимум позиций каждого типа в комбо"
+        )
+        parser.add_argument("--gallery-images", type=int, default=8)
+        parser.add_argument("--prefix", default="synthetic", help="Префикс названий и slug")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            summary = generate_menu(
+                options["pizzas"],
+                prefix=options["prefix"],
+                seed=options["seed"],
+                categories=options["categories"],
+                toppings=options["toppings"],
+                combo_items=(1, options["combo_items"]),
+                gallery_images=options["gallery_images"],
+            )
+        rows = ", ".join(f"{k}={v}" for k, v in summary.items() if isinstance(v, int))
+        self.stdout.write(self.style.SUCCESS(f"Меню создано: {rows}"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.menu_io import BATCH_SIZE, MenuImportError, import_menu, read_csv, read_jsonl
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+class Command(BaseCommand):
+    help = (
+        "Потоковый импорт меню из JSONL или CSV: проверка и запись пачками "
+        "(bulk_create/bulk_update), одной транзакцией"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Файл, созданный export_menu")
+        parser.add_argument("--format", choices=READERS, help="По умолчанию — по расширению файла")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Только проверить файл, ничего не записывая"
+        )
+
+    def handle(self, *args, **options):
+        path = options["input"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+
+        with open(path, encoding="utf-8", newline="") as stream:
+            try:
+                counts = import_menu(
+                    READERS[fmt](stream),
+                    batch_size=options["batch_size"],
+                    dry_run=options["dry_run"],
+                )
+            except MenuImportError as exc:
+                raise CommandError("\n".join([str(exc), *exc.errors]))
+
+        summary = ", ".join(f"{kind}: {count}" for kind, count in counts.items())
+        prefix = "Проверено" if options["dry_run"] else "Импортировано"
+        self.stdout.write(self.style.SUCCESS(f"{prefix} — {summary}"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.payments import run_once
+
+
+class Command(BaseCommand):
+    help = "Фоновый воркер оплаты: создаёт платежи и применяет события вебхуков"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Один проход и выход")
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--sleep", type=float, default=1.0, help="Пауза, если работы нет (сек.)"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_once(batch_size=options["batch_size"])
+            if options["once"]:
+                self.stdout.write(f"Обработано: {processed}")
+                return
+            if not processed:
+                time.sleep(options["sleep"])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.catalog import rebuild_entries
+from main.slugs import rebuild_registry
+
+
+class Command(BaseCommand):
+    help = "Полностью пересобирает реестр slug и витрину каталога (CatalogEntry)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="Размер пачки bulk_create"
+        )
+
+    def handle(self, *args, **options):
+        slugs = rebuild_registry(batch_size=options["batch_size"])
+        total = rebuild_entries(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Реестр slug: {slugs} товаров"))
+        self.stdout.write(self.style.SUCCESS(f"Витрина пересобрана: {total} позиций"))
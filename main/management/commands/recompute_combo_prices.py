@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import Combo
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сохранённую цену позиций всех комбо одним запросом"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = dict(Combo.objects.values_list("pk", "items_price"))
+            Combo.objects.all().recompute_items_price()
+            after = Combo.objects.values_list("pk", "name", "items_price")
+
+            changed = 0
+            for pk, name, price in after:
+                if before.get(pk) != price:
+                    changed += 1
+                    self.stdout.write(f"{name}: {before.get(pk)} -> {price}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Пересчитано комбо: {len(before)}, исправлено: {changed}")
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import Pizza, Toppings
+from main.repricing import RepricingError, format_diff, reprice
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовое изменение цен пицц или топпингов одним UPDATE: "
+        "--percent 7, --multiplier L=1.65 (только с авторасчётом), --round-to 9"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=["pizza", "topping"], default="pizza")
+        parser.add_argument("--category", help="slug категории пицц")
+        rule = parser.add_mutually_exclusive_group(required=True)
+        rule.add_argument("--percent", help="Изменение цен в процентах, например 7 или -5")
+        rule.add_argument("--multiplier", help="Коэффициент размера, например L=1.65")
+        rule.add_argument("--round-to", type=int, help="Последняя цифра цены, например 9")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать изменения")
+
+    def handle(self, *args, **options):
+        if options["target"] == "pizza":
+            queryset = Pizza.objects.all()
+            if options["category"]:
+                queryset = queryset.filter(category__slug=options["category"])
+        else:
+            if options["category"]:
+                raise CommandError("--category применяется только к пиццам")
+            queryset = Toppings.objects.all()
+
+        if options["percent"] is not None:
+            rule, args = "percent", [options["percent"]]
+        elif options["multiplier"] is not None:
+            size, _, value = options["multiplier"].partition("=")
+            rule, args = "multiplier", [size.upper(), value]
+        else:
+            rule, args = "round", [options["round_to"]]
+
+        try:
+            diff = reprice(queryset, rule, *args, dry_run=options["dry_run"])
+        except (RepricingError, ArithmeticError) as exc:
+            raise CommandError(exc)
+
+        for line in format_diff(diff):
+            self.stdout.write(line)
+        verb = "Будет изменено" if options["dry_run"] else "Изменено"
+        self.stdout.write(self.style.SUCCESS(f"{verb} позиций: {len(diff)}"))
@@ -8,6 +8,9 @@ def map_pizza(pizza):
         "slug": pizza.slug,
         "name": pizza.name,
         "image": pizza.image.url if pizza.image else None,
+        "srcset": pizza.image_srcset,
+        "new": pizza.new,
+        "available": pizza.is_available,
 
         "price": default["price"],
         "weight": default["weight"],
@@ -28,6 +31,9 @@ def map_roma_pizza(pizza):
         "price": pizza.price,
         "weight": pizza.weight,
         "image": pizza.image.url if pizza.image else None,
+        "srcset": pizza.image_srcset,
+        "new": pizza.new,
+        "available": pizza.is_available,
         "toppings": [t.name for t in pizza.toppings.all()],
     }
 
@@ -42,6 +48,8 @@ def map_drink(drink_size):
         "volume": drink_size.volume_ml,
         "size": drink_size.size,
         "image": drink_size.drink.image.url if drink_size.drink.image else None,
+        "srcset": drink_size.drink.image_srcset,
+        "new": drink_size.drink.new,
     }
 
 
@@ -52,4 +60,5 @@ def map_combo(combo):
         "slug": combo.slug,
         "name": combo.name,
         "price": combo.get_final_price(),
+        "available": combo.is_available,
     }
\ No newline at end of file
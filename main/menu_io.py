@@ -0,0 +1,461 @@
+import csv
+import json
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .catalog import rebuild_entries
+from .home import refresh_payload
+from .models import (
+    Category,
+    Combo,
+    ComboDrink,
+    ComboPizza,
+    ComboRomaPizza,
+    Drink,
+    DrinkSize,
+    Pizza,
+    ProductSlug,
+    RomaPizza,
+    Toppings,
+)
+from .slugs import rebuild_registry
+
+BATCH_SIZE = 1000
+
+# Порядок зависимостей: категории и топпинги раньше товаров, товары раньше комбо.
+# В этом же порядке пишет экспорт
+RECORD_TYPES = ["category", "topping", "pizza", "roma", "drink", "combo"]
+
+MODELS = {
+    "category": Category,
+    "topping": Toppings,
+    "pizza": Pizza,
+    "roma": RomaPizza,
+    "drink": Drink,
+    "combo": Combo,
+}
+
+# Естественный ключ записи: по нему импорт отличает новую позицию от изменённой
+KEYS = {"category": "slug", "topping": "name"}
+
+SCALAR_FIELDS = {
+    "category": ["slug", "name", "image"],
+    "topping": ["name", "price", "is_active", "top_category", "order"],
+    "pizza": [
+        "slug", "name", "category", "image", "new", "is_active",
+        "base_price_s", "base_weight_s", "auto_calculate",
+        "price_multiplier_m", "price_multiplier_l", "price_multiplier_xl",
+        "weight_multiplier_m", "weight_multiplier_l", "weight_multiplier_xl",
+        "price_m", "price_l", "price_xl", "weight_m", "weight_l", "weight_xl",
+    ],
+    "roma": ["slug", "name", "category", "price", "image", "weight", "new"],
+    "drink": ["slug", "name", "category", "image", "new", "description"],
+    "combo": ["slug", "name", "category", "price"],
+}
+
+# Вложенные списки: в JSONL — как есть, в CSV — JSON в ячейке
+NESTED_FIELDS = {
+    "pizza": ["toppings"],
+    "roma": ["toppings"],
+    "drink": ["sizes"],
+    "combo": ["pizzas", "romas", "drinks"],
+}
+
+CSV_COLUMNS = ["type"] + list(dict.fromkeys(
+    name
+    for kind in RECORD_TYPES
+    for name in SCALAR_FIELDS[kind] + NESTED_FIELDS.get(kind, [])
+))
+NESTED_COLUMNS = {name for names in NESTED_FIELDS.values() for name in names}
+
+
+class MenuImportError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Ошибок в файле меню: {len(errors)}")
+
+
+def _key(kind):
+    return KEYS.get(kind, "slug")
+
+
+def _scalar(obj, name):
+    if name == "category":
+        return obj.category.slug
+    if name == "image":
+        return obj.image.name or None
+    return getattr(obj, name)
+
+
+def _record(kind, obj, **nested):
+    return {"type": kind, **{name: _scalar(obj, name) for name in SCALAR_FIELDS[kind]}, **nested}
+
+
+def export_records(batch_size=BATCH_SIZE):
+    """
+    Меню по одной записи в порядке зависимостей. Таблицы читаются чанками
+    через iterator(), связанные строки — prefetch на каждый чанк
+    """
+    for category in Category.objects.order_by("pk").iterator(chunk_size=batch_size):
+        yield _record("category", category)
+
+    for topping in Toppings.objects.order_by("pk").iterator(chunk_size=batch_size):
+        yield _record("topping", topping)
+
+    for kind, model in (("pizza", Pizza), ("roma", RomaPizza)):
+        queryset = model.objects.select_related("category").prefetch_related("toppings")
+        for item in queryset.order_by("pk").iterator(chunk_size=batch_size):
+            yield _record(kind, item, toppings=[t.name for t in item.toppings.all()])
+
+    drinks = Drink.objects.select_related("category").prefetch_related(
+        Prefetch("variants", queryset=DrinkSize.objects.order_by("size"))
+    )
+    for drink in drinks.order_by("pk").iterator(chunk_size=batch_size):
+        yield _record(
+            "drink", drink, sizes=[{"size": s.size, "price": s.price} for s in drink.variants.all()]
+        )
+
+    combos = Combo.objects.select_related("category").prefetch_related(
+        Prefetch("combopizza_set", queryset=ComboPizza.objects.select_related("pizza")),
+        Prefetch(
+            "comboromapizza_set", queryset=ComboRomaPizza.objects.select_related("roman_pizza")
+        ),
+        Prefetch(
+            "combodrink_set", queryset=ComboDrink.objects.select_related("drink_size__drink")
+        ),
+    )
+    for combo in combos.order_by("pk").iterator(chunk_size=batch_size):
+        yield _record(
+            "combo",
+            combo,
+            pizzas=[
+                {"slug": item.pizza.slug, "size": item.size, "quantity": item.quantity}
+                for item in combo.combopizza_set.all()
+                if item.pizza
+            ],
+            romas=[
+                {"slug": item.roman_pizza.slug, "quantity": item.quantity}
+                for item in combo.comboromapizza_set.all()
+            ],
+            drinks=[
+                {
+                    "slug": item.drink_size.drink.slug,
+                    "size": item.drink_size.size,
+                    "quantity": item.quantity,
+                }
+                for item in combo.combodrink_set.all()
+                if item.drink_size
+            ],
+        )
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, cls=DjangoJSONEncoder)
+
+
+def write_jsonl(records, stream):
+    count = 0
+    for record in records:
+        stream.write(_dumps(record) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(records, stream):
+    writer = csv.DictWriter(stream, CSV_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow({
+            name: _dumps(value) if name in NESTED_COLUMNS else value
+            for name, value in record.items()
+        })
+        count += 1
+    return count
+
+
+def read_jsonl(stream):
+    """(номер строки, запись) без чтения файла целиком"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as exc:
+            raise MenuImportError([f"строка {number}: некорректный JSON ({exc})"])
+
+
+def read_csv(stream):
+    """Пустая ячейка — поле не задано; вложенные списки лежат в ячейках как JSON"""
+    for number, row in enumerate(csv.DictReader(stream), 2):
+        record = {name: value for name, value in row.items() if value not in ("", None)}
+        try:
+            for name in NESTED_COLUMNS & record.keys():
+                record[name] = json.loads(record[name])
+        except ValueError as exc:
+            raise MenuImportError([f"строка {number}: некорректный JSON в ячейке ({exc})"])
+        yield number, record
+
+
+class MenuImporter:
+    """
+    Потоковый импорт: записи копятся пачками по типам, пачка проверяется без
+    запросов на строку и пишется bulk_create/bulk_update. Перед пачкой типа
+    сбрасываются пачки типов, от которых он зависит
+    """
+
+    MAX_ERRORS = 50
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.buffers = {kind: [] for kind in RECORD_TYPES}
+        self.counts = Counter()
+        self.errors = []
+        # Справочники небольшие и нужны каждой пачке товаров
+        self.categories = dict(Category.objects.values_list("slug", "pk"))
+        self.toppings = dict(Toppings.objects.values_list("name", "pk"))
+        # slug -> тип товара для проверки конфликтов между типами внутри файла
+        self.product_slugs = {}
+
+    def run(self, records):
+        for line, record in records:
+            kind = record.get("type")
+            if kind not in MODELS:
+                self.error(line, f"неизвестный тип записи {kind!r}")
+                continue
+            self.buffers[kind].append((line, record))
+            if len(self.buffers[kind]) >= self.batch_size:
+                self.flush(kind)
+        self.flush(RECORD_TYPES[-1])
+
+        if self.errors:
+            raise MenuImportError(self.errors)
+        return self.counts
+
+    def error(self, line, message):
+        self.errors.append(f"строка {line}: {message}")
+        if len(self.errors) >= self.MAX_ERRORS:
+            raise MenuImportError(self.errors)
+
+    def flush(self, kind):
+        for current in RECORD_TYPES[: RECORD_TYPES.index(kind) + 1]:
+            rows, self.buffers[current] = self.buffers[current], []
+            if not rows:
+                continue
+            built = self._build(current, rows)
+            if current in ("pizza", "roma", "drink", "combo"):
+                built = self._check_slugs(current, built)
+            if current == "combo":
+                built = self._resolve_combo_items(built)
+            self._upsert(current, built)
+            self.counts[current] += len(built)
+
+    def _build(self, kind, rows):
+        """Экземпляры моделей с проверкой полей; к БД не обращается"""
+        model, key = MODELS[kind], _key(kind)
+        built, seen = [], set()
+        for line, record in rows:
+            try:
+                values = {
+                    name: model._meta.get_field(name).to_python(record[name])
+                    for name in SCALAR_FIELDS[kind]
+                    if name in record and name != "category"
+                }
+                obj = model(**values)
+                if "category" in SCALAR_FIELDS[kind]:
+                    if record.get("category") not in self.categories:
+                        raise ValidationError(f"категория {record.get('category')!r} не найдена")
+                    obj.category_id = self.categories[record["category"]]
+                # Проверка FK в clean_fields делает запрос — категория уже сверена выше
+                obj.clean_fields(exclude=["category"])
+                if kind == "pizza":
+                    obj.validate_size_fields()
+                nested = self._build_nested(kind, record)
+            except ValidationError as exc:
+                self.error(line, "; ".join(exc.messages))
+                continue
+
+            value = getattr(obj, key)
+            if value in seen:
+                self.error(line, f"повторяется {key} {value!r}")
+                continue
+            seen.add(value)
+            built.append((line, obj, nested))
+        return built
+
+    def _build_nested(self, kind, record):
+        if kind in ("pizza", "roma"):
+            missing = [name for name in record.get("toppings", []) if name not in self.toppings]
+            if missing:
+                raise ValidationError(f"топпинги не найдены: {', '.join(missing)}")
+            return [self.toppings[name] for name in record.get("toppings", [])]
+
+        if kind == "drink":
+            sizes = []
+            for item in record.get("sizes", []):
+                size = DrinkSize(size=item.get("size"), price=item.get("price"))
+                size.clean_fields(exclude=["drink"])
+                sizes.append(size)
+            return sizes
+
+        if kind == "combo":
+            return {name: record.get(name, []) for name in NESTED_FIELDS["combo"]}
+        return None
+
+    def _check_slugs(self, kind, built):
+        """Slug товара уникален среди всех типов: один запрос к реестру на пачку"""
+        product_type = MODELS[kind].product_type
+        taken = dict(
+            ProductSlug.objects.filter(slug__in=[obj.slug for _, obj, _ in built])
+            .exclude(product_type=product_type)
+            .values_list("slug", "product_type")
+        )
+        checked = []
+        for line, obj, nested in built:
+            other = self.product_slugs.get(obj.slug) or taken.get(obj.slug)
+            if other and other != product_type:
+                self.error(line, f"slug {obj.slug!r} уже занят ({other})")
+                continue
+            self.product_slugs[obj.slug] = product_type
+            checked.append((line, obj, nested))
+        return checked
+
+    def _resolve_combo_items(self, built):
+        """Ссылки комбо на товары по slug: по одному запросу на тип"""
+        items = [nested for _, _, nested in built]
+        pizzas = dict(Pizza.objects.filter(
+            slug__in={i["slug"] for n in items for i in n["pizzas"]}
+        ).values_list("slug", "pk"))
+        romas = dict(RomaPizza.objects.filter(
+            slug__in={i["slug"] for n in items for i in n["romas"]}
+        ).values_list("slug", "pk"))
+        sizes = {
+            (slug, size): pk
+            for slug, size, pk in DrinkSize.objects.filter(
+                drink__slug__in={i["slug"] for n in items for i in n["drinks"]}
+            ).values_list("drink__slug", "size", "pk")
+        }
+
+        resolved = []
+        for line, combo, nested in built:
+            try:
+                rows = [
+                    ComboPizza(
+                        pizza_id=pizzas[i["slug"]],
+                        size=i.get("size", "M"),
+                        quantity=i.get("quantity", 1),
+                    )
+                    for i in nested["pizzas"]
+                ] + [
+                    ComboRomaPizza(roman_pizza_id=romas[i["slug"]], quantity=i.get("quantity", 1))
+                    for i in nested["romas"]
+                ] + [
+                    ComboDrink(
+                        drink_size_id=sizes[i["slug"], i.get("size")],
+                        quantity=i.get("quantity", 1),
+                    )
+                    for i in nested["drinks"]
+                ]
+            except KeyError as exc:
+                self.error(line, f"позиция комбо не найдена: {exc.args[0]}")
+                continue
+            resolved.append((line, combo, rows))
+        return resolved
+
+    def _upsert(self, kind, built):
+        model, key = MODELS[kind], _key(kind)
+        existing = dict(
+            model.objects.filter(**{f"{key}__in": [getattr(obj, key) for _, obj, _ in built]})
+            .values_list(key, "pk")
+        )
+        create, update = [], []
+        for _, obj, _ in built:
+            obj.pk = existing.get(getattr(obj, key))
+            (update if obj.pk else create).append(obj)
+
+        model.objects.bulk_create(create, batch_size=self.batch_size)
+        fields = [name for name in SCALAR_FIELDS[kind] if name != key]
+        model.objects.bulk_update(update, fields, batch_size=self.batch_size)
+
+        objects = [obj for _, obj, _ in built]
+        if kind == "category":
+            self.categories.update((obj.slug, obj.pk) for obj in objects)
+        elif kind == "topping":
+            self.toppings.update((obj.name, obj.pk) for obj in objects)
+        elif kind == "pizza":
+            self._replace_toppings(Pizza.toppings.through, "pizza_id", built)
+        elif kind == "roma":
+            self._replace_toppings(RomaPizza.toppings.through, "romapizza_id", built)
+        elif kind == "drink":
+            self._upsert_sizes(built)
+        elif kind == "combo":
+            for through in (ComboPizza, ComboRomaPizza, ComboDrink):
+                through.objects.filter(combo__in=objects).delete()
+            rows = []
+            for _, combo, items in built:
+                for item in items:
+                    item.combo_id = combo.pk
+                    rows.append(item)
+            for through in (ComboPizza, ComboRomaPizza, ComboDrink):
+                through.objects.bulk_create(
+                    [row for row in rows if isinstance(row, through)], batch_size=self.batch_size
+                )
+
+    def _replace_toppings(self, through, field, built):
+        """M2M топпингов: старые связи пачки удаляются, новые вставляются одним bulk_create"""
+        through.objects.filter(**{f"{field}__in": [obj.pk for _, obj, _ in built]}).delete()
+        through.objects.bulk_create(
+            [
+                through(**{field: obj.pk, "toppings_id": topping_id})
+                for _, obj, topping_ids in built
+                for topping_id in topping_ids
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def _upsert_sizes(self, built):
+        """Размеры напитков сопоставляются по (напиток, размер); лишние удаляются"""
+        drinks = [obj.pk for _, obj, _ in built]
+        existing = {
+            (drink_id, size): pk
+            for pk, drink_id, size in DrinkSize.objects.filter(drink__in=drinks).values_list(
+                "pk", "drink_id", "size"
+            )
+        }
+        create, update = [], []
+        for _, drink, sizes in built:
+            for size in sizes:
+                size.drink_id = drink.pk
+                size.pk = existing.get((drink.pk, size.size))
+                (update if size.pk else create).append(size)
+
+        DrinkSize.objects.filter(drink__in=drinks).exclude(
+            pk__in=[size.pk for size in update]
+        ).delete()
+        DrinkSize.objects.bulk_create(create, batch_size=self.batch_size)
+        DrinkSize.objects.bulk_update(update, ["price"], batch_size=self.batch_size)
+
+
+def import_menu(records, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Импорт меню одной транзакцией: при ошибках ничего не записывается.
+    Производные данные (цены комбо, реестр slug, витрина) пересобираются
+    один раз в конце
+    """
+    with transaction.atomic():
+        counts = MenuImporter(batch_size).run(records)
+        if dry_run:
+            transaction.set_rollback(True)
+            return counts
+
+        Combo.objects.all().recompute_items_price()
+        rebuild_registry(batch_size=batch_size)
+        rebuild_entries(batch_size=batch_size)
+        refresh_payload()
+    return counts
@@ -1,15 +1,59 @@
+import uuid
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.search import SearchVectorField
+
+from .images import srcset
 
 # Create your models here.
 
 
-class Category(models.Model):
+class ProductType(models.TextChoices):
+    PIZZA = "pizza", "Пицца"
+    ROMA = "roma", "Римская пицца"
+    DRINK = "drink", "Напиток"
+    COMBO = "combo", "Комбо"
+
+
+class ImageVariantsMixin:
+    """srcset производных image (см. main.images) для шаблонов и мапперов"""
+
+    @property
+    def image_srcset(self):
+        return srcset(self.image, self.image_variants)
+
+
+class ProductSlugMixin:
+    """Проверка уникальности slug среди всех типов товаров (по ProductSlug)"""
+
+    product_type = None
+
+    def clean(self):
+        super().clean()
+        if not self.slug:
+            return
+        taken = ProductSlug.objects.filter(slug=self.slug).exclude(
+            product_type=self.product_type, object_id=self.pk
+        )
+        if taken.exists():
+            raise ValidationError({"slug": "Этот slug уже занят другим товаром"})
+
+
+class Category(ImageVariantsMixin, models.Model):
     name = models.CharField(max_length=30, unique=True)
     slug = models.SlugField(max_length=40, unique=True)
     image = models.ImageField(upload_to="Categories/%Y/%m/%d")
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения"
+    )
 
     class Meta:
         ordering = ["name"]
@@ -57,7 +101,9 @@ class Toppings(models.Model):
         return f"{self.name} (+{self.price} руб)"
 
 
-class Drink(models.Model):
+class Drink(ImageVariantsMixin, ProductSlugMixin, models.Model):
+    product_type = ProductType.DRINK
+
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
@@ -66,6 +112,9 @@ class Drink(models.Model):
     name = models.CharField(max_length=30, unique=True)
     slug = models.SlugField(max_length=40, unique=True)
     image = models.ImageField(upload_to="Drinks/%Y/%m/%d")
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения"
+    )
     new = models.BooleanField(default=False)
     description = models.TextField(max_length=250)
 
@@ -105,18 +154,89 @@ class DrinkSize(models.Model):
         return f"{self.drink.name} — {self.volume_ml}"
 
 
-class RomaPizza(models.Model):
+class RomaPizza(ImageVariantsMixin, ProductSlugMixin, models.Model):
+    product_type = ProductType.ROMA
+
     name = models.CharField(max_length=30, unique=True)
     slug = models.SlugField(max_length=40, unique=True)
     price = models.DecimalField(decimal_places=2, max_digits=8)
     image = models.ImageField(upload_to="RomaPizza/%Y/%m/%d")
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения"
+    )
     weight = models.PositiveIntegerField(default=400)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     new = models.BooleanField(default=False)
+    # Поддерживается main.availability: состав без топпингов из стоп-листа
+    is_available = models.BooleanField(default=True, editable=False, verbose_name="В продаже")
     toppings = models.ManyToManyField(Toppings)
 
 
-class Pizza(models.Model):
+PIZZA_SIZE_SUFFIXES = {"M": "m", "L": "l", "XL": "xl"}
+
+
+def _scaled_by_multiplier(base, multiplier):
+    """
+    base * multiplier с отбрасыванием дробной части, как int() в Python.
+    Коэффициент переводится в сотые, чтобы деление было целочисленным
+    и не зависело от float-арифметики СУБД
+    """
+    hundredths = Cast(Round(F(multiplier) * 100), models.IntegerField())
+    return models.ExpressionWrapper(
+        F(base) * hundredths / 100, output_field=models.IntegerField()
+    )
+
+
+def pizza_size_expression(kind, size, prefix=""):
+    """
+    SQL-аналог Pizza.get_price_for_size / get_weight_for_size.
+    kind — "price" или "weight", prefix — путь до пиццы (например "pizza__")
+    """
+    base = f"{prefix}base_{kind}_s"
+    if size == "S":
+        return F(base)
+
+    suffix = PIZZA_SIZE_SUFFIXES[size]
+    return Case(
+        When(
+            **{f"{prefix}auto_calculate": True},
+            then=_scaled_by_multiplier(base, f"{prefix}{kind}_multiplier_{suffix}"),
+        ),
+        default=F(f"{prefix}{kind}_{suffix}"),
+        output_field=models.IntegerField(),
+    )
+
+
+class PizzaQuerySet(models.QuerySet):
+    @staticmethod
+    def size_field(kind, size):
+        """Имя аннотации из with_size_prices: size_price_m, size_weight_xl и т.д."""
+        return f"size_{kind}_{size.lower()}"
+
+    def with_size_prices(self):
+        """Аннотирует цену и вес каждого размера по правилам get_price_for_size"""
+        return self.annotate(
+            **{
+                self.size_field(kind, size): pizza_size_expression(kind, size)
+                for kind in ("price", "weight")
+                for size, _ in Pizza.SIZE_CHOICES
+            }
+        )
+
+    def price_between(self, size, min_price=None, max_price=None):
+        """Фильтр по цене конкретного размера (границы включительно)"""
+        queryset = self.with_size_prices()
+        field = self.size_field("price", size)
+        if min_price is not None:
+            queryset = queryset.filter(**{f"{field}__gte": min_price})
+        if max_price is not None:
+            queryset = queryset.filter(**{f"{field}__lte": max_price})
+        return queryset
+
+
+class Pizza(ImageVariantsMixin, ProductSlugMixin, models.Model):
+    product_type = ProductType.PIZZA
+
     SIZE_CHOICES = [
         ("S", "Маленькая (25 см)"),
         ("M", "Средняя (30 см)"),
@@ -129,6 +249,9 @@ class Pizza(models.Model):
     image = models.ImageField(
         upload_to="Pizza/%Y/%m/%d", blank=True, null=True, verbose_name="Изображение"
     )
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения"
+    )
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
@@ -137,6 +260,8 @@ class Pizza(models.Model):
     )
     new = models.BooleanField(default=False, verbose_name="Новинка")
     is_active = models.BooleanField(default=True, verbose_name="Активна")
+    # Поддерживается main.availability: состав без топпингов из стоп-листа
+    is_available = models.BooleanField(default=True, editable=False, verbose_name="В продаже")
     toppings = models.ManyToManyField(Toppings, blank=True, verbose_name="Ингредиенты")
 
     # Базовые параметры для размера S (это будут значения по умолчанию)
@@ -202,6 +327,8 @@ class Pizza(models.Model):
         null=True, blank=True, verbose_name="Вес XL"
     )
 
+    objects = PizzaQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
         verbose_name = "Пицца"
@@ -248,6 +375,17 @@ class Pizza(models.Model):
         }
         return manual_prices.get(size)
 
+    def get_topping_scale(self, size):
+        """Во сколько раз топпинг дороже, чем на S: как цена самой пиццы"""
+        if size == "S":
+            return Decimal(1)
+        if self.auto_calculate:
+            return getattr(self, f"price_multiplier_{PIZZA_SIZE_SUFFIXES[size]}")
+        price = self.get_price_for_size(size)
+        if not price or not self.base_price_s:
+            return Decimal(1)
+        return Decimal(price) / self.base_price_s
+
     def get_weight_for_size(self, size):
 
         if size == "S":
@@ -297,6 +435,11 @@ class Pizza(models.Model):
 
     def clean(self):
         """Валидация при сохранении модели"""
+        super().clean()
+        self.validate_size_fields()
+
+    def validate_size_fields(self):
+        """Правило ручных размеров без обращений к БД (его же вызывает импорт меню)"""
         if not self.auto_calculate:
             required_fields = [
                 self.price_m,
@@ -319,7 +462,56 @@ class Pizza(models.Model):
         super().save(*args, **kwargs)
 
 
-class Combo(models.Model):
+class ComboQuerySet(models.QuerySet):
+    @staticmethod
+    def items_price_expression():
+        """SQL-аналог Combo.get_items_price для подзапроса по OuterRef("pk")"""
+        price = models.DecimalField(max_digits=8, decimal_places=2)
+
+        pizzas = (
+            ComboPizza.objects.filter(combo=OuterRef("pk"), pizza__isnull=False)
+            .values("combo")
+            .annotate(total=Sum(ComboPizzaQuerySet.unit_price_expression() * F("quantity")))
+            .values("total")
+        )
+        romas = (
+            ComboRomaPizza.objects.filter(combo=OuterRef("pk"))
+            .values("combo")
+            .annotate(total=Sum(F("roman_pizza__price") * F("quantity")))
+            .values("total")
+        )
+        drinks = (
+            ComboDrink.objects.filter(combo=OuterRef("pk"))
+            .values("combo")
+            .annotate(total=Sum(F("drink_size__price") * F("quantity")))
+            .values("total")
+        )
+
+        return models.ExpressionWrapper(
+            Coalesce(Subquery(pizzas, output_field=price), Value(0), output_field=price)
+            + Coalesce(Subquery(romas, output_field=price), Value(0), output_field=price)
+            + Coalesce(Subquery(drinks, output_field=price), Value(0), output_field=price),
+            output_field=price,
+        )
+
+    def recompute_items_price(self):
+        """Пересчитывает сохранённую цену позиций одним UPDATE на весь набор"""
+        return self.update(items_price=self.items_price_expression())
+
+    def with_final_price(self):
+        """Аннотация final_price_value по правилу get_final_price (для сортировки в админке)"""
+        return self.annotate(
+            final_price_value=Coalesce(
+                NullIf("price", Value(0)),
+                "items_price",
+                output_field=models.DecimalField(max_digits=8, decimal_places=2),
+            )
+        )
+
+
+class Combo(ProductSlugMixin, models.Model):
+    product_type = ProductType.COMBO
+
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     name = models.CharField(max_length=30, unique=True)
     slug = models.SlugField(max_length=40, unique=True)
@@ -341,27 +533,46 @@ class Combo(models.Model):
         blank=True,
         verbose_name="Фиксированная цена (если задана)",
     )
+    # Поддерживается сигналами через ComboQuerySet.recompute_items_price
+    items_price = models.DecimalField(
+        max_digits=8,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name="Цена позиций без скидок",
+    )
+    # Поддерживается main.availability: все пиццы комбо в продаже
+    is_available = models.BooleanField(default=True, editable=False, verbose_name="В продаже")
+
+    objects = ComboQuerySet.as_manager()
+
+    def _combo_items(self, related_name, *related):
+        """Позиции комбо: из prefetch-кэша, если он есть, иначе одним запросом"""
+        if related_name in getattr(self, "_prefetched_objects_cache", {}):
+            return getattr(self, related_name).all()
+        return getattr(self, related_name).select_related(*related)
 
     def get_items_price(self):
         total = 0
 
-        for item in self.combopizza_set.select_related("pizza"):
+        for item in self._combo_items("combopizza_set", "pizza"):
             if item.pizza:
                 total += item.pizza.get_price_for_size(item.size) * item.quantity
 
-        for item in self.comboromapizza_set.select_related("roman_pizza"):
+        for item in self._combo_items("comboromapizza_set", "roman_pizza"):
             total += item.roman_pizza.price * item.quantity
 
-        for item in self.combodrink_set.select_related(
-            "drink_size", "drink_size__drink"
+        for item in self._combo_items(
+            "combodrink_set", "drink_size", "drink_size__drink"
         ):
-            total += item.drink_size.price * item.quantity
+            if item.drink_size:
+                total += item.drink_size.price * item.quantity
 
         return total
 
     def get_final_price(self):
-        """Если задана цена комбо — используем её, иначе считаем автоматически"""
-        return self.price if self.price else self.get_items_price()
+        """Если задана цена комбо — используем её, иначе сохранённую цену позиций"""
+        return self.price if self.price else self.items_price
 
     def __str__(self):
         return self.name
@@ -372,12 +583,27 @@ class Combo(models.Model):
         super().save(*args, **kwargs)
 
 
+class ComboPizzaQuerySet(models.QuerySet):
+    @staticmethod
+    def unit_price_expression():
+        """SQL-аналог pizza.get_price_for_size(size) для строки комбо"""
+        return Case(
+            *[
+                When(size=size, then=pizza_size_expression("price", size, "pizza__"))
+                for size, _ in Pizza.SIZE_CHOICES
+            ],
+            output_field=models.IntegerField(),
+        )
+
+
 class ComboPizza(models.Model):
     combo = models.ForeignKey(Combo, on_delete=models.CASCADE)
     pizza = models.ForeignKey(Pizza, null=True, blank=True, on_delete=models.CASCADE)
     size = models.CharField(max_length=2, choices=Pizza.SIZE_CHOICES, default="M")
     quantity = models.PositiveIntegerField(default=1, verbose_name="Количество")
 
+    objects = ComboPizzaQuerySet.as_manager()
+
     class Meta:
         unique_together = ["combo", "pizza", "size"]
 
@@ -396,13 +622,17 @@ class ComboRomaPizza(models.Model):
 
 class ComboDrink(models.Model):
     combo = models.ForeignKey(Combo, on_delete=models.CASCADE)
-    drink_size = models.ForeignKey(DrinkSize, on_delete=models.CASCADE)
+    # Удалённый размер оставляет строку пустой: комбо снимается с продажи
+    # (main.availability), а не продаётся молча без напитка
+    drink_size = models.ForeignKey(DrinkSize, null=True, on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(default=1, verbose_name="Количество")
 
     class Meta:
         unique_together = ["combo", "drink_size"]
 
     def __str__(self):
+        if self.drink_size is None:
+            return f"Удалённый напиток × {self.quantity}"
         return (
             f"{self.drink_size.drink.name} "
             f"({self.drink_size.get_size_display()}) × {self.quantity}"
@@ -423,7 +653,7 @@ class ActionGallery(models.Model):
     def __str__(self):
         return self.title
 
-class ActionImage(models.Model):
+class ActionImage(ImageVariantsMixin, models.Model):
     gallery = models.ForeignKey(  
         ActionGallery,
         on_delete=models.CASCADE,
@@ -432,6 +662,9 @@ class ActionImage(models.Model):
     image = models.ImageField(
         upload_to="Actions/%Y/%m/%d", blank=True, null=True, verbose_name="Изображение"
     )
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Производные изображения"
+    )
 
     order = models.PositiveIntegerField(
         default=0, 
@@ -445,4 +678,212 @@ class ActionImage(models.Model):
     class Meta:
         verbose_name = "Изображение акции"
         verbose_name_plural = "Изображения акций"
-        ordering = ['order', '-created_at']
\ No newline at end of file
+        ordering = ['order', '-created_at']
+
+class CatalogEntry(models.Model):
+    """Денормализованная витрина: одна строка на продаваемую позицию"""
+
+    Type = ProductType
+
+    # Порядок вывода типов в каталоге (и приоритет при поиске по slug)
+    TYPE_ORDER = {
+        Type.PIZZA: 0,
+        Type.ROMA: 1,
+        Type.DRINK: 2,
+        Type.COMBO: 3,
+    }
+
+    product_type = models.CharField(max_length=5, choices=ProductType.choices)
+    type_order = models.PositiveSmallIntegerField()
+    object_id = models.PositiveBigIntegerField()
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="catalog_entries"
+    )
+    slug = models.SlugField(max_length=40)
+    name = models.CharField(max_length=30)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    new = models.BooleanField(default=False)
+    available = models.BooleanField(default=True)
+    search_text = models.TextField(blank=True)
+    # Заполняется main.search.update_vectors; GIN-индексы создаются после migrate
+    search_vector = SearchVectorField(null=True, editable=False)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["type_order", "name", "object_id"]
+        unique_together = ["product_type", "object_id"]
+        indexes = [
+            models.Index(fields=["category", "type_order", "name"]),
+            models.Index(fields=["category", "price"]),
+            models.Index(fields=["category", "name"]),
+            models.Index(fields=["slug", "type_order"]),
+        ]
+        verbose_name = "Позиция каталога"
+        verbose_name_plural = "Позиции каталога"
+
+    def __str__(self):
+        return f"{self.get_product_type_display()}: {self.name}"
+
+    def as_product(self):
+        """Словарь в формате мапперов"""
+        product = dict(self.data)
+        # Decimal в JSON хранится строкой, возвращаем исходный тип
+        if isinstance(product.get("price"), str):
+            product["price"] = self.price
+        return product
+
+
+class CatalogEntryTopping(models.Model):
+    """
+    Индекс товар -> топпинг для фасетов каталога (см. main.facets).
+    Пересобирается вместе со строками витрины, категория и группа топпинга
+    денормализованы, чтобы фильтры и подсчёты не ходили в M2M пицц
+    """
+
+    entry = models.ForeignKey(
+        CatalogEntry, on_delete=models.CASCADE, related_name="topping_index"
+    )
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    topping = models.ForeignKey(Toppings, on_delete=models.CASCADE, related_name="+")
+    top_category = models.CharField(max_length=2, choices=Toppings.TopCategory.choices)
+
+    class Meta:
+        unique_together = ["entry", "topping"]
+        indexes = [
+            models.Index(fields=["category", "topping", "entry"]),
+            models.Index(fields=["category", "top_category", "entry"]),
+        ]
+        verbose_name = "Топпинг позиции каталога"
+        verbose_name_plural = "Топпинги позиций каталога"
+
+
+class ProductSlug(models.Model):
+    """Единый реестр slug всех товаров: slug уникален между типами"""
+
+    slug = models.SlugField(max_length=40, unique=True)
+    product_type = models.CharField(max_length=5, choices=ProductType.choices)
+    object_id = models.PositiveBigIntegerField()
+
+    class Meta:
+        unique_together = ["product_type", "object_id"]
+        verbose_name = "Slug товара"
+        verbose_name_plural = "Slug товаров"
+
+    def __str__(self):
+        return f"{self.slug} → {self.product_type}:{self.object_id}"
+
+
+class CatalogVersion(models.Model):
+    """
+    Счётчик версий меню для условных GET-запросов.
+    scope: "global", "layout" (категории и галерея) или "category:<slug>"
+    """
+
+    scope = models.CharField(max_length=60, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версии каталога"
+
+    def __str__(self):
+        return f"{self.scope}: {self.version}"
+
+
+class Order(models.Model):
+    class Status(models.TextChoices):
+        NEW = "new", "Создан"
+        PENDING_PAYMENT = "pending_payment", "Ожидает оплаты"
+        PAID = "paid", "Оплачен"
+        FAILED = "failed", "Ошибка оплаты"
+        CANCELED = "canceled", "Отменён"
+
+    # Статусы, которые вебхуки уже не меняют
+    FINAL_STATUSES = [Status.PAID, Status.CANCELED]
+
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.NEW, db_index=True
+    )
+    name = models.CharField(max_length=100, verbose_name="Имя")
+    phone = models.CharField(max_length=20, verbose_name="Телефон")
+    address = models.CharField(max_length=250, verbose_name="Адрес")
+    total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Сумма")
+    payment_intent_id = models.CharField(max_length=100, blank=True, db_index=True)
+    client_secret = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "Заказ"
+        verbose_name_plural = "Заказы"
+
+    def __str__(self):
+        return f"Заказ {self.uuid}"
+
+
+class OrderItem(models.Model):
+    """Снимок строки корзины на момент оформления"""
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product_type = models.CharField(max_length=5, choices=ProductType.choices)
+    object_id = models.PositiveBigIntegerField()
+    name = models.CharField(max_length=30)
+    size = models.CharField(max_length=2, blank=True)
+    toppings = models.JSONField(default=list, blank=True)
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказа"
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+
+class PaymentTask(models.Model):
+    """Очередь работы для фонового воркера оплаты (команда process_payments)"""
+
+    class Kind(models.TextChoices):
+        CREATE_INTENT = "create_intent", "Создать платёж"
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Ожидает"
+        PROCESSING = "processing", "В работе"
+        DONE = "done", "Выполнена"
+        FAILED = "failed", "Ошибка"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payment_tasks")
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"])]
+        verbose_name = "Задача оплаты"
+        verbose_name_plural = "Задачи оплаты"
+
+
+class PaymentEvent(models.Model):
+    """Событие вебхука; event_id уникален, поэтому повторная доставка — no-op"""
+
+    event_id = models.CharField(max_length=100, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ["received_at"]
+        verbose_name = "Событие оплаты"
+        verbose_name_plural = "События оплаты"
+
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
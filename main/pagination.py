@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+CURSOR_SALT = "main.catalog.cursor"
+
+
+def encode_cursor(ordering, values):
+    """
+    Подписанный курсор: сортировка, которой он получен, и значения её ключа
+    у последней строки
+    """
+    return signing.dumps(
+        {
+            "ordering": list(ordering),
+            "values": [str(v) if isinstance(v, Decimal) else v for v in values],
+        },
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Значения ключа или None, если курсор пустой, подделан или получен
+    при другой сортировке (значения цены и названия не взаимозаменяемы)
+    """
+    if not cursor:
+        return None
+    try:
+        payload = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if not isinstance(payload, dict) or payload.get("ordering") != list(ordering):
+        return None
+    values = payload.get("values")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Условие «строго после values» для сортировки ordering:
+    (a > x) | (a = x & b > y) | ... с учётом направления каждого поля
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=24):
+    """
+    Страница queryset по курсору: (объекты, курсор следующей страницы или None).
+    Последнее поле ordering должно быть уникальным (обычно pk)
+    """
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, ordering)
+    if values is not None:
+        try:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+        except (ValidationError, TypeError, ValueError):
+            # Значения не подходят к полям — как с подделанным курсором
+            pass
+
+    rows = list(queryset[: page_size + 1])
+    page, has_next = rows[:page_size], len(rows) > page_size
+
+    next_cursor = None
+    if has_next:
+        last = page[-1]
+        next_cursor = encode_cursor(
+            ordering, [getattr(last, field.lstrip("-")) for field in ordering]
+        )
+    return page, next_cursor
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+DEFAULTS = {
+    # Потоков (и постоянных соединений с БД) на процесс для параллельных запросов
+    "WORKERS": 8,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "PARALLEL_QUERIES", {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config()["WORKERS"], thread_name_prefix="catalog-query"
+                )
+    return _executor
+
+
+def _with_connection(func):
+    """
+    Вызов в потоке пула. Соединение потока остаётся открытым между вызовами
+    (переподключение на каждый запрос съело бы выигрыш); после ошибки БД
+    закрывается, и следующий вызов откроет новое
+    """
+
+    def run():
+        try:
+            return func()
+        except DatabaseError:
+            connections.close_all()
+            raise
+
+    return run
+
+
+async def gather(*funcs):
+    """
+    Выполняет независимые синхронные функции (обычно запросы ORM) одновременно,
+    каждую в своём потоке и соединении, и возвращает результаты в том же
+    порядке. Задержка — самый долгий вызов, а не сумма. Незакоммиченные данные
+    текущей транзакции в других соединениях не видны, поэтому gather — только
+    для чтения вне транзакции
+    """
+    executor = get_executor()
+    return await asyncio.gather(
+        *(
+            sync_to_async(_with_connection(func), thread_sensitive=False, executor=executor)()
+            for func in funcs
+        )
+    )
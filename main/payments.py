@@ -0,0 +1,260 @@
+import hashlib
+import hmac
+import json
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from urllib import error, parse, request as urlrequest
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, PaymentEvent, PaymentTask
+
+MAX_ATTEMPTS = 5
+# Сколько задача считается занятой воркером; после — её подберёт другой воркер
+TASK_LEASE = timedelta(minutes=2)
+# Статус заказа по типу события Stripe
+EVENT_STATUSES = {
+    "payment_intent.succeeded": Order.Status.PAID,
+    "payment_intent.payment_failed": Order.Status.FAILED,
+    "payment_intent.canceled": Order.Status.CANCELED,
+}
+
+
+class PaymentError(Exception):
+    pass
+
+
+class StripeClient:
+    """Минимальный клиент Stripe API; STRIPE_API_BASE позволяет подставить фейковый сервер"""
+
+    def __init__(self, secret_key=None, api_base=None, api_version=None, timeout=10):
+        self.secret_key = secret_key or settings.STRIPE_SECRET_KEY
+        self.api_base = (api_base or getattr(settings, "STRIPE_API_BASE", "https://api.stripe.com")).rstrip("/")
+        self.api_version = api_version or settings.STRIPE_API_VERSION
+        self.timeout = timeout
+
+    def _post(self, path, data, idempotency_key):
+        req = urlrequest.Request(
+            f"{self.api_base}{path}",
+            data=parse.urlencode(data).encode(),
+            method="POST",
+            headers={
+                "Authorization": f"Bearer {self.secret_key}",
+                "Stripe-Version": self.api_version,
+                "Idempotency-Key": idempotency_key,
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+        )
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except error.HTTPError as exc:
+            raise PaymentError(f"Stripe {exc.code}: {exc.read()[:500]!r}") from exc
+        except (error.URLError, TimeoutError, ValueError) as exc:
+            raise PaymentError(str(exc)) from exc
+
+    def create_payment_intent(self, order):
+        return self._post(
+            "/v1/payment_intents",
+            {
+                # Сумма в минимальных единицах валюты (копейках)
+                "amount": int(order.total * 100),
+                "currency": "rub",
+                "metadata[order_uuid]": str(order.uuid),
+            },
+            idempotency_key=f"order-{order.uuid}",
+        )
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """Заголовок Stripe-Signature для payload (используется фейковым сервером и тестами)"""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def verify_webhook(payload, header, secret=None, tolerance=300):
+    """Проверяет подпись вебхука и возвращает событие; иначе PaymentError"""
+    secret = settings.STRIPE_WEBHOOK_SECRET if secret is None else secret
+    # С пустым ключом HMAC подпись может сделать кто угодно
+    if not secret:
+        raise PaymentError("Секрет вебхука не настроен")
+    parts = defaultdict(list)
+    for item in (header or "").split(","):
+        key, _, value = item.partition("=")
+        parts[key.strip()].append(value.strip())
+
+    try:
+        timestamp = int(parts["t"][0])
+    except (IndexError, ValueError):
+        raise PaymentError("Некорректный заголовок подписи")
+    if abs(time.time() - timestamp) > tolerance:
+        raise PaymentError("Подпись устарела")
+
+    expected = sign_payload(payload, secret, timestamp).split("v1=")[1]
+    if not any(hmac.compare_digest(expected, sig) for sig in parts["v1"]):
+        raise PaymentError("Неверная подпись")
+
+    try:
+        return json.loads(payload)
+    except ValueError:
+        raise PaymentError("Некорректное тело события")
+
+
+def place_order(cart, name, phone, address):
+    """
+    Снимок корзины в заказ и постановка задачи на создание платежа.
+    Сетевых вызовов нет — запрос только пишет в БД
+    """
+    lines = cart.lines()
+    if not lines:
+        return None
+
+    order = Order.objects.create(
+        name=name,
+        phone=phone,
+        address=address,
+        total=sum((line["total"] for line in lines), Decimal(0)),
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(
+            order=order,
+            product_type=line["type"],
+            object_id=line["id"],
+            name=line["name"],
+            size=line["size"] or "",
+            toppings=line["toppings"] + [f"без {name}" for name in line["removed"]],
+            unit_price=line["unit_price"],
+            quantity=line["quantity"],
+        )
+        for line in lines
+    )
+    PaymentTask.objects.create(order=order, kind=PaymentTask.Kind.CREATE_INTENT)
+    cart.clear()
+    return order
+
+
+def record_event(event):
+    """Сохраняет событие вебхука; False — событие уже было получено"""
+    _, created = PaymentEvent.objects.get_or_create(
+        event_id=event["id"],
+        defaults={"type": event.get("type", ""), "payload": event},
+    )
+    return created
+
+
+def _claim(queryset, batch_size, **mark):
+    """Забирает пачку строк, не блокируя другие воркеры (SKIP LOCKED)"""
+    with transaction.atomic():
+        ids = list(
+            queryset.select_for_update(skip_locked=True).values_list("pk", flat=True)[:batch_size]
+        )
+        if ids and mark:
+            queryset.model.objects.filter(pk__in=ids).update(**mark)
+    return ids
+
+
+def process_tasks(client=None, batch_size=50):
+    """Создаёт платежи для новых заказов; сеть вызывается вне транзакций"""
+    client = client or StripeClient()
+    now = timezone.now()
+    ids = _claim(
+        PaymentTask.objects.filter(
+            status__in=[PaymentTask.Status.PENDING, PaymentTask.Status.PROCESSING],
+            available_at__lte=now,
+        ).order_by("available_at"),
+        batch_size,
+        status=PaymentTask.Status.PROCESSING,
+        available_at=now + TASK_LEASE,
+    )
+    tasks = list(PaymentTask.objects.filter(pk__in=ids).select_related("order"))
+
+    done, retry, failed, orders = [], [], [], []
+    for task in tasks:
+        task.attempts += 1
+        try:
+            intent = client.create_payment_intent(task.order)
+        except PaymentError as exc:
+            task.last_error = str(exc)
+            if task.attempts >= MAX_ATTEMPTS:
+                task.status = PaymentTask.Status.FAILED
+                failed.append(task)
+            else:
+                task.status = PaymentTask.Status.PENDING
+                task.available_at = now + timedelta(seconds=2 ** task.attempts)
+                retry.append(task)
+            continue
+
+        task.status = PaymentTask.Status.DONE
+        done.append(task)
+        order = task.order
+        order.payment_intent_id = intent["id"]
+        order.client_secret = intent.get("client_secret", "")
+        order.updated_at = timezone.now()
+        orders.append(order)
+
+    with transaction.atomic():
+        PaymentTask.objects.bulk_update(
+            done + retry + failed, ["status", "attempts", "last_error", "available_at"]
+        )
+        Order.objects.bulk_update(orders, ["payment_intent_id", "client_secret", "updated_at"])
+        # Вебхук мог успеть перевести заказ дальше — меняем только новые
+        Order.objects.filter(
+            pk__in=[order.pk for order in orders], status=Order.Status.NEW
+        ).update(status=Order.Status.PENDING_PAYMENT)
+        if failed:
+            Order.objects.filter(pk__in=[t.order_id for t in failed]).update(
+                status=Order.Status.FAILED, updated_at=timezone.now()
+            )
+    return len(tasks)
+
+
+def _event_order(event):
+    # Stripe не гарантирует порядок доставки: сначала время события, затем приёма
+    return (event.payload.get("created") or 0, event.received_at, event.pk)
+
+
+def process_events(batch_size=200):
+    """Применяет события вебхуков пачкой: один UPDATE на каждый итоговый статус"""
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by("received_at", "pk")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        # Заказ ищется по metadata.order_uuid: событие может обогнать сохранение id платежа.
+        # Для каждого заказа остаётся статус, к которому привела бы обработка по одному событию
+        latest = {}
+        for event in sorted(events, key=_event_order):
+            status = EVENT_STATUSES.get(event.type)
+            intent = event.payload.get("data", {}).get("object", {})
+            order_uuid = intent.get("metadata", {}).get("order_uuid")
+            if not status or not order_uuid or latest.get(order_uuid) in Order.FINAL_STATUSES:
+                continue
+            latest[order_uuid] = status
+
+        by_status = defaultdict(set)
+        for order_uuid, status in latest.items():
+            by_status[status].add(order_uuid)
+
+        now = timezone.now()
+        for status, uuids in by_status.items():
+            Order.objects.filter(uuid__in=uuids).exclude(
+                status__in=Order.FINAL_STATUSES
+            ).update(status=status, updated_at=now)
+
+        PaymentEvent.objects.filter(pk__in=[e.pk for e in events]).update(processed_at=now)
+    return len(events)
+
+
+def run_once(client=None, batch_size=50):
+    return process_tasks(client, batch_size) + process_events(batch_size * 4)
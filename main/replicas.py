@@ -0,0 +1,148 @@
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+DEFAULTS = {
+    # Алиасы DATABASES, из которых читают страницы каталога; пусто — всё на основной
+    "ALIASES": [],
+    # Сколько секунд после записи (сохранение в админке, корзина) клиент читает
+    # с основной базы, чтобы увидеть свои изменения несмотря на отставание реплик
+    "STICKY_SECONDS": 5,
+    "COOKIE": "primary_until",
+}
+
+# Алиас реплики для чтений текущего запроса (ContextVar работает и в потоках, и в asyncio)
+_read_alias = ContextVar("read_alias", default=None)
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "READ_REPLICAS", {})}
+
+
+@contextmanager
+def reading_from(alias):
+    """Чтения ORM внутри блока идут в alias; запись — всегда в основную базу"""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтения уходят на реплику, только если view выбрал её (replica_reads);
+    админка, корзина, оплата и фоновые задачи работают с основной базой
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит из репликации основной базы
+        if db in config()["ALIASES"]:
+            return False
+        return None
+
+
+def is_sticky(request):
+    value = request.COOKIES.get(config()["COOKIE"], "")
+    return value.isdigit() and int(value) > time.time()
+
+
+def choose_alias(request):
+    """Реплика для запроса или None (основная база): нет реплик, не GET, недавняя запись"""
+    aliases = config()["ALIASES"]
+    if not aliases or request.method not in ("GET", "HEAD") or is_sticky(request):
+        return None
+    return random.choice(aliases)
+
+
+def replica_reads(view):
+    """
+    Анонимные GET читаются с реплики без транзакции на запрос (ATOMIC_REQUESTS
+    для view отключается). Ответ отрисовывается внутри блока, чтобы ленивые
+    queryset шаблона тоже ушли на реплику. Для async-view алиас доходит
+    до потоков sync_to_async через контекст
+    """
+
+    if asyncio.iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            alias = choose_alias(request)
+            if alias is None:
+                return await view(request, *args, **kwargs)
+            with reading_from(alias):
+                response = await view(request, *args, **kwargs)
+                if hasattr(response, "render") and not response.is_rendered:
+                    await sync_to_async(response.render)()
+            return response
+
+        return transaction.non_atomic_requests(async_wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = choose_alias(request)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        with reading_from(alias):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+        return response
+
+    return transaction.non_atomic_requests(wrapper)
+
+
+class PrimaryStickinessMiddleware:
+    """
+    После успешного изменяющего запроса ставит cookie: STICKY_SECONDS клиент
+    читает каталог с основной базы (read-your-writes после правки в админке).
+    Работает и в WSGI, и в ASGI без переключения потоков
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        conf = config()
+        if (
+            conf["ALIASES"]
+            and request.method not in ("GET", "HEAD", "OPTIONS")
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                conf["COOKIE"],
+                str(int(time.time() + conf["STICKY_SECONDS"]) + 1),
+                max_age=conf["STICKY_SECONDS"] + 1,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,140 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, IntegerField, Q, Value
+from django.db.models.functions import Cast, Floor, Greatest, Round
+
+from .catalog import schedule_combo_prices, schedule_refresh, schedule_version_bump
+from .models import CatalogEntry, ComboPizza, Pizza, Toppings
+from .versions import TOPPINGS
+
+# Поля цен, которые меняют правила; NULL (не заданная ручная цена) остаётся NULL
+PRICE_FIELDS = {
+    Pizza: ["base_price_s", "price_m", "price_l", "price_xl"],
+    Toppings: ["price"],
+}
+MULTIPLIER_SIZES = ["M", "L", "XL"]
+
+
+class RepricingError(ValueError):
+    pass
+
+
+def _decimal(value):
+    return Value(Decimal(value), output_field=DecimalField(max_digits=12, decimal_places=4))
+
+
+def _as_field(expression, model, name):
+    """Результат правила в тип поля: цены пицц целые, цены топпингов — до копеек"""
+    field = model._meta.get_field(name)
+    if isinstance(field, DecimalField):
+        return Round(
+            expression,
+            field.decimal_places,
+            output_field=DecimalField(max_digits=field.max_digits, decimal_places=field.decimal_places),
+        )
+    return Cast(Round(expression), IntegerField())
+
+
+def percent_rule(model, percent):
+    """+N% (или -N%) ко всем ценам"""
+    factor = 1 + Decimal(percent) / 100
+    if factor <= 0:
+        raise RepricingError("Снижение не может быть 100% и больше")
+    return {
+        name: _as_field(F(name) * _decimal(factor), model, name) for name in PRICE_FIELDS[model]
+    }, Q()
+
+
+def round_rule(model, digit=9):
+    """Ближайшая цена, оканчивающаяся на digit (452 -> 449, 455 -> 459)"""
+    if not 0 <= int(digit) <= 9:
+        raise RepricingError("Последняя цифра должна быть от 0 до 9")
+    digit = int(digit)
+    return {
+        name: _as_field(
+            Greatest(Floor((F(name) - _decimal(digit - 5)) / _decimal(10)) * 10 + digit, digit),
+            model,
+            name,
+        )
+        for name in PRICE_FIELDS[model]
+    }, Q()
+
+
+def multiplier_rule(model, size, value):
+    """Коэффициент цены размера для пицц с авторасчётом"""
+    if model is not Pizza:
+        raise RepricingError("Коэффициенты размеров есть только у пицц")
+    if size not in MULTIPLIER_SIZES:
+        raise RepricingError(f"Размер должен быть одним из {', '.join(MULTIPLIER_SIZES)}")
+    value = Decimal(value)
+    if not 0 <= value < 100:
+        raise RepricingError("Коэффициент должен быть от 0 до 99.99")
+    name = f"price_multiplier_{size.lower()}"
+    return {name: Value(value.quantize(Decimal("0.01")), output_field=DecimalField())}, Q(
+        auto_calculate=True
+    )
+
+
+RULES = {
+    "percent": percent_rule,
+    "round": round_rule,
+    "multiplier": multiplier_rule,
+}
+
+
+def preview(queryset, updates, condition=Q()):
+    """
+    Diff правила одним SELECT: новые значения считаются теми же выражениями,
+    что пойдут в UPDATE. Возвращает только строки, которые изменятся
+    """
+    queryset = queryset.filter(condition).annotate(
+        **{f"new_{name}": expression for name, expression in updates.items()}
+    ).order_by("pk")
+    rows = queryset.values("pk", "name", *updates, *(f"new_{name}" for name in updates))
+
+    diff = []
+    for row in rows:
+        changes = {
+            name: (row[name], row[f"new_{name}"])
+            for name in updates
+            if row[name] != row[f"new_{name}"]
+        }
+        if changes:
+            diff.append({"pk": row["pk"], "name": row["name"], "changes": changes})
+    return diff
+
+
+def reprice(queryset, rule, *args, dry_run=False):
+    """
+    Применяет правило RULES[rule] к queryset одним UPDATE. Пересборка витрины
+    и цен зависимых комбо — после коммита через отложенную очередь каталога
+    """
+    model = queryset.model
+    updates, condition = RULES[rule](model, *args)
+
+    with transaction.atomic():
+        diff = preview(queryset, updates, condition)
+        if dry_run or not diff:
+            return diff
+
+        ids = [row["pk"] for row in diff]
+        model.objects.filter(pk__in=queryset.filter(condition).values("pk")).update(**updates)
+
+        if model is Pizza:
+            schedule_refresh(CatalogEntry.Type.PIZZA, ids)
+            schedule_combo_prices(
+                ComboPizza.objects.filter(pizza__in=ids).values_list("combo_id", flat=True)
+            )
+        elif model is Toppings:
+            # UPDATE не шлёт сигналов: версию, по которой сверяется снимок
+            # цен конструктора, увеличиваем сами
+            schedule_version_bump([TOPPINGS])
+    return diff
+
+
+def format_diff(diff):
+    """Строки отчёта «название: поле старое -> новое»"""
+    for row in diff:
+        changes = ", ".join(f"{name} {old} -> {new}" for name, (old, new) in row["changes"].items())
+        yield f"{row['name']}: {changes}"
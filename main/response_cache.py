@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+from . import versions
+from .instrumentation import timed_render
+
+DEFAULTS = {
+    # "main.response_cache.LocalLRUBackend" — один узел,
+    # "main.response_cache.DjangoCacheBackend" — общий кэш (Redis) через CACHES
+    "BACKEND": "main.response_cache.LocalLRUBackend",
+    "OPTIONS": {},
+    # Через TIMEOUT запись считается устаревшей и перерисовывается одним воркером,
+    # остальные до STALE_TIMEOUT отдают старую версию
+    "TIMEOUT": 300,
+    "STALE_TIMEOUT": 3600,
+    "LOCK_TIMEOUT": 10,
+    # Сколько ждать чужой перерисовки, если устаревшей записи нет
+    "WAIT_TIMEOUT": 2.0,
+}
+
+# Заголовки, которые сохраняются вместе с телом ответа
+CACHED_HEADERS = ("Content-Type", "Content-Language")
+
+
+class LocalLRUBackend:
+    """Кэш в памяти процесса с ограничением числа записей и вытеснением LRU"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    def get(self, key):
+        with self._mutex:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._mutex:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                stats.incr("evictions")
+
+    def delete(self, key):
+        with self._mutex:
+            self._data.pop(key, None)
+
+    def add_lock(self, key, timeout):
+        with self._mutex:
+            now = time.monotonic()
+            if self._locks.get(key, 0) > now:
+                return False
+            self._locks[key] = now + timeout
+            return True
+
+    def release_lock(self, key):
+        with self._mutex:
+            self._locks.pop(key, None)
+
+    def clear(self):
+        with self._mutex:
+            self._data.clear()
+            self._locks.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Обёртка над кэшем Django (например, django.core.cache.backends.redis.RedisCache).
+    Ограничение размера и LRU обеспечивает сам сервер (maxmemory-policy allkeys-lru),
+    блокировка перерисовки — атомарный cache.add
+    """
+
+    def __init__(self, alias="default", key_prefix="catalog-response"):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def _key(self, key):
+        return f"{self.key_prefix}:{key}"
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value, timeout):
+        self.cache.set(self._key(key), value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(self._key(key))
+
+    def add_lock(self, key, timeout):
+        return self.cache.add(self._key(f"lock:{key}"), 1, timeout)
+
+    def release_lock(self, key):
+        self.cache.delete(self._key(f"lock:{key}"))
+
+    def clear(self):
+        self.cache.clear()
+
+
+class Stats:
+    """Счётчики кэша ответов текущего процесса"""
+
+    def __init__(self):
+        self._counter = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name):
+        with self._lock:
+            self._counter[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._counter)
+        for name in ("hits", "stale_hits", "misses", "evictions", "lock_waits", "renders"):
+            data.setdefault(name, 0)
+        data["pid"] = os.getpid()
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._counter.clear()
+
+
+stats = Stats()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_RESPONSE_CACHE", {})}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                conf = config()
+                _backend = import_string(conf["BACKEND"])(**conf["OPTIONS"])
+    return _backend
+
+
+def reset_backend():
+    """Сбрасывает экземпляр бэкенда (после смены настроек, в тестах)"""
+    global _backend
+    _backend = None
+    stats.reset()
+
+
+def wait_for(backend, key, timeout):
+    """Ждёт до timeout секунд, пока воркер с блокировкой положит запись key"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        item = backend.get(key)
+        if item is not None:
+            return item
+    return None
+
+
+def cache_key(name, request, kwargs, catalog_versions):
+    parts = [
+        name,
+        repr(sorted(kwargs.items())),
+        request.GET.get("q", "").strip(),
+        request.GET.get("sort", ""),
+        request.GET.get("cursor", ""),
+        *(
+            ",".join(sorted(request.GET.getlist(name)))
+            for name in ("topping", "group", "without", "without_group")
+        ),
+        "hx" if request.headers.get("HX-Request") else "full",
+        repr(sorted(catalog_versions.items())),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def _freeze(request, response):
+    if hasattr(response, "render") and not response.is_rendered:
+        timed_render(request, response)
+    return {
+        "content": response.content,
+        "status": response.status_code,
+        "headers": {h: response[h] for h in CACHED_HEADERS if response.has_header(h)},
+    }
+
+
+def _thaw(payload):
+    response = HttpResponse(payload["content"], status=payload["status"])
+    for header, value in payload["headers"].items():
+        response[header] = value
+    return response
+
+
+class _CachedRender:
+    """
+    Один GET через кэш ответов: lookup() отдаёт запись или берёт блокировку
+    перерисовки, store() сохраняет отрисованный ответ. Общая часть
+    синхронной и асинхронной обёрток cached_response
+    """
+
+    def __init__(self, name, scopes_func, request, args, kwargs):
+        self.conf = config()
+        self.backend = get_backend()
+        catalog_versions = versions.for_request(request, scopes_func(request, *args, **kwargs))
+        self.key = cache_key(name, request, kwargs, catalog_versions)
+        self.request = request
+        self.locked = False
+
+    def lookup(self):
+        item = self.backend.get(self.key)
+        if item is not None and item["fresh_until"] > time.time():
+            stats.incr("hits")
+            return _thaw(item["payload"])
+
+        self.locked = self.backend.add_lock(self.key, self.conf["LOCK_TIMEOUT"])
+        if not self.locked:
+            if item is not None:
+                stats.incr("stale_hits")
+                return _thaw(item["payload"])
+
+            # Ждём, пока воркер с блокировкой положит запись
+            stats.incr("lock_waits")
+            item = wait_for(self.backend, self.key, self.conf["WAIT_TIMEOUT"])
+            if item is not None:
+                stats.incr("hits")
+                return _thaw(item["payload"])
+
+        stats.incr("misses")
+        return None
+
+    def store(self, response):
+        if response.status_code == 200:
+            stats.incr("renders")
+            payload = _freeze(self.request, response)
+            self.backend.set(
+                self.key,
+                {"payload": payload, "fresh_until": time.time() + self.conf["TIMEOUT"]},
+                self.conf["STALE_TIMEOUT"],
+            )
+        return response
+
+    def release(self):
+        if self.locked:
+            self.backend.release_lock(self.key)
+
+
+def cached_response(name, scopes_func):
+    """
+    Кэширует отрисованный GET-ответ по (view, kwargs, q, sort, cursor, фасеты,
+    HX-Request, версии каталога). Устаревшую запись перерисовывает только
+    воркер, получивший блокировку, остальные отдают старую.
+    Работает и с async-view: обращения к кэшу и версиям идут в потоке
+    """
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return await view(request, *args, **kwargs)
+
+                def lookup():
+                    render = _CachedRender(name, scopes_func, request, args, kwargs)
+                    return render, render.lookup()
+
+                def store(response):
+                    try:
+                        return render.store(response) if response is not None else None
+                    finally:
+                        render.release()
+
+                render, cached = await sync_to_async(lookup)()
+                if cached is not None:
+                    return cached
+                response = None
+                try:
+                    response = await view(request, *args, **kwargs)
+                finally:
+                    await sync_to_async(store)(response)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            render = _CachedRender(name, scopes_func, request, args, kwargs)
+            cached = render.lookup()
+            if cached is not None:
+                return cached
+            try:
+                return render.store(view(request, *args, **kwargs))
+            finally:
+                render.release()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,193 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+from .models import CatalogEntry
+
+SEARCH_CONFIG = "russian"
+# Порог нечёткого совпадения слова в запасном индексе (как similarity в pg_trgm)
+FUZZY_THRESHOLD = 0.4
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def is_postgres():
+    return connection.vendor == "postgresql"
+
+
+def search_vector():
+    """Поисковый документ: название важнее состава и описания"""
+    return SearchVector("name", weight="A", config=SEARCH_CONFIG) + SearchVector(
+        "search_text", weight="B", config=SEARCH_CONFIG
+    )
+
+
+def update_vectors(entries):
+    """Вызывается после пересборки строк витрины"""
+    if is_postgres():
+        entries.update(search_vector=search_vector())
+    else:
+        _fallback.invalidate()
+
+
+def ensure_indexes(using="default", **kwargs):
+    """GIN-индексы полнотекстового и триграммного поиска (только PostgreSQL)"""
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor != "postgresql":
+        return
+
+    table = CatalogEntry._meta.db_table
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_search_vector_gin "
+            f"ON {table} USING gin (search_vector)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_search_text_trgm "
+            f"ON {table} USING gin (search_text gin_trgm_ops)"
+        )
+
+
+def search_entries(entries, query):
+    """
+    Фильтрует queryset витрины по запросу и аннотирует search_rank.
+    На PostgreSQL — tsvector с префиксами слов и триграммы для опечаток,
+    в остальных случаях — запасной индекс в памяти процесса
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return entries.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if is_postgres():
+        return _postgres_search(entries, tokens)
+    return _fallback.search(entries, tokens)
+
+
+def _postgres_search(entries, tokens):
+    phrase = " ".join(tokens)
+    ts_query = SearchQuery(
+        " & ".join(f"{token}:*" for token in tokens),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+    return entries.filter(
+        Q(search_vector=ts_query) | Q(search_text__trigram_word_similar=phrase)
+    ).annotate(
+        search_rank=SearchRank(F("search_vector"), ts_query)
+        + TrigramWordSimilarity(phrase, "search_text")
+    )
+
+
+def trigrams(word):
+    """Триграммы слова с дополнением пробелами, как в pg_trgm"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FallbackIndex:
+    """
+    Инвертированный индекс по словам витрины для SQLite и тестов:
+    слово -> позиции, триграмма -> слова. Стоимость запроса зависит
+    от размера словаря, а не от числа позиций
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = None
+
+    def invalidate(self):
+        self._built = None
+
+    def _build(self):
+        postings = defaultdict(dict)
+        grams = defaultdict(set)
+
+        rows = CatalogEntry.objects.order_by().values_list("pk", "name", "search_text")
+        for pk, name, search_text in rows.iterator():
+            name_tokens = set(tokenize(name))
+            for token in tokenize(search_text):
+                # Совпадение в названии весит больше, чем в составе
+                weight = 1.0 if token in name_tokens else 0.4
+                postings[token][pk] = max(weight, postings[token].get(pk, 0))
+                for gram in trigrams(token):
+                    grams[gram].add(token)
+
+        return postings, grams
+
+    def _index(self):
+        built = self._built
+        if built is None:
+            with self._lock:
+                if self._built is None:
+                    self._built = self._build()
+                built = self._built
+        return built
+
+    def _similar_words(self, token, postings, grams):
+        """Слова словаря с их схожестью: префикс — 1.0, опечатка — по триграммам"""
+        words = {word: 1.0 for word in postings if word.startswith(token)}
+
+        token_grams = trigrams(token)
+        candidates = set()
+        for gram in token_grams:
+            candidates |= grams.get(gram, set())
+
+        for word in candidates - words.keys():
+            word_grams = trigrams(word)
+            similarity = len(token_grams & word_grams) / len(token_grams | word_grams)
+            if similarity >= FUZZY_THRESHOLD:
+                words[word] = similarity
+        return words
+
+    def match(self, tokens):
+        """pk позиции -> ранг; позиция должна совпасть со всеми словами запроса"""
+        postings, grams = self._index()
+        scores = None
+
+        for token in tokens:
+            token_scores = {}
+            for word, similarity in self._similar_words(token, postings, grams).items():
+                for pk, weight in postings[word].items():
+                    token_scores[pk] = max(token_scores.get(pk, 0), similarity * weight)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    pk: score + token_scores[pk]
+                    for pk, score in scores.items()
+                    if pk in token_scores
+                }
+            if not scores:
+                break
+
+        return scores or {}
+
+    def search(self, entries, tokens):
+        scores = self.match(tokens)
+        return entries.filter(pk__in=scores).annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+_fallback = FallbackIndex()
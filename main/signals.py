@@ -0,0 +1,179 @@
+from functools import partial
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .images import schedule_variants, variants_applied
+from .catalog import schedule_combo_prices, schedule_refresh, schedule_version_bump
+from .slugs import REGISTRY_SOURCES, register_slug, unregister_slug
+from .versions import LAYOUT, TOPPINGS, category_scope
+from .models import (
+    ActionGallery,
+    ActionImage,
+    CatalogEntry,
+    Category,
+    Combo,
+    ComboDrink,
+    ComboPizza,
+    ComboRomaPizza,
+    Drink,
+    DrinkSize,
+    Pizza,
+    RomaPizza,
+    Toppings,
+)
+
+PIZZA = CatalogEntry.Type.PIZZA
+ROMA = CatalogEntry.Type.ROMA
+DRINK = CatalogEntry.Type.DRINK
+
+
+def _ids(queryset, field):
+    return queryset.values_list(field, flat=True)
+
+
+@receiver(post_save, sender=Pizza)
+@receiver(post_delete, sender=Pizza)
+def pizza_changed(sender, instance, **kwargs):
+    schedule_refresh(PIZZA, [instance.pk])
+    schedule_combo_prices(_ids(ComboPizza.objects.filter(pizza=instance), "combo_id"))
+
+
+@receiver(post_save, sender=RomaPizza)
+@receiver(post_delete, sender=RomaPizza)
+def roma_pizza_changed(sender, instance, **kwargs):
+    schedule_refresh(ROMA, [instance.pk])
+    schedule_combo_prices(
+        _ids(ComboRomaPizza.objects.filter(roman_pizza=instance), "combo_id")
+    )
+
+
+@receiver(post_save, sender=Drink)
+def drink_changed(sender, instance, **kwargs):
+    schedule_refresh(DRINK, _ids(instance.variants.all(), "id"))
+
+
+@receiver(post_save, sender=DrinkSize)
+@receiver(pre_delete, sender=DrinkSize)
+def drink_size_changed(sender, instance, **kwargs):
+    # pre_delete: после удаления строки комбо уже не ссылаются на размер
+    schedule_refresh(DRINK, [instance.pk])
+    schedule_combo_prices(
+        _ids(ComboDrink.objects.filter(drink_size=instance), "combo_id")
+    )
+
+
+@receiver(post_save, sender=Combo)
+@receiver(post_delete, sender=Combo)
+def combo_changed(sender, instance, **kwargs):
+    schedule_combo_prices([instance.pk])
+
+
+@receiver(post_save, sender=ComboPizza)
+@receiver(post_delete, sender=ComboPizza)
+@receiver(post_save, sender=ComboRomaPizza)
+@receiver(post_delete, sender=ComboRomaPizza)
+@receiver(post_save, sender=ComboDrink)
+@receiver(post_delete, sender=ComboDrink)
+def combo_item_changed(sender, instance, **kwargs):
+    schedule_combo_prices([instance.combo_id])
+
+
+@receiver(post_save, sender=Toppings)
+@receiver(pre_delete, sender=Toppings)
+def topping_changed(sender, instance, **kwargs):
+    """
+    Название топпинга входит в карточки пицц, в которых он есть; цена —
+    в снимок конструктора, который сверяется с версией меню
+    """
+    schedule_version_bump([TOPPINGS])
+    schedule_refresh(
+        PIZZA, _ids(Pizza.toppings.through.objects.filter(toppings=instance), "pizza_id")
+    )
+    schedule_refresh(
+        ROMA,
+        _ids(RomaPizza.toppings.through.objects.filter(toppings=instance), "romapizza_id"),
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    schedule_version_bump([LAYOUT, category_scope(instance.slug)])
+
+
+@receiver(post_save, sender=ActionGallery)
+@receiver(post_delete, sender=ActionGallery)
+@receiver(post_save, sender=ActionImage)
+@receiver(post_delete, sender=ActionImage)
+def gallery_changed(sender, instance, **kwargs):
+    schedule_version_bump([LAYOUT])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Pizza)
+@receiver(post_save, sender=RomaPizza)
+@receiver(post_save, sender=Drink)
+@receiver(post_save, sender=ActionImage)
+def image_saved(sender, instance, **kwargs):
+    """Новый файл изображения — производные строятся в фоне после коммита"""
+    schedule_variants(instance)
+
+
+@receiver(variants_applied)
+def variants_changed(sender, pk, **kwargs):
+    """srcset входит в карточки товаров, а у категорий и акций — в данные главной"""
+    if sender is Pizza:
+        schedule_refresh(PIZZA, [pk])
+    elif sender is RomaPizza:
+        schedule_refresh(ROMA, [pk])
+    elif sender is Drink:
+        schedule_refresh(DRINK, _ids(DrinkSize.objects.filter(drink_id=pk), "id"))
+    else:
+        schedule_version_bump([LAYOUT])
+
+
+def _slug_saved(sender, instance, **kwargs):
+    """Реестр обновляется сразу, чтобы конфликт slug откатил сохранение"""
+    register_slug(sender.product_type, instance.pk, instance.slug)
+
+
+def _slug_deleted(sender, instance, **kwargs):
+    unregister_slug(sender.product_type, instance.pk)
+
+
+for model in REGISTRY_SOURCES.values():
+    post_save.connect(_slug_saved, sender=model)
+    post_delete.connect(_slug_deleted, sender=model)
+
+
+def _connect_m2m(through, schedule, source_field, target_field):
+    """
+    Подписка на изменения M2M: при прямом изменении instance — сам объект,
+    при обратном (topping.pizza_set.add) — объекты из pk_set
+    """
+
+    def handler(sender, instance, action, reverse, pk_set, **kwargs):
+        if action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        if not reverse:
+            schedule([instance.pk])
+        elif pk_set:
+            schedule(pk_set)
+        else:
+            schedule(
+                _ids(through.objects.filter(**{target_field: instance.pk}), source_field)
+            )
+
+    m2m_changed.connect(handler, sender=through, weak=False)
+
+
+_connect_m2m(
+    Pizza.toppings.through, partial(schedule_refresh, PIZZA), "pizza_id", "toppings_id"
+)
+_connect_m2m(
+    RomaPizza.toppings.through, partial(schedule_refresh, ROMA), "romapizza_id", "toppings_id"
+)
+_connect_m2m(ComboPizza, schedule_combo_prices, "combo_id", "pizza_id")
+_connect_m2m(ComboRomaPizza, schedule_combo_prices, "combo_id", "roman_pizza_id")
+_connect_m2m(ComboDrink, schedule_combo_prices, "combo_id", "drink_size_id")
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Combo, Drink, Pizza, ProductSlug, ProductType, RomaPizza
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш фиксированного размера"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# slug -> (тип товара, id); промахи не кэшируются, чтобы новый товар был виден сразу
+_cache = LRUCache(getattr(settings, "PRODUCT_SLUG_CACHE_SIZE", 4096))
+
+
+def resolve_slug(slug, use_cache=True):
+    """(тип, id) товара по slug: из LRU или одним индексным запросом"""
+    if use_cache:
+        cached = _cache.get(slug)
+        if cached is not None:
+            return cached
+
+    row = ProductSlug.objects.filter(slug=slug).values_list(
+        "product_type", "object_id"
+    ).first()
+    if row is not None:
+        _cache.put(slug, row)
+    return row
+
+
+def forget_slug(slug):
+    _cache.discard(slug)
+
+
+def register_slug(product_type, object_id, slug):
+    """Создаёт или переименовывает запись реестра; конфликт slug — IntegrityError"""
+    current = ProductSlug.objects.filter(
+        product_type=product_type, object_id=object_id
+    ).first()
+
+    if current is None:
+        ProductSlug.objects.create(
+            product_type=product_type, object_id=object_id, slug=slug
+        )
+    elif current.slug != slug:
+        forget_slug(current.slug)
+        current.slug = slug
+        current.save(update_fields=["slug"])
+    forget_slug(slug)
+
+
+def unregister_slug(product_type, object_id):
+    slugs = ProductSlug.objects.filter(product_type=product_type, object_id=object_id)
+    for slug in slugs.values_list("slug", flat=True):
+        forget_slug(slug)
+    slugs.delete()
+
+
+REGISTRY_SOURCES = {
+    ProductType.PIZZA: Pizza,
+    ProductType.ROMA: RomaPizza,
+    ProductType.DRINK: Drink,
+    ProductType.COMBO: Combo,
+}
+
+
+def rebuild_registry(batch_size=500):
+    """Полная пересборка реестра; при дубликатах между типами — IntegrityError"""
+    with transaction.atomic():
+        ProductSlug.objects.all().delete()
+        for product_type, model in REGISTRY_SOURCES.items():
+            rows = model.objects.order_by().values_list("pk", "slug")
+            ProductSlug.objects.bulk_create(
+                (
+                    ProductSlug(product_type=product_type, object_id=pk, slug=slug)
+                    for pk, slug in rows.iterator(chunk_size=batch_size)
+                ),
+                batch_size=batch_size,
+            )
+    _cache.clear()
+    return ProductSlug.objects.count()
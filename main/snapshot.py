@@ -0,0 +1,548 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import CatalogEntry
+from .versions import GLOBAL, current
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Файл снимка; None — во временном каталоге, отдельный для каждой базы.
+    # Все воркеры узла отображают один файл, поэтому он должен быть общим
+    "PATH": None,
+    # Раз в столько секунд воркер проверяет, не заменён ли файл
+    "TTL": 1.0,
+}
+
+MAGIC = b"PZCS"
+FORMAT = 1
+
+# Заголовок: версия меню, время её изменения и размеры секций
+HEADER = struct.Struct("<4sHxxqqIIIII")
+# Товар: тип, флаги, вид цены, object_id, метка updated_at строки витрины,
+# цена, вес, диаметр, объём, ссылки на строки, диапазоны размеров и топпингов
+PRODUCT = struct.Struct("<BBBxQqqiiiIIIIIIIHH")
+# Размер пиццы: вид цены, цена, вес, диаметр, код и название размера
+SIZE = struct.Struct("<BxxxqiiII")
+REF = struct.Struct("<I")
+
+NEW = 1
+AVAILABLE = 2
+
+# Вид числа: None, int (цены пицц) или Decimal в копейках (остальные цены)
+NONE, INT, CENTS = 0, 1, 2
+NO_STRING = 0xFFFFFFFF
+NO_INT = -(2**31)
+
+TYPES = list(CatalogEntry.Type.values)
+
+# Ключи и их порядок — как у словарей main.mappers
+FIELDS = {
+    CatalogEntry.Type.PIZZA: (
+        "type", "id", "slug", "name", "image", "srcset", "new", "available",
+        "price", "weight", "diameter", "current_size", "sizes", "toppings",
+    ),
+    CatalogEntry.Type.ROMA: (
+        "type", "id", "slug", "name", "price", "weight", "image", "srcset",
+        "new", "available", "toppings",
+    ),
+    CatalogEntry.Type.DRINK: (
+        "type", "id", "slug", "name", "price", "volume", "size", "image", "srcset", "new",
+    ),
+    CatalogEntry.Type.COMBO: ("type", "id", "slug", "name", "price", "available"),
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_SNAPSHOT", {})}
+
+
+def snapshot_path():
+    path = config()["PATH"]
+    if path:
+        return str(path)
+    name = str(connections["default"].settings_dict["NAME"])
+    return os.path.join(
+        tempfile.gettempdir(), f"pizza-catalog-{zlib.crc32(name.encode()):08x}.snapshot"
+    )
+
+
+def stamp(updated_at):
+    """updated_at строки витрины в микросекундах: по нему снимок сверяется с базой"""
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=dt_timezone.utc)
+    return (updated_at - _EPOCH) // timedelta(microseconds=1)
+
+
+def menu_stamp(menu_version):
+    """(версия, время изменения) глобальной версии меню -> пара чисел для заголовка"""
+    version, updated_at = menu_version
+    return version, 0 if updated_at is None else stamp(updated_at)
+
+
+def _key_slot(code, object_id, mask):
+    return ((object_id * 0x9E3779B1) ^ code) & mask
+
+
+def _encode_number(value):
+    if value is None:
+        return NONE, 0
+    if isinstance(value, int):
+        return INT, value
+    return CENTS, int(Decimal(value).scaleb(2))
+
+
+def _decode_number(kind, value):
+    if kind == INT:
+        return value
+    if kind == CENTS:
+        return Decimal(value).scaleb(-2)
+    return None
+
+
+def _encode_int(value):
+    return NO_INT if value is None else value
+
+
+class _Strings:
+    """Таблица строк: одинаковые названия, размеры и топпинги хранятся один раз"""
+
+    def __init__(self):
+        self.index = {}
+        self.items = []
+
+    def ref(self, value):
+        if value is None:
+            return NO_STRING
+        ref = self.index.get(value)
+        if ref is None:
+            ref = self.index[value] = len(self.items)
+            self.items.append(value.encode("utf-8"))
+        return ref
+
+
+def build(menu_version=None):
+    """
+    Собирает файл снимка из строк витрины (CatalogEntry) в bytes: заголовок,
+    товары и размеры фиксированной длины, ссылки на топпинги, открытая
+    хеш-таблица (тип, object_id) -> товар и таблица строк. menu_version —
+    прочитанная до строк глобальная версия меню (см. versions.current)
+    """
+    if menu_version is None:
+        menu_version = current([GLOBAL])[GLOBAL]
+    version, changed_at = menu_stamp(menu_version)
+    strings = _Strings()
+    products, sizes, toppings, keys = [], [], [], []
+
+    entries = CatalogEntry.objects.only(
+        "product_type", "object_id", "updated_at", "price", "available", "data"
+    ).order_by("pk")
+    for entry in entries.iterator(chunk_size=2000):
+        product = entry.as_product()
+        code = TYPES.index(entry.product_type)
+        price_kind, price = _encode_number(product["price"])
+        flags = (NEW if product.get("new") else 0) | (AVAILABLE if entry.available else 0)
+        srcset = product.get("srcset")
+
+        sizes_start = len(sizes)
+        for size in product.get("sizes", ()):
+            kind, size_price = _encode_number(size["price"])
+            sizes.append(SIZE.pack(
+                kind, size_price, _encode_int(size["weight"]), _encode_int(size["diameter"]),
+                strings.ref(size["size"]), strings.ref(size["size_display"]),
+            ))
+        toppings_start = len(toppings)
+        toppings.extend(strings.ref(name) for name in product.get("toppings", ()))
+
+        products.append(PRODUCT.pack(
+            code, flags, price_kind, entry.object_id, stamp(entry.updated_at), price,
+            _encode_int(product.get("weight")),
+            _encode_int(product.get("diameter")),
+            _encode_int(product.get("volume")),
+            strings.ref(product["slug"]),
+            strings.ref(product["name"]),
+            strings.ref(product.get("image")),
+            strings.ref(None if srcset is None else json.dumps(srcset)),
+            strings.ref(product.get("current_size", product.get("size"))),
+            sizes_start,
+            toppings_start,
+            len(sizes) - sizes_start,
+            len(toppings) - toppings_start,
+        ))
+        keys.append((code, entry.object_id))
+
+    # Таблица заполнена не больше чем наполовину: поиск — одна-две пробы
+    slots_count = 8
+    while slots_count < 2 * len(keys):
+        slots_count *= 2
+    mask = slots_count - 1
+    slots = [0] * slots_count
+    for index, (code, object_id) in enumerate(keys):
+        slot = _key_slot(code, object_id, mask)
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+
+    offsets, position = [], 0
+    for item in strings.items:
+        offsets.append(position)
+        position += len(item)
+    offsets.append(position)
+
+    return b"".join([
+        HEADER.pack(
+            MAGIC, FORMAT, version, changed_at, len(products), len(sizes), len(toppings),
+            slots_count, len(strings.items),
+        ),
+        *products,
+        *sizes,
+        struct.pack(f"<{len(toppings)}I", *toppings),
+        struct.pack(f"<{slots_count}I", *slots),
+        struct.pack(f"<{len(offsets)}I", *offsets),
+        *strings.items,
+    ])
+
+
+def _replace(path, data):
+    """Запись во временный файл рядом и атомарная подмена: читатели видят старый или новый файл"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp, "wb") as stream:
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+class Snapshot:
+    """
+    Отображённый в память файл снимка (только чтение). Страницы файла общие
+    для всех воркеров узла; в процессе живут лишь смещения секций
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as stream:
+            self.identity = _identity(os.fstat(stream.fileno()))
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._map)
+
+        (magic, file_format, self.version, self.changed_at, self.count, sizes, toppings,
+         self._slots_count, strings) = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError("Неизвестный формат снимка каталога")
+
+        self._products = HEADER.size
+        self._sizes = self._products + self.count * PRODUCT.size
+        self._toppings = self._sizes + sizes * SIZE.size
+        self._slots = self._toppings + toppings * REF.size
+        self._offsets = self._slots + self._slots_count * REF.size
+        self._blob = self._offsets + (strings + 1) * REF.size
+
+    def __len__(self):
+        return self.count
+
+    def string(self, ref):
+        if ref == NO_STRING:
+            return None
+        start, end = struct.unpack_from("<II", self._buffer, self._offsets + ref * REF.size)
+        return str(self._buffer[self._blob + start:self._blob + end], "utf-8")
+
+    def record(self, index):
+        return PRODUCT.unpack_from(self._buffer, self._products + index * PRODUCT.size)
+
+    def size(self, index):
+        return SIZE.unpack_from(self._buffer, self._sizes + index * SIZE.size)
+
+    def refs(self, start, count):
+        return struct.unpack_from(f"<{count}I", self._buffer, self._toppings + start * REF.size)
+
+    def find(self, product_type, object_id):
+        """Индекс товара по (тип, object_id) или None: O(1) по хеш-таблице"""
+        code = TYPES.index(product_type)
+        mask = self._slots_count - 1
+        slot = _key_slot(code, object_id, mask)
+        while True:
+            (value,) = REF.unpack_from(self._buffer, self._slots + slot * REF.size)
+            if not value:
+                return None
+            record = self.record(value - 1)
+            if record[0] == code and record[3] == object_id:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def product(self, product_type, object_id, updated_at=None):
+        """
+        Представление товара или None. С updated_at — только если запись
+        совпадает со строкой витрины (снимок не отстал от базы)
+        """
+        index = self.find(product_type, object_id)
+        if index is None:
+            return None
+        view = ProductView(self, self.record(index))
+        if updated_at is not None and view.stamp != stamp(updated_at):
+            return None
+        return view
+
+
+def _identity(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class ProductView(Mapping):
+    """
+    Товар снимка с ключами словаря маппера (main.mappers) для шаблонов и
+    кода, работавшего со словарями. Значения читаются из общей памяти при
+    обращении; на товар — только ссылка на снимок и распакованная запись
+    """
+
+    __slots__ = ("_snapshot", "_record")
+
+    def __init__(self, snapshot, record):
+        self._snapshot = snapshot
+        self._record = record
+
+    @property
+    def type(self):
+        return TYPES[self._record[0]]
+
+    @property
+    def stamp(self):
+        return self._record[4]
+
+    def _string(self, position):
+        return self._snapshot.string(self._record[position])
+
+    def _int(self, position):
+        value = self._record[position]
+        return None if value == NO_INT else value
+
+    def _srcset(self):
+        value = self._string(12)
+        return None if value is None else json.loads(value)
+
+    def _sizes(self):
+        result = []
+        for index in range(self._record[14], self._record[14] + self._record[16]):
+            kind, price, weight, diameter, size, display = self._snapshot.size(index)
+            result.append({
+                "size": self._snapshot.string(size),
+                "size_display": self._snapshot.string(display),
+                "price": _decode_number(kind, price),
+                "weight": None if weight == NO_INT else weight,
+                "diameter": None if diameter == NO_INT else diameter,
+            })
+        return result
+
+    def _toppings(self):
+        refs = self._snapshot.refs(self._record[15], self._record[17])
+        return [self._snapshot.string(ref) for ref in refs]
+
+    _GETTERS = {
+        "type": lambda self: self.type,
+        "id": lambda self: self._record[3],
+        "slug": lambda self: self._string(9),
+        "name": lambda self: self._string(10),
+        "image": lambda self: self._string(11),
+        "srcset": _srcset,
+        "new": lambda self: bool(self._record[1] & NEW),
+        "available": lambda self: bool(self._record[1] & AVAILABLE),
+        "price": lambda self: _decode_number(self._record[2], self._record[5]),
+        "weight": lambda self: self._int(6),
+        "diameter": lambda self: self._int(7),
+        "volume": lambda self: self._int(8),
+        "current_size": lambda self: self._string(13),
+        "size": lambda self: self._string(13),
+        "sizes": _sizes,
+        "toppings": _toppings,
+    }
+
+    def __getitem__(self, key):
+        if key not in FIELDS[self.type]:
+            raise KeyError(key)
+        return self._GETTERS[key](self)
+
+    def __iter__(self):
+        return iter(FIELDS[self.type])
+
+    def __len__(self):
+        return len(FIELDS[self.type])
+
+    def __repr__(self):
+        return f"<ProductView {self.type}:{self._record[3]}>"
+
+
+class SnapshotFile:
+    """
+    Текущий снимок процесса. Коммит изменений меню только заказывает
+    пересборку: она идёт в фоновом потоке, заказы за время сборки сливаются
+    в одну, а файл пишется, только если глобальная версия меню ушла вперёд.
+    Остальные воркеры раз в TTL сравнивают файл с отображённым (stat, без
+    запросов к базе) и переотображают его. Пока нового файла нет, товары
+    читаются из строк витрины; ошибки сборки только пишутся в лог
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        self._checked_at = 0.0
+        self._requested = False
+        self._running = False
+        self._executor = None
+
+    def invalidate(self):
+        self._current = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-snapshot")
+        return self._executor
+
+    def schedule_rebuild(self):
+        # Внутри транзакции другое соединение не видит её данных (тесты,
+        # команды в atomic) — тогда собираем в текущем
+        if transaction.get_connection().in_atomic_block:
+            self.rebuild()
+            return
+        with self._lock:
+            self._requested = True
+            if self._running:
+                return
+            self._running = True
+            try:
+                self._get_executor().submit(self._drain)
+            except RuntimeError:
+                # Интерпретатор завершается — новые задачи пулу не отдать
+                self._running = False
+                logger.warning("Пересборка снимка каталога не запущена")
+
+    def _take_request(self):
+        with self._lock:
+            requested, self._requested = self._requested, False
+            if not requested:
+                self._running = False
+            return requested
+
+    def _drain(self):
+        try:
+            while self._take_request():
+                self.rebuild()
+        except BaseException:
+            with self._lock:
+                self._running = False
+            raise
+        finally:
+            connections.close_all()
+
+    def _open(self, path):
+        """Отображает файл, если он сменился; None — файла нет или он испорчен"""
+        try:
+            identity = _identity(os.stat(path))
+        except FileNotFoundError:
+            return None
+        snapshot = self._current
+        if snapshot is None or snapshot.identity != identity:
+            try:
+                snapshot = Snapshot(path)
+            except (OSError, ValueError, struct.error):
+                return None
+        return snapshot
+
+    def rebuild(self):
+        """Пишет новый файл, если версия меню ушла вперёд; ошибки только в лог"""
+        try:
+            menu_version = current([GLOBAL])[GLOBAL]
+            path = snapshot_path()
+            snapshot = self._open(path)
+            if snapshot is None or (snapshot.version, snapshot.changed_at) != menu_stamp(menu_version):
+                _replace(path, build(menu_version))
+                snapshot = Snapshot(path)
+            with self._lock:
+                self._current = snapshot
+                self._checked_at = time.monotonic()
+        except Exception:
+            logger.exception("Не удалось собрать снимок каталога")
+
+    def get(self):
+        """
+        Снимок или None, пока файла нет. Запросов к базе и сборки здесь нет:
+        недостающий файл только заказывается
+        """
+        snapshot = self._current
+        if snapshot is not None and time.monotonic() - self._checked_at < config()["TTL"]:
+            return snapshot
+
+        opened = self._open(snapshot_path())
+        with self._lock:
+            if opened is not None:
+                self._current = opened
+            self._checked_at = time.monotonic()
+        if opened is None:
+            self.schedule_rebuild()
+        return self._current
+
+
+_file = SnapshotFile()
+
+
+def get():
+    return _file.get()
+
+
+def schedule_rebuild():
+    """Заказывает пересборку файла снимка (после коммита изменений меню)"""
+    _file.schedule_rebuild()
+
+
+def invalidate():
+    _file.invalidate()
+
+
+def products(entries):
+    """
+    Строки витрины (без поля data) -> товары в том же порядке: представления
+    снимка, а для строк, которых в снимке нет или которые новее его, —
+    словари из data одним дополнительным запросом
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+    snapshot = get()
+    result = [
+        None if snapshot is None
+        else snapshot.product(entry.product_type, entry.object_id, entry.updated_at)
+        for entry in entries
+    ]
+    missing = [entry.pk for entry, product in zip(entries, result) if product is None]
+    if missing:
+        # Снимок отстал от витрины: пересборка сравнит версии и, если
+        # новый файл ещё не записан, соберёт его
+        _file.schedule_rebuild()
+        loaded = CatalogEntry.objects.only("price", "data").in_bulk(missing)
+        result = [
+            loaded[entry.pk].as_product() if product is None else product
+            for entry, product in zip(entries, result)
+        ]
+    return result
@@ -0,0 +1,203 @@
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from .catalog import build_category_entries, schedule_version_bump
+from .models import (
+    ActionGallery,
+    ActionImage,
+    Category,
+    Combo,
+    ComboDrink,
+    ComboPizza,
+    ComboRomaPizza,
+    Drink,
+    DrinkSize,
+    Pizza,
+    ProductSlug,
+    RomaPizza,
+    Toppings,
+)
+from .versions import LAYOUT, category_scope
+
+BATCH_SIZE = 1000
+
+# Размер меню (число пицц) -> число позиций остальных типов
+DEFAULT_SHAPE = {
+    "categories": 4,
+    "toppings": 60,
+    "romas": 0.5,
+    "drinks": 0.25,
+    "combos": 0.1,
+    "gallery_images": 8,
+    "toppings_per_item": (3, 8),
+    "combo_items": (2, 6),
+}
+
+
+def _bulk(model, rows):
+    return model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def generate_menu(pizzas, prefix="bench", seed=0, publish=True, **shape):
+    """
+    Синтетическое меню из pizzas пицц и пропорционального числа остальных
+    позиций. Пишется через bulk_create (без сигналов), затем для новых строк
+    считаются цены комбо, записи реестра slug и строки витрины — остальное
+    меню не пересобирается. publish — после коммита сменить версии новых
+    категорий и раскладки (бенчмарки не публикуют: меню откатывается или
+    удаляется). Возвращает сводку с примерами slug для бенчмарка
+    """
+    shape = {**DEFAULT_SHAPE, **shape}
+    rng = random.Random(seed)
+
+    categories = _bulk(Category, [
+        Category(
+            name=f"{prefix} кат. {i}", slug=f"{prefix}-cat-{i}", image="Categories/synthetic.jpg"
+        )
+        for i in range(shape["categories"])
+    ])
+    toppings = _bulk(Toppings, [
+        Toppings(
+            name=f"{prefix} топпинг {i}",
+            price=Decimal(rng.randrange(30, 150)),
+            top_category=rng.choice(Toppings.TopCategory.values),
+            order=i,
+        )
+        for i in range(shape["toppings"])
+    ])
+
+    def pick_toppings():
+        count = rng.randint(*shape["toppings_per_item"])
+        return rng.sample(toppings, min(len(toppings), count))
+
+    pizza_rows = _bulk(Pizza, [
+        Pizza(
+            name=f"{prefix} пицца {i}",
+            slug=f"{prefix}-pizza-{i}",
+            category=rng.choice(categories),
+            image="Pizza/synthetic.jpg",
+            new=rng.random() < 0.1,
+            base_price_s=rng.randrange(300, 900),
+            base_weight_s=rng.randrange(350, 600),
+            price_multiplier_m=Decimal("1.30"),
+            price_multiplier_l=Decimal("1.60"),
+            price_multiplier_xl=Decimal("2.00"),
+            weight_multiplier_m=Decimal("1.30"),
+            weight_multiplier_l=Decimal("1.60"),
+            weight_multiplier_xl=Decimal("2.00"),
+        )
+        for i in range(pizzas)
+    ])
+    _bulk(Pizza.toppings.through, [
+        Pizza.toppings.through(pizza_id=pizza.pk, toppings_id=topping.pk)
+        for pizza in pizza_rows
+        for topping in pick_toppings()
+    ])
+
+    roma_rows = _bulk(RomaPizza, [
+        RomaPizza(
+            name=f"{prefix} римская {i}",
+            slug=f"{prefix}-roma-{i}",
+            category=rng.choice(categories),
+            image="RomaPizza/synthetic.jpg",
+            new=rng.random() < 0.1,
+            price=Decimal(rng.randrange(350, 1000)),
+        )
+        for i in range(int(pizzas * shape["romas"]))
+    ])
+    _bulk(RomaPizza.toppings.through, [
+        RomaPizza.toppings.through(romapizza_id=roma.pk, toppings_id=topping.pk)
+        for roma in roma_rows
+        for topping in pick_toppings()
+    ])
+
+    drink_rows = _bulk(Drink, [
+        Drink(
+            name=f"{prefix} напиток {i}",
+            slug=f"{prefix}-drink-{i}",
+            category=rng.choice(categories),
+            image="Drinks/synthetic.jpg",
+            description="Синтетический напиток",
+        )
+        for i in range(int(pizzas * shape["drinks"]))
+    ])
+    size_rows = _bulk(DrinkSize, [
+        DrinkSize(drink=drink, size=size, price=Decimal(rng.randrange(80, 250)))
+        for drink in drink_rows
+        for size in DrinkSize.Size.values
+    ])
+
+    combo_rows = _bulk(Combo, [
+        Combo(
+            name=f"{prefix} комбо {i}",
+            slug=f"{prefix}-combo-{i}",
+            category=rng.choice(categories),
+            price=Decimal(rng.randrange(900, 2500)) if rng.random() < 0.3 else None,
+        )
+        for i in range(int(pizzas * shape["combos"]))
+    ])
+
+    def sample(items):
+        return rng.sample(items, min(len(items), rng.randint(*shape["combo_items"])))
+
+    combo_pizzas, combo_romas, combo_drinks = [], [], []
+    for combo in combo_rows:
+        combo_pizzas += [
+            ComboPizza(
+                combo=combo, pizza=pizza, size=rng.choice(["S", "M", "L"]), quantity=rng.randint(1, 3)
+            )
+            for pizza in sample(pizza_rows)
+        ]
+        combo_romas += [ComboRomaPizza(combo=combo, roman_pizza=roma) for roma in sample(roma_rows)]
+        combo_drinks += [
+            ComboDrink(combo=combo, drink_size=size, quantity=rng.randint(1, 4))
+            for size in sample(size_rows)
+        ]
+    _bulk(ComboPizza, combo_pizzas)
+    _bulk(ComboRomaPizza, combo_romas)
+    _bulk(ComboDrink, combo_drinks)
+
+    gallery = ActionGallery.objects.create(title=f"{prefix} галерея")
+    _bulk(ActionImage, [
+        ActionImage(gallery=gallery, image=f"Actions/synthetic-{i}.jpg", order=i)
+        for i in range(shape["gallery_images"])
+    ])
+
+    category_ids = [category.pk for category in categories]
+    Combo.objects.filter(category__in=category_ids).recompute_items_price()
+    _bulk(ProductSlug, [
+        ProductSlug(product_type=row.product_type, object_id=row.pk, slug=row.slug)
+        for row in (*pizza_rows, *roma_rows, *drink_rows, *combo_rows)
+    ])
+    build_category_entries(category_ids)
+    if publish:
+        # Главная, снимок и кэши страниц обновятся после коммита, как при правке в админке
+        schedule_version_bump([LAYOUT, *(category_scope(category.slug) for category in categories)])
+
+    return {
+        "categories": len(categories),
+        "toppings": len(toppings),
+        "pizzas": len(pizza_rows),
+        "romas": len(roma_rows),
+        "drinks": len(drink_rows),
+        "drink_sizes": len(size_rows),
+        "combos": len(combo_rows),
+        "combo_items": len(combo_pizzas) + len(combo_romas) + len(combo_drinks),
+        "category_slug": categories[0].slug,
+        "product_slug": pizza_rows[0].slug if pizza_rows else None,
+        "search": toppings[0].name if toppings else "",
+    }
+
+
+def remove_menu(prefix="bench"):
+    """
+    Удаляет меню generate_menu(prefix=...), если оно было закоммичено
+    (бенчмарк async-страниц). Строки витрины уходят каскадом, записи реестра
+    и версии убирают сигналы удаления — остальное меню не пересобирается
+    """
+    with transaction.atomic():
+        Category.objects.filter(slug__startswith=f"{prefix}-cat-").delete()
+        Toppings.objects.filter(name__startswith=f"{prefix} топпинг ").delete()
+        ActionGallery.objects.filter(title=f"{prefix} галерея").delete()
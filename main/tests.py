@@ -1,3 +1,2016 @@
-from django.test import TestCase
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from functools import partial
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from asgiref.sync import async_to_sync
+from PIL import Image
+
+from .catalog import (
+    catalog_facets,
+    catalog_page,
+    category_entries,
+    category_queryset,
+    entry_by_slug,
+    rebuild_entries,
+)
+from .mappers import map_combo, map_pizza
+from .models import (
+    ActionGallery,
+    ActionImage,
+    CatalogEntry,
+    Category,
+    ProductSlug,
+    Combo,
+    ComboDrink,
+    ComboPizza,
+    ComboRomaPizza,
+    Drink,
+    DrinkSize,
+    Order,
+    PaymentEvent,
+    PaymentTask,
+    Pizza,
+    RomaPizza,
+    Toppings,
+)
+from . import urls as main_urls
+from . import (
+    builder, catalog, home, images, ingredients, menu_io, pagination, parallel, payments,
+    replicas, repricing, response_cache, snapshot, synthetic, versions, views,
+)
+from .benchmark import compare_async_views, run_benchmark
+from .builder import QuoteError, topping_price
+from .instrumentation import QueryRecorder, metrics
+from .cart import Cart
+from .slugs import rebuild_registry, resolve_slug
+
+
+def make_pizza(category, name, **kwargs):
+    """Пицца с десятичными коэффициентами (float по умолчанию не проходит full_clean)"""
+    fields = {
+        "slug": name,
+        "price_multiplier_m": Decimal("1.30"),
+        "price_multiplier_l": Decimal("1.60"),
+        "price_multiplier_xl": Decimal("2.00"),
+        "weight_multiplier_m": Decimal("1.30"),
+        "weight_multiplier_l": Decimal("1.60"),
+        "weight_multiplier_xl": Decimal("2.00"),
+    }
+    fields.update(kwargs)
+    return Pizza.objects.create(name=name, category=category, **fields)
+
+
+def make_menu(category, count, prefix="item"):
+    """Наполняет категорию count позициями каждого типа"""
+    cheese = Toppings.objects.get_or_create(
+        name="Моцарелла", defaults={"top_category": Toppings.TopCategory.CHEESE}
+    )[0]
+    ham = Toppings.objects.get_or_create(
+        name="Ветчина", defaults={"top_category": Toppings.TopCategory.MEAT}
+    )[0]
+
+    for i in range(count):
+        name = f"{prefix}-{category.slug}-{i}"
+        pizza = make_pizza(category, f"p-{name}", base_price_s=400 + i)
+        pizza.toppings.add(cheese, ham)
+
+        roma = RomaPizza.objects.create(
+            name=f"r-{name}",
+            slug=f"r-{name}",
+            price=500 + i,
+            image="RomaPizza/test.jpg",
+            category=category,
+        )
+        roma.toppings.add(cheese)
+
+        drink = Drink.objects.create(
+            name=f"d-{name}",
+            slug=f"d-{name}",
+            image="Drinks/test.jpg",
+            category=category,
+            description="Напиток",
+        )
+        size_s = DrinkSize.objects.create(drink=drink, size="S", price=100)
+        DrinkSize.objects.create(drink=drink, size="L", price=150)
+
+        combo = Combo.objects.create(
+            name=f"c-{name}", slug=f"c-{name}", category=category
+        )
+        ComboPizza.objects.create(combo=combo, pizza=pizza, size="M", quantity=2)
+        ComboRomaPizza.objects.create(combo=combo, roman_pizza=roma)
+        ComboDrink.objects.create(combo=combo, drink_size=size_s, quantity=2)
+
+
+class CatalogAssemblyTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small = Category.objects.create(
+                name="Маленькая", slug="small", image="Categories/test.jpg"
+            )
+            self.large = Category.objects.create(
+                name="Большая", slug="large", image="Categories/test.jpg"
+            )
+            make_menu(self.small, 2)
+            make_menu(self.large, 20)
+
+    def test_query_count_does_not_depend_on_category_size(self):
+        with self.assertNumQueries(1):
+            small = category_entries(self.small)
+        with self.assertNumQueries(1):
+            large = category_entries(self.large)
+
+        self.assertEqual(len(small), 2 * 5)
+        self.assertEqual(len(large), 20 * 5)
+
+    def test_combo_price_matches_model(self):
+        combo = Combo.objects.filter(category=self.small).first()
+        products = category_entries(self.small)
+        mapped = next(p for p in products if p["id"] == combo.id and p["type"] == "combo")
+
+        self.assertEqual(mapped["price"], combo.get_items_price())
+
+    def test_product_by_slug(self):
+        combo = Combo.objects.filter(category=self.small).first()
+
+        self.assertEqual(entry_by_slug(combo.slug), map_combo(combo))
+        self.assertIsNone(entry_by_slug("missing"))
+
+
+class CatalogEntryTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Пиццы", slug="pizzas", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 3)
+
+    def test_entries_match_mappers(self):
+        pizza = Pizza.objects.prefetch_related("toppings").first()
+        self.assertEqual(entry_by_slug(pizza.slug), map_pizza(pizza))
+        self.assertEqual(len(category_entries(self.category)), 3 * 5)
+
+    def test_rebuild_matches_incremental_refresh(self):
+        incremental = category_entries(self.category)
+        rebuild_entries()
+
+        self.assertEqual(category_entries(self.category), incremental)
+
+    def test_category_read_is_single_query(self):
+        category_entries(self.category, search="моцарелла")  # прогрев поискового индекса
+        with self.assertNumQueries(1):
+            category_entries(self.category, search="моцарелла", sort="price_desc")
+
+    def test_topping_rename_refreshes_pizzas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            topping = Toppings.objects.get(name="Ветчина")
+            topping.name = "Бекон"
+            topping.save()
+
+        pizza = Pizza.objects.first()
+        self.assertIn("Бекон", entry_by_slug(pizza.slug)["toppings"])
+
+    def test_pizza_price_change_refreshes_combo(self):
+        combo_item = ComboPizza.objects.select_related("combo", "pizza").first()
+        with self.captureOnCommitCallbacks(execute=True):
+            combo_item.pizza.base_price_s = 1000
+            combo_item.pizza.save()
+
+        combo_item.combo.refresh_from_db()
+        self.assertEqual(combo_item.combo.items_price, combo_item.combo.get_items_price())
+        self.assertEqual(
+            entry_by_slug(combo_item.combo.slug)["price"],
+            combo_item.combo.get_final_price(),
+        )
+
+    def test_deleted_and_inactive_products_leave_catalog(self):
+        pizza, combo = Pizza.objects.first(), Combo.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza.is_active = False
+            pizza.save()
+            combo.delete()
+
+        self.assertIsNone(entry_by_slug(pizza.slug))
+        self.assertIsNone(entry_by_slug(combo.slug))
+        self.assertFalse(CatalogEntry.objects.filter(object_id=combo.id, product_type="combo").exists())
+
+
+class ComboPriceTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Комбо", slug="combo", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+            manual = make_pizza(
+                self.category,
+                "manual",
+                base_price_s=333,
+                auto_calculate=False,
+                price_m=451, price_l=599, price_xl=777,
+                weight_m=1, weight_l=2, weight_xl=3,
+            )
+            odd = make_pizza(
+                self.category, "odd", base_price_s=399, price_multiplier_l=Decimal("1.15")
+            )
+            self.combo = Combo.objects.create(name="Сет", slug="set", category=self.category)
+            ComboPizza.objects.create(combo=self.combo, pizza=manual, size="XL", quantity=3)
+            ComboPizza.objects.create(combo=self.combo, pizza=odd, size="L")
+            ComboPizza.objects.create(combo=self.combo, pizza=odd, size="S")
+
+    def test_stored_price_matches_python_calculation(self):
+        for combo in Combo.objects.all():
+            self.assertEqual(combo.items_price, combo.get_items_price())
+
+    def test_recompute_is_single_update(self):
+        Combo.objects.update(items_price=0)
+        with self.assertNumQueries(1):
+            Combo.objects.all().recompute_items_price()
+
+        self.combo.refresh_from_db()
+        self.assertEqual(self.combo.items_price, 777 * 3 + int(399 * Decimal("1.15")) + 399)
+
+    def test_drink_price_change_cascades(self):
+        size = DrinkSize.objects.filter(combodrink__isnull=False).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            size.price = 999
+            size.save()
+
+        for combo in Combo.objects.filter(combodrink__drink_size=size):
+            self.assertEqual(combo.items_price, combo.get_items_price())
+
+    def test_fixed_price_wins(self):
+        self.combo.price = 100
+        self.assertEqual(self.combo.get_final_price(), 100)
+
+
+class PizzaSizeExpressionTests(TestCase):
+    """SQL-выражения размеров должны совпадать с методами модели"""
+
+    MULTIPLIERS = [Decimal(v) for v in ("0", "1.00", "1.15", "1.30", "1.33", "1.99", "2.57")]
+
+    def setUp(self):
+        category = Category.objects.create(
+            name="Размеры", slug="sizes", image="Categories/test.jpg"
+        )
+        pizzas = []
+        combinations = itertools.product(
+            (True, False), (1, 399, 401, 997), self.MULTIPLIERS, (None, 0, 615)
+        )
+        for i, (auto, base, multiplier, manual) in enumerate(combinations):
+            pizzas.append(
+                Pizza(
+                    name=f"prop-{i}",
+                    slug=f"prop-{i}",
+                    category=category,
+                    auto_calculate=auto,
+                    base_price_s=base,
+                    base_weight_s=base + 7,
+                    price_multiplier_m=multiplier,
+                    price_multiplier_l=self.MULTIPLIERS[-1] - multiplier,
+                    price_multiplier_xl=multiplier * 2,
+                    weight_multiplier_m=multiplier,
+                    weight_multiplier_l=multiplier + 1,
+                    weight_multiplier_xl=self.MULTIPLIERS[-1],
+                    price_m=manual,
+                    price_l=manual and manual + 1,
+                    price_xl=None,
+                    weight_m=manual,
+                    weight_l=None,
+                    weight_xl=manual,
+                )
+            )
+        Pizza.objects.bulk_create(pizzas)
+
+    def test_sql_matches_python_for_every_combination(self):
+        pizzas = list(Pizza.objects.with_size_prices())
+        self.assertEqual(len(pizzas), 2 * 4 * len(self.MULTIPLIERS) * 3)
+
+        for pizza in pizzas:
+            for size, _ in Pizza.SIZE_CHOICES:
+                self.assertEqual(
+                    getattr(pizza, Pizza.objects.size_field("price", size)),
+                    pizza.get_price_for_size(size),
+                    (pizza.name, size),
+                )
+                self.assertEqual(
+                    getattr(pizza, Pizza.objects.size_field("weight", size)),
+                    pizza.get_weight_for_size(size),
+                    (pizza.name, size),
+                )
+
+    def test_price_between_filters_in_database(self):
+        expected = {
+            p.pk for p in Pizza.objects.all()
+            if p.get_price_for_size("L") is not None
+            and 500 <= p.get_price_for_size("L") < 900
+        }
+        with self.assertNumQueries(1):
+            found = set(
+                Pizza.objects.price_between("L", 500, 899).values_list("pk", flat=True)
+            )
+
+        self.assertEqual(found, expected)
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Поиск", slug="search", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+            pepperoni = make_pizza(self.category, "Пепперони", slug="pepperoni")
+            pepperoni.toppings.add(
+                Toppings.objects.create(name="Колбаски пепперони", top_category="MT")
+            )
+
+    def names(self, search):
+        return [p["name"] for p in category_entries(self.category, search=search)]
+
+    def test_prefix_and_topping_match(self):
+        self.assertEqual(self.names("пеппер")[0], "Пепперони")
+        self.assertEqual(len(self.names("моцар")), 2 * 2)
+
+    def test_typo_tolerance(self):
+        self.assertIn("Пепперони", self.names("пеперони"))
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.names("пепперони моцарелла"), [])
+
+    def test_name_match_ranks_first(self):
+        self.assertEqual(self.names("пепперони")[0], "Пепперони")
+
+    def test_queryset_uses_search_index(self):
+        entries, _ = category_queryset(self.category, search="моцарелла")
+        self.assertEqual(
+            set(entries.values_list("product_type", flat=True)), {"pizza", "roma"}
+        )
+
+
+class ProductSlugRegistryTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Реестр", slug="registry", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 1)
+        self.combo = Combo.objects.get()
+
+    def test_every_product_is_registered(self):
+        self.assertEqual(ProductSlug.objects.count(), 4)
+        self.assertEqual(resolve_slug(self.combo.slug), ("combo", self.combo.pk))
+
+    def test_slug_is_unique_across_types(self):
+        pizza = Pizza.objects.get()
+        with self.assertRaises(ValidationError) as error:
+            make_pizza(self.category, "Дубль", slug=self.combo.slug)
+        self.assertIn("slug", error.exception.message_dict)
+
+        pizza.slug = self.combo.slug
+        with self.assertRaises(ValidationError):
+            pizza.full_clean()
+
+    def test_rename_updates_registry(self):
+        old_slug = self.combo.slug
+        resolve_slug(old_slug)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.combo.slug = "renamed"
+            self.combo.save()
+
+        self.assertIsNone(resolve_slug(old_slug))
+        self.assertIsNone(entry_by_slug(old_slug))
+        self.assertEqual(entry_by_slug("renamed")["id"], self.combo.pk)
+
+    def test_product_lookup_query_counts(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(entry_by_slug("missing"))
+
+        entry_by_slug(self.combo.slug)
+        with self.assertNumQueries(1):
+            self.assertEqual(entry_by_slug(self.combo.slug)["type"], "combo")
+
+    def test_delete_and_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.combo.delete()
+        self.assertIsNone(resolve_slug(self.combo.slug))
+        self.assertEqual(rebuild_registry(), 3)
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Страницы", slug="pages", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 6)
+
+    def walk(self, sort, page_size=4):
+        products, cursor, pages = [], None, 0
+        while True:
+            page, cursor = catalog_page(self.category, sort=sort, cursor=cursor, page_size=page_size)
+            products += page
+            pages += 1
+            if cursor is None:
+                return products, pages
+
+    def test_price_sort_is_global_across_types(self):
+        products, pages = self.walk("price_asc")
+        prices = [p["price"] for p in products]
+
+        self.assertEqual(len(products), 6 * 5)
+        self.assertEqual(pages, 8)
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(len({(p["type"], p["id"]) for p in products}), len(products))
+
+    def test_every_sort_pages_through_whole_category(self):
+        expected = category_entries(self.category)
+        for sort in (None, "price_desc", "name", "new"):
+            products, _ = self.walk(sort, page_size=7)
+            self.assertCountEqual(
+                [(p["type"], p["id"]) for p in products],
+                [(p["type"], p["id"]) for p in expected],
+            )
+
+    def test_new_first(self):
+        pizza = Pizza.objects.last()
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza.new = True
+            pizza.save()
+
+        page, _ = catalog_page(self.category, sort="new", page_size=1)
+        self.assertEqual(page[0]["id"], pizza.id)
+
+    def test_page_is_single_query_regardless_of_cursor(self):
+        _, cursor = catalog_page(self.category, sort="price_desc", page_size=5)
+        with self.assertNumQueries(1):
+            catalog_page(self.category, sort="price_desc", cursor=cursor, page_size=5)
+
+    def test_tampered_cursor_starts_from_first_page(self):
+        first, _ = catalog_page(self.category, page_size=3)
+        page, _ = catalog_page(self.category, cursor="garbage", page_size=3)
+        self.assertEqual(page, first)
+
+    def test_cursor_of_another_sort_starts_from_first_page(self):
+        _, by_name = catalog_page(self.category, sort="name", page_size=3)
+        _, by_price = catalog_page(self.category, sort="price_asc", page_size=3)
+        first, _ = catalog_page(self.category, sort="price_asc", page_size=3)
+        desc_first, _ = catalog_page(self.category, sort="price_desc", page_size=3)
+
+        page, _ = catalog_page(self.category, sort="price_asc", cursor=by_name, page_size=3)
+        self.assertEqual(page, first)
+        page, _ = catalog_page(self.category, sort="price_desc", cursor=by_price, page_size=3)
+        self.assertEqual(page, desc_first)
+
+        response = self.client.get(
+            f"/catalog/{self.category.slug}/", {"sort": "price_asc", "cursor": by_name}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_unusable_cursor_values_are_ignored(self):
+        ordering = ("price", "pk")
+        cursor = pagination.encode_cursor(ordering, ["c-item-x-12", 1])
+        first, _ = pagination.keyset_page(CatalogEntry.objects.all(), ordering, page_size=3)
+        page, _ = pagination.keyset_page(CatalogEntry.objects.all(), ordering, cursor, page_size=3)
+        self.assertEqual(page, first)
+
+    def test_htmx_next_page_renders_product_list(self):
+        _, cursor = catalog_page(self.category, page_size=24)
+        response = self.client.get(
+            f"/catalog/{self.category.slug}/", {"cursor": cursor}, HTTP_HX_REQUEST="true"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "main/product_list.html")
+        self.assertTemplateNotUsed(response, "main/home_content.html")
+
+
+class CatalogConditionalGetTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Версии", slug="versions", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 1)
+        self.url = f"/catalog/{self.category.slug}/"
+
+    def test_matching_etag_returns_304_without_product_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(selects), 1)
+        self.assertIn("main_catalogversion", selects[0])
+        self.assertIn("HX-Request", response["Vary"])
+
+    def test_htmx_fragment_has_own_validator(self):
+        full = self.client.get(self.url)["ETag"]
+        partial = self.client.get(self.url, HTTP_HX_REQUEST="true")["ETag"]
+        self.assertNotEqual(full, partial)
+
+        response = self.client.get(self.url, HTTP_HX_REQUEST="true", HTTP_IF_NONE_MATCH=full)
+        self.assertEqual(response.status_code, 200)
+
+    def test_menu_change_invalidates_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        index_etag = self.client.get("/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza = Pizza.objects.get()
+            pizza.base_price_s = 555
+            pizza.save()
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # Главная не показывает товары и остаётся валидной
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=index_etag).status_code, 304)
+
+    def test_category_change_invalidates_index(self):
+        etag = self.client.get("/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Новое имя"
+            self.category.save()
+
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Кэш", slug="cache", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+        self.url = f"/catalog/{self.category.slug}/"
+
+    def tearDown(self):
+        response_cache.reset_backend()
+
+    def product_queries(self, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response, [q for q in queries if "main_catalogentry" in q["sql"]]
+
+    def test_second_request_is_served_from_cache(self):
+        first, queries = self.product_queries()
+        self.assertTrue(queries)
+
+        second, queries = self.product_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(response_cache.stats.snapshot()["hits"], 1)
+
+    def test_htmx_and_search_have_separate_entries(self):
+        self.product_queries()
+        _, queries = self.product_queries(HTTP_HX_REQUEST="true")
+        self.assertTrue(queries)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {"q": "моцарелла"})
+        self.assertTrue([q for q in queries if "main_catalogentry" in q["sql"]])
+
+    def test_menu_change_bypasses_old_entry(self):
+        self.product_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza = Pizza.objects.first()
+            pizza.name = "Переименована"
+            pizza.save()
+
+        response, queries = self.product_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, "Переименована")
+
+    @override_settings(CATALOG_RESPONSE_CACHE={"OPTIONS": {"max_entries": 2}})
+    def test_lru_eviction_is_counted(self):
+        response_cache.reset_backend()
+        for sort in ("price_asc", "price_desc", "name"):
+            self.client.get(self.url, {"sort": sort})
+
+        self.assertEqual(response_cache.stats.snapshot()["evictions"], 1)
+
+    @override_settings(CATALOG_RESPONSE_CACHE={"TIMEOUT": 0})
+    def test_stale_entry_is_served_while_another_worker_renders(self):
+        response_cache.reset_backend()
+        first, _ = self.product_queries()
+
+        backend = response_cache.get_backend()
+        with mock.patch.object(backend, "add_lock", return_value=False):
+            second, queries = self.product_queries()
+
+        self.assertEqual(queries, [])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(response_cache.stats.snapshot()["stale_hits"], 1)
+
+    @override_settings(
+        CATALOG_RESPONSE_CACHE={"BACKEND": "main.response_cache.DjangoCacheBackend"},
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_shared_cache_backend(self):
+        response_cache.reset_backend()
+        self.product_queries()
+        _, queries = self.product_queries()
+        self.assertEqual(queries, [])
+
+
+class CartTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Корзина", slug="cart", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 13)
+        self.extra = Toppings.objects.first()
+
+    def add(self, **data):
+        return self.client.post("/cart/add/", data, HTTP_HX_REQUEST="true")
+
+    def fill_cart(self):
+        for pizza in Pizza.objects.all():
+            self.add(type="pizza", id=pizza.pk, size="L", toppings=[self.extra.pk])
+        for roma in RomaPizza.objects.all():
+            self.add(type="roma", id=roma.pk)
+        for size in DrinkSize.objects.all()[:12]:
+            self.add(type="drink", id=size.pk, quantity=2)
+        for combo in Combo.objects.all()[:12]:
+            self.add(type="combo", id=combo.pk)
+
+    def cart(self):
+        request = self.client.get("/cart/").wsgi_request
+        return Cart(request)
+
+    def test_session_stores_only_keys_and_quantities(self):
+        pizza = Pizza.objects.first()
+        self.add(type="pizza", id=pizza.pk, size="M", toppings=[self.extra.pk])
+        self.add(type="pizza", id=pizza.pk, size="M", toppings=[self.extra.pk])
+
+        self.assertEqual(
+            self.client.session["cart"],
+            {f"p:{pizza.pk}:M:{self.extra.pk}": 2},
+        )
+
+    def test_fifty_line_totals_within_query_budget(self):
+        self.fill_cart()
+        cart = self.cart()
+        self.assertEqual(len(cart.cart), 50)
+
+        # Пиццы, римские пиццы, напитки, комбо и топпинги — по одному запросу
+        with self.assertNumQueries(5):
+            total = cart.get_total_price()
+
+        # Добавка на L дороже во столько же раз, во сколько сама пицца
+        expected = sum(
+            (
+                Decimal(p.get_price_for_size("L")) + topping_price(self.extra.price, p.get_topping_scale("L"))
+                for p in Pizza.objects.all()
+            ),
+            Decimal(0),
+        )
+        expected += sum(r.price for r in RomaPizza.objects.all())
+        expected += sum(d.price * 2 for d in DrinkSize.objects.all()[:12])
+        expected += sum(c.get_final_price() for c in Combo.objects.all()[:12])
+        self.assertEqual(total, expected)
+
+    def test_update_and_remove_return_fragment(self):
+        combo = Combo.objects.first()
+        self.add(type="combo", id=combo.pk)
+        key = f"c:{combo.pk}"
+
+        response = self.client.post("/cart/update/", {"key": key, "quantity": 3})
+        self.assertTemplateUsed(response, "main/cart.html")
+        self.assertTemplateNotUsed(response, "main/base.html")
+        self.assertEqual(self.client.session["cart"], {key: 3})
+
+        self.client.post("/cart/remove/", {"key": key})
+        self.assertEqual(self.client.session["cart"], {})
+
+    def test_unavailable_lines_are_skipped(self):
+        pizza = Pizza.objects.first()
+        self.add(type="pizza", id=pizza.pk, size="S")
+        self.add(type="combo", id=999999)
+        Pizza.objects.filter(pk=pizza.pk).update(is_active=False)
+
+        self.assertEqual(self.cart().lines(), [])
+
+    def test_pizza_requires_size(self):
+        response = self.add(type="pizza", id=Pizza.objects.first().pk)
+        self.assertEqual(response.status_code, 400)
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    """Фейковый Stripe: создаёт платёж и запоминает ключи идемпотентности"""
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.requests.append((self.headers["Idempotency-Key"], body))
+        if server.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        payload = json.dumps({
+            "id": f"pi_{len(server.requests)}",
+            "client_secret": f"pi_{len(server.requests)}_secret",
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test", STRIPE_SECRET_KEY="sk_test")
+class PaymentTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("127.0.0.1", 0), FakeStripeHandler)
+        cls.server.requests = []
+        cls.server.fail = False
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.fail = False
+        self.client_api = payments.StripeClient(
+            api_base=f"http://127.0.0.1:{self.server.server_port}"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Оплата", slug="pay", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+
+    def checkout(self):
+        roma = RomaPizza.objects.first()
+        self.client.post("/cart/add/", {"type": "roma", "id": roma.pk, "quantity": 2})
+        response = self.client.post(
+            "/checkout/", {"name": "Иван", "phone": "+79990000000", "address": "Ленина, 1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        return Order.objects.get()
+
+    def webhook(self, event, secret="whsec_test"):
+        body = json.dumps(event).encode()
+        return self.client.post(
+            "/payments/webhook/",
+            body,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=payments.sign_payload(body, secret),
+        )
+
+    def event(self, order, event_id="evt_1", event_type="payment_intent.succeeded"):
+        return {
+            "id": event_id,
+            "type": event_type,
+            "data": {"object": {"metadata": {"order_uuid": str(order.uuid)}}},
+        }
+
+    def test_checkout_only_queues_task(self):
+        order = self.checkout()
+
+        self.assertEqual(order.status, Order.Status.NEW)
+        self.assertEqual(order.total, RomaPizza.objects.first().price * 2)
+        self.assertEqual(order.items.count(), 1)
+        self.assertEqual(PaymentTask.objects.get().order, order)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(self.client.session["cart"], {})
+
+    def test_worker_creates_intent_with_idempotency_key(self):
+        order = self.checkout()
+
+        self.assertEqual(payments.process_tasks(self.client_api), 1)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PENDING_PAYMENT)
+        self.assertEqual(order.payment_intent_id, "pi_1")
+        self.assertEqual(self.server.requests[0][0], f"order-{order.uuid}")
+        self.assertEqual(PaymentTask.objects.get().status, PaymentTask.Status.DONE)
+        self.assertEqual(payments.process_tasks(self.client_api), 0)
+
+    def test_failed_call_is_retried_later(self):
+        self.checkout()
+        self.server.fail = True
+
+        payments.process_tasks(self.client_api)
+
+        task = PaymentTask.objects.get()
+        self.assertEqual(task.status, PaymentTask.Status.PENDING)
+        self.assertEqual(task.attempts, 1)
+        self.assertGreater(task.available_at, task.order.created_at)
+        # Задача отложена — повторный проход её не берёт
+        self.assertEqual(payments.process_tasks(self.client_api), 0)
+
+    def test_webhook_is_recorded_once_and_applied_by_worker(self):
+        order = self.checkout()
+        payments.process_tasks(self.client_api)
+
+        self.assertEqual(self.webhook(self.event(order)).status_code, 200)
+        self.assertEqual(self.webhook(self.event(order)).status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+        self.assertEqual(payments.process_events(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+
+        # Поздний сбой не отменяет оплату
+        self.webhook(self.event(order, "evt_2", "payment_intent.payment_failed"))
+        payments.process_events()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+
+    def test_event_before_intent_is_not_lost(self):
+        order = self.checkout()
+        self.webhook(self.event(order))
+        payments.process_events()
+        payments.process_tasks(self.client_api)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+        self.assertEqual(order.payment_intent_id, "pi_1")
+
+    def test_batch_applies_events_in_event_order(self):
+        order = self.checkout()
+        canceled = self.event(order, "evt_2", "payment_intent.canceled")
+        canceled["created"] = 200
+        succeeded = self.event(order, "evt_1")
+        succeeded["created"] = 100
+        # Отмена пришла раньше, но произошла позже оплаты
+        self.webhook(canceled)
+        self.webhook(succeeded)
+        self.assertEqual(payments.process_events(), 2)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PAID)
+
+    def test_bad_signature_is_rejected(self):
+        order = self.checkout()
+        response = self.webhook(self.event(order), secret="whsec_other")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_empty_secret_is_refused(self):
+        order = self.checkout()
+        with override_settings(STRIPE_WEBHOOK_SECRET=""):
+            response = self.webhook(self.event(order), secret="")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+        with self.assertRaises(payments.PaymentError):
+            payments.verify_webhook(b"{}", payments.sign_payload(b"{}", ""), secret="")
+
+
+def make_upload(name, width, height):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "orange").save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root,
+            IMAGE_DERIVATIVES={"WIDTHS": [320, 640], "FORMATS": ["webp", "jpeg"], "ASYNC": False},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Картинки", slug="images", image="Categories/test.jpg"
+            )
+
+    def make_roma(self, width=800, height=600):
+        with self.captureOnCommitCallbacks(execute=True):
+            return RomaPizza.objects.create(
+                name="Римская",
+                slug="roma",
+                price=500,
+                image=make_upload("roma.png", width, height),
+                category=self.category,
+            )
+
+    def test_upload_builds_derivatives_and_srcset(self):
+        roma = self.make_roma()
+        roma.refresh_from_db()
+
+        self.assertEqual(roma.image_variants["widths"], [320, 640])
+        for width in (320, 640):
+            for fmt in ("webp", "jpeg"):
+                self.assertTrue(
+                    default_storage.exists(images.derivative_name(roma.image.name, width, fmt))
+                )
+        with default_storage.open(images.derivative_name(roma.image.name, 320, "webp")) as f:
+            self.assertEqual(Image.open(f).size, (320, 240))
+
+        entry = CatalogEntry.objects.get(product_type=CatalogEntry.Type.ROMA)
+        self.assertEqual([s["type"] for s in entry.data["srcset"]], ["image/webp", "image/jpeg"])
+        self.assertIn("_640w.webp 640w", entry.data["srcset"][0]["srcset"])
+
+    def test_small_original_is_not_upscaled(self):
+        roma = self.make_roma(width=200, height=200)
+        roma.refresh_from_db()
+        self.assertEqual(roma.image_variants["widths"], [200])
+
+    def test_replaced_image_hides_old_srcset(self):
+        roma = self.make_roma()
+        roma.refresh_from_db()
+        roma.image = "RomaPizza/other.jpg"
+        self.assertEqual(roma.image_srcset, [])
+
+    def test_save_does_not_wait_for_derivatives(self):
+        with override_settings(IMAGE_DERIVATIVES={"ASYNC": True}), \
+                mock.patch.object(images, "get_executor") as executor:
+            roma = self.make_roma()
+
+        executor.return_value.submit.assert_called_once_with(
+            images._build_in_background, "main.romapizza", roma.pk, roma.image.name
+        )
+        self.assertFalse(
+            default_storage.exists(images.derivative_name(roma.image.name, 320, "jpeg"))
+        )
+
+    def test_backfill_command_uses_process_pool(self):
+        with override_settings(IMAGE_DERIVATIVES={"ASYNC": True}), \
+                mock.patch.object(images, "get_executor"):
+            roma = self.make_roma()
+
+        call_command(
+            "build_image_derivatives", workers=2, model=["main.romapizza"], stdout=StringIO()
+        )
+
+        roma.refresh_from_db()
+        self.assertEqual(roma.image_variants["source"], roma.image.name)
+        self.assertTrue(roma.image_srcset)
+
+    def test_backfill_refreshes_catalog_once_per_batch(self):
+        with override_settings(IMAGE_DERIVATIVES={"ASYNC": True}), \
+                mock.patch.object(images, "get_executor"), \
+                self.captureOnCommitCallbacks(execute=True):
+            romas = [
+                RomaPizza.objects.create(
+                    name=f"Римская {i}", slug=f"roma-{i}", price=500,
+                    image=make_upload(f"roma{i}.png", 400, 300), category=self.category,
+                )
+                for i in range(3)
+            ]
+
+        with mock.patch("main.catalog.refresh_entries", wraps=catalog.refresh_entries) as refresh, \
+                mock.patch.object(RomaPizza, "full_clean") as full_clean, \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                "build_image_derivatives", workers=2, model=["main.romapizza"], stdout=StringIO()
+            )
+
+        full_clean.assert_not_called()
+        refresh.assert_called_once_with(CatalogEntry.Type.ROMA, {roma.pk for roma in romas})
+        for entry in CatalogEntry.objects.filter(product_type=CatalogEntry.Type.ROMA):
+            self.assertTrue(entry.data["srcset"])
+
+
+class HomePayloadTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        home.reset_backend()
+        self.addCleanup(home.reset_backend)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Главная", slug="home", image="Categories/test.jpg"
+            )
+            gallery = ActionGallery.objects.create()
+            ActionImage.objects.create(gallery=gallery, image="Actions/second.jpg", order=2)
+            ActionImage.objects.create(gallery=gallery, image="Actions/first.jpg", order=1)
+
+    def test_warm_index_does_not_touch_database(self):
+        self.client.get("/")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
+        self.assertContains(response, "Главная")
+
+        content = response.content.decode()
+        self.assertLess(content.index("Actions/first.jpg"), content.index("Actions/second.jpg"))
+
+    def test_stale_payload_is_served_while_refreshing_in_background(self):
+        payload = home.get_payload()
+        Category.objects.filter(pk=self.category.pk).update(name="Тихо переименована")
+
+        with override_settings(HOME_PAYLOAD={"TIMEOUT": 0}):
+            home.store_payload(payload)
+            with mock.patch("main.home.threading.Thread") as thread:
+                response = self.client.get("/")
+                self.client.get("/")
+
+        self.assertContains(response, "Главная")
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+        # Фоновая пересборка кладёт новый payload и снимает блокировку
+        thread.call_args.kwargs["target"]()
+        self.assertContains(self.client.get("/"), "Тихо переименована")
+
+    def test_category_change_refreshes_payload(self):
+        etag = self.client.get("/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Обновлена"
+            self.category.save()
+
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Обновлена")
+
+    def test_refresh_is_visible_to_other_workers(self):
+        home.get_payload()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Для всех"
+            self.category.save()
+
+        # Другой процесс видит тот же кэш через свой экземпляр бэкенда
+        other = response_cache.DjangoCacheBackend(key_prefix="home")
+        names = [c["name"] for c in other.get(home.PAYLOAD_KEY)["payload"]["categories"]]
+        self.assertEqual(names, ["Для всех"])
+
+    def test_cold_cache_waits_for_builder(self):
+        payload = home.build_payload()
+        backend = home.get_backend()
+        self.assertTrue(backend.add_lock(home.PAYLOAD_KEY, 30))
+
+        def built_elsewhere(backend, key, timeout):
+            home.store_payload(payload)
+            return backend.get(key)
+
+        with mock.patch("main.response_cache.wait_for", side_effect=built_elsewhere):
+            with self.assertNumQueries(0):
+                self.assertEqual(home.get_payload(), payload)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Метрики", slug="metrics", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+        self.url = f"/catalog/{self.category.slug}/"
+
+    @override_settings(REQUEST_METRICS={"SAMPLE_RATE": 1})
+    def test_sampled_request_gets_server_timing(self):
+        response = self.client.get(self.url)
+
+        timing = response["Server-Timing"]
+        for metric in ("db;dur=", "view;dur=", "tpl;dur=", "total;dur="):
+            self.assertIn(metric, timing)
+
+        with self.assertLogs("main.metrics", "INFO") as logs:
+            self.client.get(self.url, {"sort": "name"})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["url"], "main:catalog")
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["template"], 0)
+
+        snapshot = metrics.snapshot()["main:catalog"]
+        self.assertEqual(snapshot["count"], 2)
+        self.assertEqual(set(snapshot["total"]), {"p50", "p95", "p99"})
+
+    @override_settings(REQUEST_METRICS={"SAMPLE_RATE": 0})
+    def test_unsampled_request_is_untouched(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_repeated_query_shapes_are_counted_as_duplicates(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pizza in Pizza.objects.all():
+                list(pizza.toppings.all())
+            Category.objects.filter(slug="metrics").exists()
+
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.duplicates, 1)
+
+
+class SyntheticMenuTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        self.addCleanup(response_cache.reset_backend)
+
+    def test_generate_menu_builds_catalog(self):
+        summary = synthetic.generate_menu(40, prefix="gen", categories=2)
+
+        self.assertEqual(Pizza.objects.count(), 40)
+        self.assertEqual(RomaPizza.objects.count(), 20)
+        self.assertEqual(DrinkSize.objects.count(), 30)
+        self.assertEqual(Combo.objects.count(), 4)
+        self.assertEqual(CatalogEntry.objects.count(), 40 + 20 + 30 + 4)
+        self.assertEqual(ProductSlug.objects.count(), 40 + 20 + 10 + 4)
+        self.assertTrue(Combo.objects.filter(items_price__gt=0).exists())
+        self.assertEqual(summary["pizzas"], 40)
+
+    def test_benchmark_reports_every_scenario_and_rolls_back(self):
+        report = run_benchmark([20], requests=2)
+
+        scenarios = {row["scenario"] for row in report["results"] if "latency_ms" in row}
+        self.assertIn("index", scenarios)
+        self.assertIn("catalog:search", scenarios)
+        self.assertIn("admin:combo_changelist", scenarios)
+        for row in report["results"]:
+            if "latency_ms" in row:
+                self.assertEqual(row["statuses"], {200: 2}, row["scenario"])
+        json.dumps(report)
+        self.assertFalse(Pizza.objects.exists())
+
+    @override_settings(READ_REPLICAS={"ALIASES": ["replica1"]})
+    def test_benchmark_reads_from_primary(self):
+        with mock.patch.object(replicas, "reading_from") as reading_from:
+            run_benchmark([2], requests=1, only=["catalog:default", "product"])
+        reading_from.assert_not_called()
+
+    def test_generate_and_remove_leave_existing_menu_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(
+                name="Настоящая", slug="real", image="Categories/test.jpg"
+            )
+            make_menu(category, 2)
+        entries = set(CatalogEntry.objects.values_list("pk", flat=True))
+        slugs = set(ProductSlug.objects.values_list("slug", flat=True))
+
+        synthetic.generate_menu(20, prefix="gen", categories=2, publish=False)
+        self.assertEqual(CatalogEntry.objects.count(), len(entries) + 20 + 10 + 15 + 2)
+        self.assertTrue(entries <= set(CatalogEntry.objects.values_list("pk", flat=True)))
+        self.assertEqual(ProductSlug.objects.count(), len(slugs) + 20 + 10 + 5 + 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            synthetic.remove_menu("gen")
+        self.assertEqual(set(CatalogEntry.objects.values_list("pk", flat=True)), entries)
+        self.assertEqual(set(ProductSlug.objects.values_list("slug", flat=True)), slugs)
+
+    def test_benchmark_keeps_shared_payload_and_snapshot(self):
+        home.reset_backend()
+        self.addCleanup(home.reset_backend)
+        home.store_payload({"etag": "shared"})
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "catalog.snapshot")
+
+        with override_settings(CATALOG_SNAPSHOT={"PATH": path}):
+            snapshot.invalidate()
+            run_benchmark([4], requests=1, only=["index", "catalog:default"])
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(home.get_payload(), {"etag": "shared"})
+
+
+class MenuImportExportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.path = os.path.join(media_root, "menu")
+        synthetic.generate_menu(30, prefix="io", categories=2)
+
+    def export(self, fmt):
+        path = f"{self.path}.{fmt}"
+        call_command("export_menu", path, stderr=StringIO())
+        return path
+
+    def snapshot(self):
+        return {
+            "pizzas": sorted(Pizza.objects.values_list("slug", "base_price_s", "category__slug")),
+            "toppings": sorted(
+                Pizza.toppings.through.objects.values_list("pizza__slug", "toppings__name")
+            ),
+            "sizes": sorted(DrinkSize.objects.values_list("drink__slug", "size", "price")),
+            "combos": sorted(Combo.objects.values_list("slug", "price", "items_price")),
+            "combo_drinks": sorted(
+                ComboDrink.objects.values_list("combo__slug", "drink_size__drink__slug", "quantity")
+            ),
+        }
+
+    def roundtrip(self, fmt):
+        before = self.snapshot()
+        path = self.export(fmt)
+        for model in (Combo, Drink, RomaPizza, Pizza, Toppings, Category):
+            model.objects.all().delete()
+
+        call_command("import_menu", path, batch_size=7, stdout=StringIO())
+
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(CatalogEntry.objects.count(), 30 + 15 + 21 + 3)
+
+    def test_jsonl_roundtrip(self):
+        self.roundtrip("jsonl")
+
+    def test_csv_roundtrip(self):
+        self.roundtrip("csv")
+
+    def test_reimport_updates_in_place(self):
+        path = self.export("jsonl")
+        pizza_ids = set(Pizza.objects.values_list("pk", flat=True))
+        Pizza.objects.update(base_price_s=1)
+
+        with open(path, encoding="utf-8") as stream, \
+                CaptureQueriesContext(connection) as queries:
+            counts = menu_io.import_menu(menu_io.read_jsonl(stream))
+
+        self.assertEqual(counts["pizza"], 30)
+        self.assertEqual(set(Pizza.objects.values_list("pk", flat=True)), pizza_ids)
+        self.assertFalse(Pizza.objects.filter(base_price_s=1).exists())
+        # Запросы растут с числом пачек, а не строк
+        self.assertLess(len(queries), 150)
+
+    def test_invalid_rows_abort_import(self):
+        records = [
+            {"type": "category", "slug": "new-cat", "name": "Новая", "image": "x.jpg"},
+            {"type": "pizza", "slug": "bad", "name": "Плохая", "category": "nope"},
+            # slug уже занят пиццей
+            {"type": "roma", "slug": "io-pizza-0", "name": "Дубль", "category": "new-cat", "price": 1},
+        ]
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+
+        with self.assertRaises(CommandError) as ctx:
+            call_command("import_menu", self.path, format="jsonl", stdout=StringIO())
+
+        self.assertIn("строка 2", str(ctx.exception))
+        self.assertIn("строка 3", str(ctx.exception))
+        self.assertFalse(Category.objects.filter(slug="new-cat").exists())
+
+
+class RepricingTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Сезон", slug="season", image="Categories/test.jpg"
+            )
+            self.other = Category.objects.create(
+                name="Прочее", slug="other", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 3)
+            make_menu(self.other, 1)
+            self.manual = make_pizza(
+                self.category,
+                "manual",
+                base_price_s=452,
+                auto_calculate=False,
+                price_m=455, price_l=599, price_xl=779,
+                weight_m=1, weight_l=2, weight_xl=3,
+            )
+
+    def test_percent_applies_to_category_and_refreshes_combos(self):
+        queryset = Pizza.objects.filter(category=self.category)
+        with self.captureOnCommitCallbacks(execute=True):
+            # SAVEPOINT, SELECT diff, UPDATE, SELECT id комбо, RELEASE
+            with self.assertNumQueries(5):
+                diff = repricing.reprice(queryset, "percent", 10)
+
+        self.assertEqual(len(diff), 4)
+        self.manual.refresh_from_db()
+        self.assertEqual(
+            (self.manual.base_price_s, self.manual.price_m, self.manual.price_xl), (497, 501, 857)
+        )
+        self.assertTrue(Pizza.objects.filter(category=self.other, base_price_s=400).exists())
+        for combo in Combo.objects.all():
+            self.assertEqual(combo.items_price, combo.get_items_price())
+        entry = CatalogEntry.objects.get(product_type=CatalogEntry.Type.PIZZA, object_id=self.manual.pk)
+        self.assertIn("497", json.dumps(entry.data))
+
+    def test_dry_run_reports_without_writing(self):
+        diff = repricing.reprice(Pizza.objects.all(), "round", 9, dry_run=True)
+
+        manual = next(row for row in diff if row["pk"] == self.manual.pk)
+        self.assertEqual(manual["changes"], {"base_price_s": (452, 449), "price_m": (455, 459)})
+        self.assertEqual(Pizza.objects.get(pk=self.manual.pk).base_price_s, 452)
+
+    def test_multiplier_only_touches_auto_calculated(self):
+        call_command("reprice", multiplier="L=1.65", stdout=StringIO())
+
+        self.assertFalse(
+            Pizza.objects.filter(auto_calculate=True).exclude(price_multiplier_l=Decimal("1.65")).exists()
+        )
+        self.assertEqual(Pizza.objects.get(pk=self.manual.pk).price_multiplier_l, Decimal("1.60"))
+
+    def test_topping_prices(self):
+        Toppings.objects.update(price=Decimal("100.00"))
+        out = StringIO()
+        call_command("reprice", target="topping", percent="-7.5", stdout=out)
+
+        self.assertEqual(set(Toppings.objects.values_list("price", flat=True)), {Decimal("92.50")})
+        with self.assertRaises(CommandError):
+            call_command("reprice", target="topping", multiplier="L=2", stdout=StringIO())
+
+    def test_topping_reprice_reaches_builder(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            extra = Toppings.objects.create(
+                name="Халапеньо", top_category=Toppings.TopCategory.SPICES, price=100
+            )
+        pizza = Pizza.objects.filter(category=self.category).first()
+        self.assertEqual(builder.quote(pizza.pk, "S", add=[extra.pk])["extras"][0]["price"], 100)
+        version = versions.current([versions.GLOBAL])[versions.GLOBAL][0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            repricing.reprice(Toppings.objects.filter(pk=extra.pk), "percent", 10)
+
+        self.assertGreater(versions.current([versions.GLOBAL])[versions.GLOBAL][0], version)
+        self.assertEqual(builder.quote(pizza.pk, "S", add=[extra.pk])["extras"][0]["price"], 110)
+
+    def test_admin_action_previews_then_applies(self):
+        admin = get_user_model().objects.create_superuser("admin", "a@example.com", "pw")
+        self.client.force_login(admin)
+        url = reverse("admin:main_pizza_changelist")
+        data = {"action": "reprice", "_selected_action": [self.manual.pk]}
+
+        response = self.client.post(url, data)
+        self.assertTemplateUsed(response, "admin/main/reprice.html")
+
+        response = self.client.post(url, {**data, "rule": "round", "digit": 9, "preview": "1"})
+        self.assertContains(response, "449")
+        self.assertEqual(Pizza.objects.get(pk=self.manual.pk).base_price_s, 452)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {**data, "rule": "round", "digit": 9, "apply": "1"})
+        self.assertRedirects(response, url)
+        self.assertEqual(Pizza.objects.get(pk=self.manual.pk).base_price_s, 449)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        admin = get_user_model().objects.create_superuser("admin", "a@example.com", "pw")
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Админка", slug="admin-cat", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2, prefix="a")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def grow(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_menu(self.category, 5, prefix="b")
+            combo = Combo.objects.first()
+            for pizza in Pizza.objects.exclude(combopizza__combo=combo)[:5]:
+                ComboPizza.objects.create(combo=combo, pizza=pizza, size="L")
+            for drink_size in DrinkSize.objects.exclude(combodrink__combo=combo)[:5]:
+                ComboDrink.objects.create(combo=combo, drink_size=drink_size)
+            for i in range(3):
+                gallery = ActionGallery.objects.create(title=f"Галерея {i}")
+                for j in range(i + 1):
+                    ActionImage.objects.create(gallery=gallery, image=f"Actions/{i}-{j}.jpg")
+
+    def test_query_count_does_not_grow_with_rows(self):
+        combo = Combo.objects.first()
+        urls = [
+            reverse("admin:main_combo_changelist"),
+            reverse("admin:main_combo_change", args=[combo.pk]),
+            reverse("admin:main_actiongallery_changelist"),
+        ]
+        before = [self.count_queries(url) for url in urls]
+        self.grow()
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_computed_columns_are_sortable(self):
+        Combo.objects.filter(pk=Combo.objects.first().pk).update(price=1)
+        response = self.client.get(reverse("admin:main_combo_changelist"), {"o": "3"})
+        prices = [combo.final_price_value for combo in response.context["cl"].result_list]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual(prices[0], 1)
+
+        self.grow()
+        response = self.client.get(reverse("admin:main_actiongallery_changelist"), {"o": "-2"})
+        counts = [gallery.image_total for gallery in response.context["cl"].result_list]
+        self.assertEqual(counts, [3, 2, 1])
+
+    def test_inline_price_matches_python(self):
+        combo = Combo.objects.first()
+        response = self.client.get(reverse("admin:main_combo_change", args=[combo.pk]))
+        for item in ComboPizza.objects.filter(combo=combo).select_related("pizza"):
+            self.assertContains(response, f'data-price="{item.pizza.get_price_for_size(item.size)}"')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Фасеты", slug="facets", image="Categories/test.jpg"
+            )
+            top = Toppings.TopCategory
+            self.cheese = Toppings.objects.create(name="Сыр", top_category=top.CHEESE)
+            self.ham = Toppings.objects.create(name="Ветчина", top_category=top.MEAT)
+            self.shrimp = Toppings.objects.create(name="Креветки", top_category=top.SEAFOOD)
+            self.mushroom = Toppings.objects.create(name="Грибы", top_category=top.VEGETABLES)
+
+            recipes = {
+                "margo": [self.cheese],
+                "ham": [self.cheese, self.ham],
+                "ham-mush": [self.cheese, self.ham, self.mushroom],
+                "sea": [self.cheese, self.shrimp],
+            }
+            for name, toppings in recipes.items():
+                make_pizza(self.category, name, base_price_s=400).toppings.set(toppings)
+            roma = RomaPizza.objects.create(
+                name="roma-sea", slug="roma-sea", price=500,
+                image="RomaPizza/test.jpg", category=self.category,
+            )
+            roma.toppings.set([self.shrimp, self.mushroom])
+            drink = Drink.objects.create(
+                name="Морс", slug="mors", image="Drinks/test.jpg",
+                category=self.category, description="Напиток",
+            )
+            DrinkSize.objects.create(drink=drink, size="S", price=100)
+
+    def slugs(self, **filters):
+        return sorted(p["slug"] for p in category_entries(self.category, **filters))
+
+    def test_groups_match_any_and_toppings_match_all(self):
+        self.assertEqual(self.slugs(groups=["SF"]), ["roma-sea", "sea"])
+        self.assertEqual(self.slugs(groups=["SF", "MT"]), ["ham", "ham-mush", "roma-sea", "sea"])
+        self.assertEqual(self.slugs(toppings=[self.ham.pk, self.mushroom.pk]), ["ham-mush"])
+        self.assertEqual(self.slugs(toppings=[self.cheese.pk], groups=["VG"]), ["ham-mush"])
+
+    @override_settings(TOPPING_INDEX={"TTL": 60})
+    def test_counts_come_from_index(self):
+        catalog_facets(self.category, groups=["MT"])  # построение битового индекса
+        with CaptureQueriesContext(connection) as queries:
+            facets = catalog_facets(self.category, groups=["MT"])
+
+        # Отбор — в памяти, в базу только два GROUP BY по индексу состава
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any("pizza_toppings" in q["sql"] for q in queries))
+        groups = {g["value"]: g["count"] for g in facets["groups"]}
+        self.assertEqual(groups, {"CH": 2, "MT": 2, "VG": 1})
+        toppings = {t["name"]: (t["count"], t["selected"]) for t in facets["toppings"]}
+        self.assertEqual(toppings["Грибы"], (1, False))
+        self.assertEqual(toppings["Ветчина"], (2, False))
+
+    def test_index_follows_topping_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mushroom.top_category = Toppings.TopCategory.SPICES
+            self.mushroom.save()
+        self.assertEqual(self.slugs(groups=["VG"]), [])
+        self.assertEqual(self.slugs(groups=["SP"]), ["ham-mush", "roma-sea"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Pizza.objects.get(slug="margo").toppings.add(self.mushroom)
+        self.assertEqual(self.slugs(groups=["SP"]), ["ham-mush", "margo", "roma-sea"])
+
+    def test_exclusions(self):
+        self.assertEqual(
+            self.slugs(without=[self.mushroom.pk]), ["ham", "margo", "mors", "sea"]
+        )
+        self.assertEqual(self.slugs(without_groups=["SF", "MT"]), ["margo", "mors"])
+        self.assertEqual(
+            self.slugs(toppings=[self.cheese.pk], without=[self.ham.pk], without_groups=["SF"]),
+            ["margo"],
+        )
+
+
+    @override_settings(TOPPING_INDEX={"TTL": 60})
+    def test_exclusions_use_bitset_index(self):
+        self.slugs(without=[self.ham.pk])
+        with self.assertNumQueries(0):
+            ids = ingredients.match_entries(
+                self.category.pk, without=[self.ham.pk], without_groups=["VG"]
+            )
+        slugs = CatalogEntry.objects.filter(pk__in=ids).values_list("slug", flat=True)
+        self.assertEqual(sorted(slugs), ["margo", "sea"])
+
+        # Нет ни одной подходящей позиции — запроса к витрине нет вовсе
+        entries, _ = category_queryset(self.category, toppings=[self.ham.pk, self.shrimp.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(entries), [])
+
+    def test_many_matches_fall_back_to_subquery(self):
+        filters = {"toppings": [self.cheese.pk], "without": [self.ham.pk]}
+        entries, _ = category_queryset(self.category, **filters)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sorted(entries.values_list("slug", flat=True)), ["margo", "sea"])
+        self.assertNotIn("EXISTS", queries[-1]["sql"].upper())
+
+        # Список pk не растёт с категорией: больше MAX_IDS — подзапросы к индексу
+        with override_settings(TOPPING_INDEX={"MAX_IDS": 1}):
+            entries, _ = category_queryset(self.category, **filters)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(sorted(entries.values_list("slug", flat=True)), ["margo", "sea"])
+        self.assertEqual(queries[-1]["sql"].upper().count("EXISTS"), 2)
+
+    def test_search_api_filters(self):
+        response = self.client.get(reverse("main:search"), {"without_group": "SF"})
+        slugs = sorted(row["slug"] for row in response.json()["results"])
+        self.assertEqual(slugs, ["ham", "ham-mush", "margo", "mors"])
+
+        response = self.client.get(reverse("main:search"), {"topping": self.shrimp.pk})
+        self.assertEqual(
+            sorted(row["slug"] for row in response.json()["results"]), ["roma-sea", "sea"]
+        )
+
+    def test_view_filters_and_caches_per_filter(self):
+        url = reverse("main:catalog", args=["facets"])
+        response = self.client.get(url, {"group": "SF"})
+        self.assertEqual(
+            sorted(p["slug"] for p in response.context["products"]), ["roma-sea", "sea"]
+        )
+        self.assertContains(response, "Морепродукты")
+
+        response = self.client.get(url)
+        self.assertEqual(len(response.context["products"]), 6)
+
+
+class PizzaBuilderTests(TestCase):
+    def setUp(self):
+        builder.invalidate()
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(
+                name="Конструктор", slug="builder", image="Categories/test.jpg"
+            )
+            self.cheese = Toppings.objects.create(
+                name="Сыр", price=Decimal("60.00"), top_category=Toppings.TopCategory.CHEESE
+            )
+            self.bacon = Toppings.objects.create(
+                name="Бекон", price=Decimal("90.00"), top_category=Toppings.TopCategory.MEAT
+            )
+            self.olives = Toppings.objects.create(
+                name="Оливки", price=Decimal("45.00"), top_category=Toppings.TopCategory.VEGETABLES
+            )
+            self.pizza = make_pizza(category, "base", base_price_s=500)
+            self.pizza.toppings.set([self.cheese])
+            self.manual = make_pizza(
+                category, "manual", base_price_s=400, auto_calculate=False,
+                price_m=500, price_l=600, price_xl=800, weight_m=1, weight_l=2, weight_xl=3,
+            )
+
+    def test_extras_scale_with_pizza_size(self):
+        result = builder.quote(self.pizza.pk, "L", add=[self.bacon.pk, self.cheese.pk])
+
+        # Сыр уже в составе, бекон на L дороже в 1.6 раза, как и пицца
+        self.assertEqual([extra["name"] for extra in result["extras"]], ["Бекон"])
+        self.assertEqual(result["extras"][0]["price"], Decimal(144))
+        self.assertEqual(result["price"], Decimal(800 + 144))
+
+        result = builder.quote(self.manual.pk, "L", add=[self.olives.pk])
+        self.assertEqual(result["price"], Decimal(600) + topping_price(45, Decimal(600) / 400))
+
+    def test_removed_toppings_do_not_change_price(self):
+        result = builder.quote(self.pizza.pk, "S", remove=[self.cheese.pk, self.bacon.pk])
+        self.assertEqual(result["removed"], ["Сыр"])
+        self.assertEqual(result["price"], Decimal(500))
+
+    def test_snapshot_answers_without_queries_and_follows_changes(self):
+        builder.quote(self.pizza.pk, "M")
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                builder.quote(self.pizza.pk, "M", add=[self.olives.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.olives.price = Decimal("100.00")
+            self.olives.save()
+        result = builder.quote(self.pizza.pk, "S", add=[self.olives.pk])
+        self.assertEqual(result["price"], Decimal(600))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.olives.is_active = False
+            self.olives.save()
+        with self.assertRaises(QuoteError):
+            builder.quote(self.pizza.pk, "S", add=[self.olives.pk])
+
+    def test_quote_endpoint(self):
+        url = reverse("main:builder_quote")
+        params = {"id": self.pizza.pk, "size": "XL", "toppings": [self.bacon.pk]}
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.json()["price"], "1180")
+
+        response = self.client.get(url, params, HTTP_HX_REQUEST="true")
+        self.assertTemplateUsed(response, "main/builder_quote.html")
+        self.assertContains(response, "1180 ₽")
+
+        self.assertEqual(self.client.get(url, {**params, "size": "XXL"}).status_code, 400)
+
+    def test_builder_page_and_cart_use_same_price(self):
+        response = self.client.get(reverse("main:builder", args=[self.pizza.slug]))
+        self.assertContains(response, "Бекон")
+
+        self.client.post(reverse("main:cart_add"), {
+            "type": "pizza", "id": self.pizza.pk, "size": "L",
+            "toppings": [self.bacon.pk], "removed": [self.cheese.pk],
+        })
+        key = f"p:{self.pizza.pk}:L:{self.bacon.pk}:{self.cheese.pk}"
+        self.assertEqual(self.client.session["cart"], {key: 1})
+
+        line = Cart(self.client.get("/cart/").wsgi_request).lines()[0]
+        expected = builder.quote(self.pizza.pk, "L", [self.bacon.pk], [self.cheese.pk])
+        self.assertEqual(line["unit_price"], expected["price"])
+        self.assertEqual(line["removed"], ["Сыр"])
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Стоп-лист", slug="stop", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 3)
+        self.cheese = Toppings.objects.get(name="Моцарелла")
+        self.ham = Toppings.objects.get(name="Ветчина")
+
+    def toggle(self, topping, is_active):
+        with self.captureOnCommitCallbacks(execute=True):
+            topping.is_active = is_active
+            topping.save()
+
+    def test_stopped_topping_hides_pizzas_and_their_combos(self):
+        self.toggle(self.ham, False)
+
+        self.assertFalse(Pizza.objects.filter(is_available=True).exists())
+        self.assertEqual(RomaPizza.objects.filter(is_available=True).count(), 3)
+        self.assertFalse(Combo.objects.filter(is_available=True).exists())
+        types = {product["type"] for product in category_entries(self.category)}
+        self.assertEqual(types, {"roma", "drink"})
+
+        pizza = Pizza.objects.first()
+        self.assertFalse(entry_by_slug(pizza.slug)["available"])
+        response = self.client.get(reverse("main:product", args=[pizza.slug]))
+        self.assertContains(response, "Нет в наличии")
+
+        self.toggle(self.ham, True)
+        self.assertEqual(Combo.objects.filter(is_available=True).count(), 3)
+        self.assertEqual(len(category_entries(self.category)), 15)
+
+    def test_toggle_is_a_bulk_update(self):
+        # Доступность: по SELECT и UPDATE на пиццы, римские пиццы и комбо,
+        # независимо от числа позиций с этим топпингом
+        with CaptureQueriesContext(connection) as queries:
+            self.toggle(self.cheese, False)
+        updates = [
+            q["sql"] for q in queries.captured_queries
+            if q["sql"].startswith("UPDATE") and "is_available" in q["sql"]
+        ]
+        self.assertEqual(len(updates), 3)
+        self.assertFalse(RomaPizza.objects.filter(is_available=True).exists())
+
+    def test_inactive_pizza_and_missing_size_break_combo(self):
+        combo = Combo.objects.first()
+        item = combo.combopizza_set.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            item.pizza.price_multiplier_m = 0
+            item.pizza.save()
+        combo.refresh_from_db()
+        self.assertTrue(item.pizza.is_available)
+        self.assertFalse(combo.is_available)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            combo.combopizza_set.all().delete()
+            combo.comboromapizza_set.all().delete()
+            DrinkSize.objects.filter(combodrink__combo=combo).delete()
+        combo.refresh_from_db()
+        self.assertFalse(combo.is_available)
+
+    def test_deleted_drink_size_breaks_combo(self):
+        combo = Combo.objects.first()
+        self.client.post(reverse("main:cart_add"), {"type": "combo", "id": combo.pk})
+        self.assertEqual(len(Cart(self.client.get("/cart/").wsgi_request).lines()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            DrinkSize.objects.filter(combodrink__combo=combo).delete()
+
+        combo.refresh_from_db()
+        self.assertFalse(combo.is_available)
+        self.assertEqual(combo.combodrink_set.get().drink_size, None)
+        self.assertEqual(Combo.objects.filter(is_available=True).count(), 2)
+        self.assertEqual(Cart(self.client.get("/cart/").wsgi_request).lines(), [])
+
+    def test_cart_drops_unavailable_lines(self):
+        pizza = Pizza.objects.first()
+        self.client.post(reverse("main:cart_add"), {"type": "pizza", "id": pizza.pk, "size": "S"})
+        self.toggle(self.ham, False)
+        self.assertEqual(Cart(self.client.get("/cart/").wsgi_request).lines(), [])
+
+
+@override_settings(READ_REPLICAS={"ALIASES": ["replica1"], "STICKY_SECONDS": 5})
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        @replicas.replica_reads
+        def view(request):
+            return HttpResponse(replicas.ReplicaRouter().db_for_read(Pizza) or "default")
+
+        self.view = view
+        self.factory = RequestFactory()
+
+    def test_anonymous_get_reads_from_replica_without_transaction(self):
+        self.assertEqual(self.view(self.factory.get("/")).content, b"replica1")
+        self.assertEqual(self.view._non_atomic_requests, {"default"})
+        self.assertIsNone(replicas.ReplicaRouter().db_for_read(Pizza))
+        self.assertEqual(replicas.ReplicaRouter().db_for_write(Pizza), "default")
+
+    def test_writes_and_recent_writers_stay_on_primary(self):
+        self.assertEqual(self.view(self.factory.post("/")).content, b"default")
+
+        request = self.factory.get("/")
+        request.COOKIES["primary_until"] = str(int(time.time()) + 5)
+        self.assertEqual(self.view(request).content, b"default")
+        request.COOKIES["primary_until"] = str(int(time.time()) - 1)
+        self.assertEqual(self.view(request).content, b"replica1")
+
+    def test_write_sets_stickiness_cookie(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(
+                name="Реплики", slug="replicas", image="Categories/test.jpg"
+            )
+            pizza = make_pizza(category, "sticky", base_price_s=400)
+        response = self.client.post(
+            reverse("main:cart_add"), {"type": "pizza", "id": pizza.pk, "size": "S"}
+        )
+        self.assertEqual(response.cookies["primary_until"]["max-age"], 6)
+        self.assertTrue(replicas.is_sticky(self.client.get("/cart/").wsgi_request))
+
+
+# Реплика в тестах — зеркало default (TEST: MIRROR) со своим соединением:
+# данные должны быть закоммичены, поэтому TransactionTestCase
+@skipUnless("replica1" in settings.DATABASES, "нужен второй алиас БД (POSTGRES_REPLICA_HOSTS)")
+@override_settings(READ_REPLICAS={"ALIASES": ["replica1"], "STICKY_SECONDS": 5})
+class ReplicaQueriesTests(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        response_cache.reset_backend()
+        self.category = Category.objects.create(
+            name="Реплики", slug="replicas", image="Categories/test.jpg"
+        )
+        make_menu(self.category, 2)
+        rebuild_entries()
+
+    def test_catalog_views_query_replica_only(self):
+        urls = [
+            reverse("main:catalog", args=[self.category.slug]),
+            reverse("main:product", args=[Pizza.objects.first().slug]),
+        ]
+        for url in urls:
+            with CaptureQueriesContext(connections["replica1"]) as replica, \
+                    CaptureQueriesContext(connection) as primary:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertTrue(replica.captured_queries)
+            self.assertEqual(primary.captured_queries, [])
+
+
+class AsyncURLConf:
+    """Корневой URLconf как под ASGI: каталог обслуживает async-версия"""
+
+    urlpatterns = [
+        path("", include((
+            [path("catalog/<slug:slug>/", views.catalog_async, name="catalog"), *main_urls.urlpatterns],
+            "main",
+        ))),
+    ]
+
+
+# Async-страницы читают в соединениях других потоков, которые видят только
+# закоммиченные данные, поэтому TransactionTestCase
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        response_cache.reset_backend()
+        home.reset_backend()
+        with transaction.atomic():
+            self.category = Category.objects.create(
+                name="Async", slug="async", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 3)
+        self.factory, self.async_factory = RequestFactory(), AsyncRequestFactory()
+
+    def render_both(self, sync_view, async_view, url, headers=None, **kwargs):
+        sync = sync_view(self.factory.get(url, headers=headers), **kwargs)
+        sync.render()
+        response_cache.reset_backend()
+        concurrent = async_to_sync(async_view)(self.async_factory.get(url, headers=headers), **kwargs)
+        return sync, concurrent
+
+    def test_async_views_render_same_pages(self):
+        slug = {"slug": self.category.slug}
+        url = reverse("main:catalog", kwargs=slug)
+        pizza = Pizza.objects.first()
+        cases = [
+            (views.CatalogView.as_view(), views.catalog_async, url, {}, slug),
+            (views.CatalogView.as_view(), views.catalog_async, url, {"HX-Request": "true"}, slug),
+            (views.CatalogView.as_view(), views.catalog_async, f"{url}?topping={Toppings.objects.first().pk}",
+             {}, slug),
+            (views.ProductDetailView.as_view(), views.product_async,
+             reverse("main:product", args=[pizza.slug]), {}, {"slug": pizza.slug}),
+            (views.IndexView.as_view(), views.index_async, reverse("main:index"), {}, {}),
+        ]
+        for sync_view, async_view, page_url, headers, kwargs in cases:
+            sync, concurrent = self.render_both(sync_view, async_view, page_url, headers, **kwargs)
+            self.assertEqual(concurrent.status_code, 200)
+            self.assertEqual(concurrent.content, sync.content, page_url)
+            self.assertEqual(concurrent["ETag"], sync["ETag"])
+
+    def test_async_catalog_conditional_get_and_404(self):
+        url = reverse("main:catalog", args=[self.category.slug])
+        first = async_to_sync(views.catalog_async)(self.async_factory.get(url), slug=self.category.slug)
+        repeat = async_to_sync(views.catalog_async)(
+            self.async_factory.get(url, headers={"If-None-Match": first["ETag"]}),
+            slug=self.category.slug,
+        )
+        self.assertEqual(repeat.status_code, 304)
+        self.assertIn("HX-Request", repeat["Vary"])
+
+        with self.assertRaises(Http404):
+            async_to_sync(views.catalog_async)(self.async_factory.get("/"), slug="missing")
+
+    @override_settings(REQUEST_METRICS={"SAMPLE_RATE": 1}, ROOT_URLCONF=AsyncURLConf)
+    async def test_async_page_metrics_include_pool_queries(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        url = reverse("main:catalog", args=[self.category.slug])
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db;dur=", response["Server-Timing"])
+
+        # Версии и категория — в потоке sync_to_async, страница и два запроса
+        # фасетов — в потоках пула main.parallel
+        record = metrics.snapshot()["main:catalog"]
+        self.assertEqual(record["queries"]["p50"], 5)
+
+    @override_settings(REQUEST_METRICS={"SAMPLE_RATE": 1}, ROOT_URLCONF=AsyncURLConf)
+    async def test_async_page_reports_template_time(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        # Async-view отдаёт ответ уже отрисованным
+        response = await self.async_client.get(reverse("main:catalog", args=[self.category.slug]))
+
+        record = metrics.snapshot()["main:catalog"]
+        self.assertGreater(record["template"]["p50"], 0)
+        self.assertIn(f'tpl;dur={record["template"]["p50"]}', response["Server-Timing"])
+
+    def test_gather_runs_calls_concurrently(self):
+        # Последовательные вызовы не дождались бы друг друга у барьера
+        barrier = threading.Barrier(3)
+        results = async_to_sync(parallel.gather)(
+            *[partial(lambda n: (barrier.wait(timeout=5), n)[1], n) for n in range(3)]
+        )
+        self.assertEqual(results, [0, 1, 2])
+
+    def test_benchmark_compares_sync_and_async(self):
+        report = compare_async_views([5], requests=2, latency_ms=1, allow_commit=True)
+        self.assertEqual([row["scenario"] for row in report["results"]], ["catalog", "product"])
+        self.assertTrue(all(row["speedup"] > 0 for row in report["results"]))
+        self.assertFalse(Category.objects.filter(slug__startswith="async5-").exists())
+        # Существующее меню осталось на месте
+        self.assertTrue(CatalogEntry.objects.filter(category=self.category).exists())
+
+    def test_compare_refuses_without_confirmation(self):
+        with self.assertRaises(CommandError):
+            call_command("benchmark_menu", "--compare-async", "--sizes", "2", stdout=StringIO())
+        with self.assertRaises(ValueError):
+            compare_async_views([2])
+        self.assertFalse(Category.objects.filter(slug__startswith="async2-").exists())
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "catalog.snapshot")
+        settings_override = override_settings(CATALOG_SNAPSHOT={"PATH": self.path, "TTL": 0})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(snapshot.invalidate)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                name="Снимок", slug="snapshot", image="Categories/test.jpg"
+            )
+            make_menu(self.category, 2)
+
+    def test_products_are_views_equal_to_mapper_dicts(self):
+        products = category_entries(self.category)
+        self.assertTrue(all(isinstance(p, snapshot.ProductView) for p in products))
+        entries, ordering = category_queryset(self.category)
+        self.assertEqual(products, [entry.as_product() for entry in entries.order_by(*ordering)])
+
+        pizza = next(p for p in products if p["type"] == "pizza")
+        self.assertFalse(hasattr(pizza, "__dict__"))
+        self.assertEqual([size["size"] for size in pizza["sizes"]], ["S", "M", "L", "XL"])
+        self.assertCountEqual(pizza["toppings"], ["Моцарелла", "Ветчина"])
+        drink = next(p for p in products if p["type"] == "drink")
+        self.assertEqual(drink["price"], Decimal("100.00"))
+        with self.assertRaises(KeyError):
+            drink["available"]
+
+    def test_menu_change_swaps_file(self):
+        before = snapshot.get()
+        pizza = Pizza.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza.base_price_s = 999
+            pizza.save()
+
+        after = snapshot.get()
+        self.assertIsNot(after, before)
+        self.assertGreater(after.version, before.version)
+        self.assertEqual(entry_by_slug(pizza.slug)["price"], 999)
+        # Уже выданные представления читают свой (старый) файл
+        self.assertEqual(before.product("pizza", pizza.pk)["price"], 400)
+
+    def test_other_worker_remaps_replaced_file(self):
+        worker = snapshot.SnapshotFile()
+        self.assertEqual(worker.get().identity, snapshot.get().identity)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pizza.objects.first().save()
+        self.assertEqual(worker.get().identity, snapshot.get().identity)
+
+    def test_stale_file_falls_back_to_entries_and_rebuilds(self):
+        stale = snapshot.build()
+        pizza = Pizza.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            pizza.base_price_s = 777
+            pizza.save()
+        # Файл, который не заменили после коммита (например, воркер упал)
+        snapshot._replace(self.path, stale)
+
+        product = entry_by_slug(pizza.slug)
+        self.assertNotIsInstance(product, snapshot.ProductView)
+        self.assertEqual(product["price"], 777)
+
+        product = entry_by_slug(pizza.slug)
+        self.assertIsInstance(product, snapshot.ProductView)
+        self.assertEqual(product["price"], 777)
+
+    def background_worker(self):
+        """SnapshotFile вне транзакции: сборка уходит в (подменённый) пул потоков"""
+        worker = snapshot.SnapshotFile()
+        worker._executor = mock.Mock()
+        outside = mock.patch.object(
+            snapshot.transaction, "get_connection", return_value=mock.Mock(in_atomic_block=False)
+        )
+        return worker, outside
+
+    def test_rebuild_requests_are_coalesced(self):
+        worker, outside = self.background_worker()
+        with outside:
+            worker.schedule_rebuild()
+            worker.schedule_rebuild()
+        worker._executor.submit.assert_called_once()
+
+        with mock.patch.object(snapshot.connections, "close_all"):
+            worker._executor.submit.call_args.args[0]()
+        self.assertEqual(worker.get().identity, snapshot.get().identity)
+
+        with outside:
+            worker.schedule_rebuild()
+        self.assertEqual(worker._executor.submit.call_count, 2)
+
+    def test_missing_file_is_not_built_on_request(self):
+        os.remove(self.path)
+        worker, outside = self.background_worker()
+        with outside, self.assertNumQueries(0):
+            self.assertIsNone(worker.get())
+        worker._executor.submit.assert_called_once()
+
+    def test_build_errors_are_logged(self):
+        pizza = Pizza.objects.first()
+        with mock.patch.object(snapshot, "build", side_effect=OSError("disk full")), \
+                self.assertLogs("main.snapshot", "ERROR"), \
+                self.captureOnCommitCallbacks(execute=True):
+            pizza.base_price_s = 555
+            pizza.save()
+        self.assertEqual(entry_by_slug(pizza.slug)["price"], 555)
 
-# Create your tests here.
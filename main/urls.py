@@ -1,10 +1,31 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'main'
 
+# Под ASGI публичные страницы обслуживают async-версии (см. myproject/asgi.py)
+if settings.ASYNC_VIEWS:
+    index_view, catalog_view, product_view = views.index_async, views.catalog_async, views.product_async
+else:
+    index_view = views.IndexView.as_view()
+    catalog_view = views.CatalogView.as_view()
+    product_view = views.ProductDetailView.as_view()
+
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('catalog/<slug:slug>/', views.CatalogView.as_view(), name='catalog'),
-    path('product/<slug:slug>/', views.ProductDetailView.as_view(), name='product')
+    path('', index_view, name='index'),
+    path('catalog/<slug:slug>/', catalog_view, name='catalog'),
+    path('product/<slug:slug>/', product_view, name='product'),
+    path('product/<slug:slug>/builder/', views.pizza_builder, name='builder'),
+    path('builder/quote/', views.builder_quote, name='builder_quote'),
+    path('search/', views.search_api, name='search'),
+    path('cache-stats/', views.response_cache_stats, name='cache_stats'),
+    path('request-metrics/', views.request_metrics, name='request_metrics'),
+    path('cart/', views.cart_detail, name='cart'),
+    path('cart/add/', views.cart_add, name='cart_add'),
+    path('cart/update/', views.cart_update, name='cart_update'),
+    path('cart/remove/', views.cart_remove, name='cart_remove'),
+    path('checkout/', views.checkout, name='checkout'),
+    path('order/<uuid:uuid>/', views.order_status, name='order_status'),
+    path('payments/webhook/', views.stripe_webhook, name='stripe_webhook'),
 ]
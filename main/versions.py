@@ -0,0 +1,149 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .models import CatalogVersion, Category
+
+GLOBAL = "global"
+LAYOUT = "layout"
+# Цены и доступность топпингов (конструктор пиццы); bump увеличивает и global
+TOPPINGS = "toppings"
+
+
+def category_scope(slug):
+    return f"category:{slug}"
+
+
+def bump(scopes):
+    """Увеличивает версии scopes (и global) одним UPDATE, недостающие создаёт"""
+    scopes = set(scopes) | {GLOBAL}
+    now = timezone.now()
+
+    CatalogVersion.objects.filter(scope__in=scopes).update(
+        version=F("version") + 1, updated_at=now
+    )
+    existing = set(
+        CatalogVersion.objects.filter(scope__in=scopes).values_list("scope", flat=True)
+    )
+    CatalogVersion.objects.bulk_create(
+        [
+            CatalogVersion(scope=scope, version=1, updated_at=now)
+            for scope in scopes - existing
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def bump_categories(category_ids):
+    """Версии категорий по их id (витрина знает id, а URL — slug)"""
+    slugs = Category.objects.filter(pk__in=category_ids).values_list("slug", flat=True)
+    bump(category_scope(slug) for slug in slugs)
+
+
+def bump_all():
+    slugs = Category.objects.values_list("slug", flat=True)
+    bump([LAYOUT, *(category_scope(slug) for slug in slugs)])
+
+
+def current(scopes):
+    """{scope: (версия, время изменения)} одним запросом к таблице версий"""
+    rows = CatalogVersion.objects.filter(scope__in=scopes).values_list(
+        "scope", "version", "updated_at"
+    )
+    found = {scope: (version, updated_at) for scope, version, updated_at in rows}
+    return {scope: found.get(scope, (0, None)) for scope in scopes}
+
+
+def for_request(request, scopes):
+    """Версии, прочитанные один раз за запрос (их используют ETag и кэш ответов)"""
+    memo = request.__dict__.setdefault("_catalog_versions", {})
+    missing = [scope for scope in scopes if scope not in memo]
+    if missing:
+        memo.update(current(missing))
+    return {scope: memo[scope] for scope in scopes}
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    django.views.decorators.http.condition для async-view (в Django 4.2 он
+    только синхронный): валидаторы считаются в потоке, 304 — без вызова view
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            def validators():
+                etag = etag_func(request, *args, **kwargs) if etag_func else None
+                stamp = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+                return (
+                    quote_etag(etag) if etag is not None else None,
+                    int(stamp.timestamp()) if stamp else None,
+                )
+
+            etag, last_modified = await sync_to_async(validators)()
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def catalog_condition(name, scopes_func):
+    """
+    ETag/Last-Modified для страниц каталога по версиям меню: повторный запрос
+    с совпавшим валидатором получает 304 без обращения к таблицам товаров.
+    HTMX-фрагмент и полная страница получают разные ETag
+    """
+
+    def versions(request, *args, **kwargs):
+        return for_request(request, scopes_func(request, *args, **kwargs))
+
+    def etag(request, *args, **kwargs):
+        variant = "hx" if request.headers.get("HX-Request") else "full"
+        numbers = ".".join(
+            str(version) for _, (version, _) in sorted(versions(request, *args, **kwargs).items())
+        )
+        return f'"{name}.{variant}.{numbers}"'
+
+    def last_modified(request, *args, **kwargs):
+        stamps = [stamp for _, stamp in versions(request, *args, **kwargs).values() if stamp]
+        return max(stamps) if stamps else None
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            conditional = async_condition(etag, last_modified)(view)
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response = await conditional(request, *args, **kwargs)
+                patch_vary_headers(response, ["HX-Request"])
+                return response
+
+            return async_wrapper
+
+        conditional = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            patch_vary_headers(response, ["HX-Request"])
+            return response
+
+        return wrapper
+
+    return decorator
@@ -1,23 +1,73 @@
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView
-from django.http import Http404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.db import transaction
 from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_http_methods, require_POST
+from django.views.decorators.vary import vary_on_headers
 from .models import *
-from django.db.models import Q
 
-from .mappers import map_combo, map_pizza, map_drink, map_roma_pizza
+from . import parallel
+from .builder import QuoteError, builder_options, quote
+from .cart import Cart
+from .catalog import catalog_facets, catalog_page, catalog_queries, entry_by_slug, search_catalog
+from .facets import facet_result, filter_query, parse_filters, toggle_query
+from .home import get_payload
+from .instrumentation import metrics, timed_render
+from .forms import CartAddForm, CartUpdateForm, CheckoutForm
+from .payments import PaymentError, place_order, record_event, verify_webhook
+from .replicas import replica_reads
+from .response_cache import cached_response, stats
+from .versions import GLOBAL, LAYOUT, async_condition, catalog_condition, category_scope
 
 # Create your views here.
 
 
+def catalog_scopes(request, slug):
+    return [LAYOUT, category_scope(slug)]
+
+
+def product_scopes(request, slug):
+    return [GLOBAL]
+
+
+def catalog_cache(name, scopes_func):
+    """Чтение с реплики, условный GET по версиям меню, затем кэш отрисованного ответа"""
+    return method_decorator(
+        [replica_reads, catalog_condition(name, scopes_func), cached_response(name, scopes_func)],
+        name="dispatch",
+    )
+
+
+def index_etag(request, **kwargs):
+    variant = "hx" if request.headers.get("HX-Request") else "full"
+    return f'"index.{variant}.{get_payload()["etag"]}"'
+
+
+@method_decorator(
+    [replica_reads, condition(etag_func=index_etag), vary_on_headers("HX-Request")],
+    name="dispatch",
+)
 class IndexView(TemplateView):
+    """
+    Главная строится из готового payload (main.home) и не обращается к БД,
+    пока payload в кэше; ETag — хэш payload
+    """
     template_name = "main/base.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["categories"] = Category.objects.all()
-        context['action_gallery'] = ActionGallery.objects.first()
-        print(context)
+        payload = get_payload()
+        context["categories"] = payload["categories"]
+        context["action_gallery"] = payload["gallery"]
         context["current_category"] = None
         return context
 
@@ -28,6 +78,51 @@ class IndexView(TemplateView):
         return TemplateResponse(request, self.template_name, context)
 
 
+def catalog_params(request):
+    """Поиск, сортировка, курсор и фильтры состава из строки запроса каталога"""
+    return {
+        "search": request.GET.get("q", "").strip(),
+        "sort": request.GET.get("sort"),
+        "cursor": request.GET.get("cursor"),
+        "filters": parse_filters(request.GET),
+    }
+
+
+def catalog_context(request, category, params, page, facets, payload):
+    """Контекст страницы каталога; facets=None — без перерисовки фасетов"""
+    products, next_cursor = page
+    context = {
+        "categories": payload["categories"],
+        "current_category": category,
+        "products": products,
+        "next_cursor": next_cursor,
+        "search": params["search"],
+        "sort": params["sort"],
+        "filters": params["filters"],
+        "filter_query": filter_query(params["filters"]),
+    }
+    if facets is not None:
+        query = request.GET
+        for item in facets["groups"]:
+            item["query"] = toggle_query(query, "group", item["value"])
+            item["exclude_query"] = toggle_query(query, "without_group", item["value"])
+        for item in facets["toppings"]:
+            item["query"] = toggle_query(query, "topping", item["id"])
+            item["exclude_query"] = toggle_query(query, "without", item["id"])
+        context["facets"] = facets
+    return context
+
+
+def catalog_template(request):
+    if request.headers.get("HX-Request"):
+        # Подгрузка следующей страницы при бесконечной прокрутке
+        if request.GET.get("cursor"):
+            return "main/product_list.html"
+        return "main/home_content.html"
+    return "main/base.html"
+
+
+@catalog_cache("catalog", catalog_scopes)
 class CatalogView(TemplateView):
     template_name = "main/base.html"
 
@@ -35,86 +130,21 @@ class CatalogView(TemplateView):
         context = super().get_context_data(**kwargs)
 
         category = get_object_or_404(Category, slug=kwargs["slug"])
-        search = self.request.GET.get("q", "").strip()
-        sort = self.request.GET.get("sort")
-
-        products = []
-
-        pizzas = Pizza.objects.filter(category=category, is_active=True)
-
-        if search:
-            pizzas = pizzas.filter(
-                Q(name__icontains=search) |
-                Q(toppings__name__icontains=search)
-            ).distinct()
-
-        if sort == "price_asc":
-            pizzas = pizzas.order_by("base_price_s")
-        elif sort == "price_desc":
-            pizzas = pizzas.order_by("-base_price_s")
-
-        products += [map_pizza(p) for p in pizzas]
-
-        romas = RomaPizza.objects.filter(category=category)
-
-        if search:
-            romas = romas.filter(
-                Q(name__icontains=search) |
-                Q(toppings__name__icontains=search)
-            ).distinct()
-
-        if sort == "price_asc":
-            romas = romas.order_by("price")
-        elif sort == "price_desc":
-            romas = romas.order_by("-price")
-
-        products += [map_roma_pizza(r) for r in romas]
-
-        drinks = DrinkSize.objects.filter(
-            drink__category=category
-        ).select_related("drink")
-
-        if search:
-            drinks = drinks.filter(
-                Q(drink__name__icontains=search) |
-                Q(drink__description__icontains=search)
-            ).distinct()
-
-        if sort == "price_asc":
-            drinks = drinks.order_by("price")
-        elif sort == "price_desc":
-            drinks = drinks.order_by("-price")
-
-        products += [map_drink(d) for d in drinks]
-        combos = Combo.objects.filter(category=category)
-
-        if search:
-            combos = combos.filter(name__icontains=search)
-
-        if sort == "price_asc":
-            combos = combos.order_by("price")
-        elif sort == "price_desc":
-            combos = combos.order_by("-price")
-
-        products += [map_combo(c) for c in combos]
-
-        context.update({
-            "categories": Category.objects.all(),
-            "current_category": category,
-            "products": products,
-            "search": search,
-            "sort": sort,
-        })
+        params = catalog_params(self.request)
+        filters = params["filters"]
+        page = catalog_page(category, params["search"], params["sort"], params["cursor"], **filters)
+        # Следующие страницы бесконечной прокрутки фасеты не перерисовывают
+        facets = None if params["cursor"] else catalog_facets(category, params["search"], **filters)
 
+        context.update(catalog_context(self.request, category, params, page, facets, get_payload()))
         return context
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        if request.headers.get("HX-Request"):
-            return TemplateResponse(request, "main/home_content.html", context)
-        return TemplateResponse(request, self.template_name, context)
+        return TemplateResponse(request, catalog_template(request), context)
 
 
+@catalog_cache("product", product_scopes)
 class ProductDetailView(TemplateView):
     template_name = "main/product_detail.html"
 
@@ -125,27 +155,232 @@ class ProductDetailView(TemplateView):
         product = self.get_product_by_slug(slug)
 
         context["product"] = product
-        context["categories"] = Category.objects.all()
+        context["categories"] = get_payload()["categories"]
         return context
 
     def get_product_by_slug(self, slug):
-        pizza = Pizza.objects.filter(slug=slug, is_active=True).first()
-        if pizza:
-            return map_pizza(pizza)
-
-        roma = RomaPizza.objects.filter(slug=slug).first()
-        if roma:
-            return map_roma_pizza(roma)
-
-        drink = Drink.objects.filter(slug=slug).first()
-        if drink:
-            size = drink.variants.first()
-            if not size:
-                raise Http404()
-            return map_drink(size)
-
-        combo = Combo.objects.filter(slug=slug).first()
-        if combo:
-            return map_combo(combo)
-
-        raise Http404()
\ No newline at end of file
+        product = entry_by_slug(slug)
+        if product is None:
+            raise Http404()
+        return product
+
+
+# Async-версии публичных страниц для ASGI (myproject/asgi.py, settings.ASYNC_VIEWS).
+# Независимые запросы страницы идут одновременно через main.parallel.gather,
+# шаблон отрисовывается в потоке, HTMX-фрагменты и кэш — как у синхронных
+
+
+async def render_async(request, template_name, context):
+    response = TemplateResponse(request, template_name, context)
+    await sync_to_async(timed_render)(request, response)
+    return response
+
+
+@replica_reads
+@async_condition(etag_func=index_etag)
+async def index_async(request):
+    payload = await sync_to_async(get_payload)()
+    context = {
+        "categories": payload["categories"],
+        "action_gallery": payload["gallery"],
+        "current_category": None,
+    }
+    template_name = "main/home_content.html" if request.headers.get("HX-Request") else "main/base.html"
+    response = await render_async(request, template_name, context)
+    patch_vary_headers(response, ["HX-Request"])
+    return response
+
+
+@replica_reads
+@catalog_condition("catalog", catalog_scopes)
+@cached_response("catalog", catalog_scopes)
+async def catalog_async(request, slug):
+    params = catalog_params(request)
+    filters = params["filters"]
+
+    def prepare():
+        category = get_object_or_404(Category, slug=slug)
+        return category, catalog_queries(
+            category, params["search"], params["sort"], params["cursor"], **filters
+        )
+
+    # Страница и три запроса фасетов одновременно: задержка — самый долгий из них
+    category, queries = await sync_to_async(prepare)()
+    payload, page, *facet_parts = await parallel.gather(get_payload, *queries)
+    facets = facet_result(*facet_parts, **filters) if facet_parts else None
+
+    context = catalog_context(request, category, params, page, facets, payload)
+    return await render_async(request, catalog_template(request), context)
+
+
+@replica_reads
+@catalog_condition("product", product_scopes)
+@cached_response("product", product_scopes)
+async def product_async(request, slug):
+    product, payload = await parallel.gather(partial(entry_by_slug, slug), get_payload)
+    if product is None:
+        raise Http404()
+    return await render_async(
+        request,
+        "main/product_detail.html",
+        {"product": product, "categories": payload["categories"]},
+    )
+
+
+@require_GET
+def search_api(request):
+    """
+    JSON-поиск по всей витрине: ?q=, фильтры состава как в каталоге
+    (?topping=, ?group=, ?without=, ?without_group=)
+    """
+    entries = search_catalog(
+        request.GET.get("q", "").strip(), **parse_filters(request.GET)
+    )
+    return JsonResponse({
+        "results": [
+            {
+                "type": entry.product_type,
+                "slug": entry.slug,
+                "name": entry.name,
+                "price": entry.price,
+                "url": reverse("main:product", args=[entry.slug]),
+            }
+            for entry in entries
+        ]
+    })
+
+
+@require_GET
+def pizza_builder(request, slug):
+    """Конструктор: состав, добавки и размер; цена пересчитывается через builder_quote"""
+    options = builder_options(slug)
+    if options is None:
+        raise Http404()
+    return TemplateResponse(request, "main/builder.html", {
+        "pizza": options,
+        "quote": quote(options["id"], options["sizes"][0]["size"]),
+    })
+
+
+def _ids(values):
+    return [int(value) for value in values if value.isdigit()]
+
+
+@transaction.non_atomic_requests
+@require_GET
+def builder_quote(request):
+    """
+    Цена конфигурации из снимка цен в памяти (main.builder): без запросов
+    к БД, пока снимок свежий. HTMX получает фрагмент, остальные — JSON
+    """
+    params = request.GET
+    pizza_id = params.get("id", "")
+    try:
+        result = quote(
+            int(pizza_id) if pizza_id.isdigit() else None,
+            params.get("size"),
+            add=_ids(params.getlist("toppings")),
+            remove=_ids(params.getlist("removed")),
+        )
+    except QuoteError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    if request.headers.get("HX-Request"):
+        return TemplateResponse(request, "main/builder_quote.html", {"quote": result})
+    return JsonResponse(result)
+
+
+@staff_member_required
+def response_cache_stats(request):
+    """Счётчики кэша ответов текущего воркера для мониторинга"""
+    return JsonResponse(stats.snapshot())
+
+
+@staff_member_required
+def request_metrics(request):
+    """Перцентили времени и числа запросов по URL (по выборке текущего воркера)"""
+    return JsonResponse(metrics.snapshot())
+
+
+def render_cart(request, cart):
+    """HTMX получает только фрагмент корзины"""
+    return TemplateResponse(request, "main/cart.html", {"cart": cart})
+
+
+@require_GET
+def cart_detail(request):
+    return render_cart(request, Cart(request))
+
+
+@require_POST
+def cart_add(request):
+    form = CartAddForm(request.POST)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_json(), content_type="application/json")
+
+    cart = Cart(request)
+    data = form.cleaned_data
+    cart.add(
+        data["type"],
+        data["id"],
+        size=data["size"] or None,
+        toppings=[topping.pk for topping in data["toppings"]],
+        quantity=data["quantity"] or 1,
+        removed=[topping.pk for topping in data["removed"]],
+    )
+    return render_cart(request, cart)
+
+
+@require_POST
+def cart_update(request):
+    form = CartUpdateForm(request.POST)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_json(), content_type="application/json")
+
+    cart = Cart(request)
+    cart.update(form.cleaned_data["key"], form.cleaned_data["quantity"])
+    return render_cart(request, cart)
+
+
+@require_POST
+def cart_remove(request):
+    cart = Cart(request)
+    cart.remove(request.POST.get("key", ""))
+    return render_cart(request, cart)
+
+
+@require_http_methods(["GET", "POST"])
+def checkout(request):
+    """Оформление: только снимок корзины и задача в очередь, без вызова платёжки"""
+    cart = Cart(request)
+    form = CheckoutForm(request.POST or None)
+
+    if request.method == "POST" and form.is_valid():
+        order = place_order(cart, **form.cleaned_data)
+        if order is not None:
+            return TemplateResponse(request, "main/order_status.html", {"order": order})
+        form.add_error(None, "Корзина пуста")
+
+    return TemplateResponse(request, "main/checkout.html", {"cart": cart, "form": form})
+
+
+@require_GET
+def order_status(request, uuid):
+    """Фрагмент статуса заказа; HTMX опрашивает его, пока воркер создаёт платёж"""
+    order = get_object_or_404(Order, uuid=uuid)
+    return TemplateResponse(request, "main/order_status.html", {"order": order})
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Только проверка подписи и запись события — обработка в воркере"""
+    try:
+        event = verify_webhook(request.body, request.headers.get("Stripe-Signature"))
+    except PaymentError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    if "id" not in event:
+        return HttpResponseBadRequest("Событие без id")
+    record_event(event)
+    return HttpResponse(status=200)
@@ -38,12 +38,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'main',
 
 ]
 
 MIDDLEWARE = [
+    'main.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,10 +53,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.replicas.PrimaryStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'myproject.urls'
 
+# Async-версии главной, каталога и товара (main.views.*_async); включает myproject/asgi.py
+ASYNC_VIEWS = os.getenv('DJANGO_ASYNC_VIEWS') == '1'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -72,6 +78,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'myproject.wsgi.application'
+ASGI_APPLICATION = 'myproject.asgi.application'
 
 
 # Database
@@ -89,6 +96,18 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения каталога (main.replicas): POSTGRES_REPLICA_HOSTS=replica1,replica2.
+# Локально можно указать тот же сервер, что и основной: POSTGRES_REPLICA_HOSTS=db
+for number, host in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'ATOMIC_REQUESTS': False,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['main.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -129,6 +148,39 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Кэш отрисованных страниц каталога (main/response_cache.py).
+# Для нескольких узлов: BACKEND = 'main.response_cache.DjangoCacheBackend'
+# и CACHES['default'] = django.core.cache.backends.redis.RedisCache
+CATALOG_RESPONSE_CACHE = {
+    'BACKEND': 'main.response_cache.LocalLRUBackend',
+    'OPTIONS': {'max_entries': int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', 1000))},
+    'TIMEOUT': 300,
+}
+
+# Измерение запросов (main.instrumentation): Server-Timing, лог main.metrics, перцентили
+REQUEST_METRICS = {
+    'SAMPLE_RATE': float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', 0.05)),
+    'WINDOW': 1000,
+    'SERVER_TIMING': True,
+}
+
+# Данные главной (main.home): отдаются из общего кэша CACHES['default'],
+# устаревшие пересобираются в фоне
+HOME_PAYLOAD = {
+    'BACKEND': 'main.response_cache.DjangoCacheBackend',
+    'OPTIONS': {'key_prefix': 'home'},
+    'TIMEOUT': 60,
+}
+
+# Производные изображений (main.images): ширины и форматы для srcset
+IMAGE_DERIVATIVES = {
+    'WIDTHS': [320, 640, 960],
+    'FORMATS': ['avif', 'webp', 'jpeg'],
+    'QUALITY': 80,
+    'ASYNC': True,
+}
+
 CART_SESSION_ID = 'cart'
 
 # AUTH_USER_MODEL = 'users.User'
@@ -136,4 +188,35 @@ CART_SESSION_ID = 'cart'
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
-STRIPE_API_VERSION = '2023-10-16'
\ No newline at end of file
+STRIPE_API_VERSION = '2023-10-16'
+# Для локальной разработки и тестов можно указать фейковый платёжный сервер
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+
+# Конструктор пиццы (main.builder): снимок цен в памяти, сверка с версией меню
+PIZZA_BUILDER = {
+    'SNAPSHOT_TTL': 1.0,
+    'MAX_EXTRAS': 15,
+}
+
+# Фильтры состава (main.ingredients): битовый индекс в памяти, сверка с версией меню
+TOPPING_INDEX = {
+    'TTL': 1.0,
+    'MAX_IDS': 500,
+}
+
+# Чтение страниц каталога с реплик (main.replicas) и read-your-writes после записи
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.getenv('REPLICA_STICKY_SECONDS', 5)),
+}
+
+# Параллельные запросы async-страниц (main.parallel): потоки и постоянные соединения на процесс
+PARALLEL_QUERIES = {
+    'WORKERS': int(os.getenv('PARALLEL_QUERY_WORKERS', 8)),
+}
+
+# Снимок каталога (main.snapshot): файл, который все воркеры узла отображают в память
+CATALOG_SNAPSHOT = {
+    'PATH': os.getenv('CATALOG_SNAPSHOT_PATH') or None,
+    'TTL': 1.0,
+}